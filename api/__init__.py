@@ -4,5 +4,6 @@ from .config_router import router as config_router
 from .message_router import router as message_router
 from .test_routes import router as test_router
 from .monitor_roter import router as monitor_roter
+from .metrics_router import router as metrics_router
 
-__all__ = ["iprange_router","provider_router","config_router","message_router","test_router","monitor_roter"]
\ No newline at end of file
+__all__ = ["iprange_router","provider_router","config_router","message_router","test_router","monitor_roter","metrics_router"]
\ No newline at end of file
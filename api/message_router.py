@@ -4,6 +4,7 @@ import logging
 from fastapi import APIRouter, Depends, HTTPException
 from pydantic import BaseModel
 from services.pubsub_service import PubSubService
+from services.progress_hub import SSE_CLIENT_BUFFER, progress_hub
 from sse_starlette.sse import EventSourceResponse
 from dependencies import get_pubsub_service
 from services.logger import setup_logger
@@ -23,7 +24,7 @@ class ProgressUpdate(BaseModel):
 @router.get("/get_latest_message", response_model=ProgressUpdate)
 async def get_latest_message(pubsub_service: PubSubService = Depends(get_pubsub_service)):
     """ 获取最新的进度信息 """
-    latest_message = pubsub_service.get_latest_message()
+    latest_message = await pubsub_service.get_latest_progress()
     if latest_message is None:
         raise HTTPException(status_code=404, detail="No latest message available")
     return latest_message
@@ -50,17 +51,33 @@ import asyncio
 
 
 
+# 新连接的客户端先回放最近的这么多个进度事件
+SSE_REPLAY_COUNT = 20
+
+
 @router.get("/sse/progress")
 async def sse_progress(request: Request, pubsub_service: PubSubService = Depends(get_pubsub_service)):
-    async def event_generator():
-        while True:
-            # 检查客户端是否断开连接
-            if await request.is_disconnected():
-                break
+    """
+    进度事件由本进程的 progress_hub 统一读取后分发，每个客户端一个有界队列，按限速合并推送。
+    事件 id 作为 SSE 的 id 发送，断线重连时浏览器带上 Last-Event-ID，从断开的位置接着读。
+    """
+    last_event_id = request.headers.get("last-event-id")
 
-            # 获取消息
-            message = pubsub_service.get_message()
-            if message is not None:
-                yield {"data": json.dumps(message)}
-
-    return EventSourceResponse(event_generator())
\ No newline at end of file
+    async def event_generator():
+        # 先订阅再读回放，两者之间发布的事件不会丢
+        subscriber = progress_hub.subscribe()
+        try:
+            if last_event_id:
+                replay = await pubsub_service.read_progress(last_event_id, count=SSE_CLIENT_BUFFER)
+            else:
+                replay = await pubsub_service.recent_progress(SSE_REPLAY_COUNT)
+            async for events in progress_hub.stream(subscriber, replay, after=last_event_id):
+                # 检查客户端是否断开连接
+                if await request.is_disconnected():
+                    break
+                for event_id, message in events:
+                    yield {"id": event_id, "data": json.dumps(message)}
+        finally:
+            progress_hub.unsubscribe(subscriber)
+
+    return EventSourceResponse(event_generator())
@@ -0,0 +1,29 @@
+from fastapi import APIRouter, Depends
+from db.db_manager import DBManager
+from dependencies import get_db_manager
+from domain.services.tcping_test_service import better_ip_coalescer
+from services.progress_hub import progress_hub
+
+router = APIRouter()
+
+
+@router.get("/db")
+async def get_db_metrics(db_manager: DBManager = Depends(get_db_manager)):
+    """ 连接池 (使用中/等待/取连接耗时) 和各 SQL 语句的延迟直方图 """
+    return {
+        "pool": db_manager.pool_stats(),
+        "queries": db_manager.query_stats(),
+    }
+
+
+@router.get("/coalescer")
+async def get_coalescer_metrics():
+    """ 最优 IP 查询的请求合并: 窗口内直接复用结果的命中率、合并到进行中查询的比例 """
+    return better_ip_coalescer.stats()
+
+
+
+@router.get("/sse")
+async def get_sse_metrics():
+    """ 本进程的 SSE 客户端数和因消费太慢丢弃的事件数 """
+    return progress_hub.stats()
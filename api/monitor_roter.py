@@ -56,4 +56,12 @@ async def get_best_ip(tcping_test_service: TcpingTestService = Depends(get_tcpin
         return result
     else:
         return {}
-    
\ No newline at end of file
+    
+
+@router.get("/betterips/{provider_id}")
+async def get_better_ips(provider_id: int, ip_type: str = 'ipv4', count: int = 10,
+                         tcping_test_service: TcpingTestService = Depends(get_tcping_test_service)):
+    if ip_type not in ('ipv4', 'ipv6'):
+        raise HTTPException(status_code=400, detail="ip_type must be ipv4 or ipv6")
+    ips = await tcping_test_service.get_ranked_ips(provider_id, ip_type, count)
+    return {"provider_id": provider_id, "ip_type": ip_type, "ips": ips}
@@ -1,6 +1,15 @@
+import asyncio
 import asyncpg
 import logging
+import time
+from contextlib import asynccontextmanager
+from typing import Dict
 from db.dbconfig import DBConfig
+from db.latency_histogram import LatencyHistogram
+from db.query_registry import query_registry
+
+# 未命名的语句按 SQL 文本分别记录延迟，最多这么多条不同的语句，其余的记在 '<other>' 下
+MAX_TRACKED_QUERIES = 200
 
 class DBManager:
     _instance = None
@@ -14,21 +23,100 @@ class DBManager:
         if not hasattr(self, 'initialized'):
             self.config = DBConfig()
             self.pool = None
+            self.query_latency: Dict[str, LatencyHistogram] = {}
+            # SQL 文本 -> 统计用的键 (空白压缩后的文本)，每条语句只计算一次
+            self._query_keys: Dict[str, str] = {}
+            self._connect_lock = asyncio.Lock()
+            # 连接池指标
+            self.in_use = 0
+            self.waiters = 0
+            self.acquire_latency = LatencyHistogram()
             self.initialized = True
 
     async def connect(self):
+        # 多个协程同时触发首次查询时只创建一个连接池
+        async with self._connect_lock:
+            if self.pool is not None:
+                return
+            try:
+                self.pool = await asyncpg.create_pool(
+                    host=self.config.DB_HOST,
+                    port=self.config.DB_PORT,
+                    database=self.config.DB_NAME,
+                    user=self.config.DB_USER,
+                    password=self.config.DB_PASSWORD,
+                    min_size=self.config.DB_POOL_MIN_SIZE,
+                    max_size=self.config.DB_POOL_MAX_SIZE,
+                    max_inactive_connection_lifetime=self.config.DB_MAX_INACTIVE_CONNECTION_LIFETIME,
+                    command_timeout=self.config.DB_COMMAND_TIMEOUT,
+                    statement_cache_size=self.config.DB_STATEMENT_CACHE_SIZE,
+                    init=self._init_connection
+                )
+                logging.info(f"Database connection pool created successfully "
+                             f"(min {self.config.DB_POOL_MIN_SIZE}, max {self.config.DB_POOL_MAX_SIZE}).")
+            except Exception as e:
+                logging.error(f"Error connecting to database: {e}")
+                raise
+
+    async def warmup(self):
+        """
+        启动时调用: 建好连接池 (min_size 个连接随池一起建立)，并对每个空闲连接做一次健康检查，
+        避免第一批测试结果写库时才去建连接。
+        """
+        if self.pool is None:
+            await self.connect()
+        count = self.pool.get_idle_size() or 1
+        connections = [await self.pool.acquire() for _ in range(count)]
         try:
-            self.pool = await asyncpg.create_pool(
-                host=self.config.DB_HOST,
-                port=self.config.DB_PORT,
-                database=self.config.DB_NAME,
-                user=self.config.DB_USER,
-                password=self.config.DB_PASSWORD
+            await asyncio.gather(*(connection.fetchval("SELECT 1") for connection in connections))
+        finally:
+            for connection in connections:
+                await self.pool.release(connection)
+        logging.info(f"Database pool warmed up with {count} connections.")
+
+    @asynccontextmanager
+    async def acquire(self):
+        """从连接池取连接，同时记录使用中的连接数、等待数和取连接耗时"""
+        if self.pool is None:
+            await self.connect()
+        self.waiters += 1
+        start = time.perf_counter()
+        try:
+            connection = await self.pool.acquire()
+        finally:
+            self.waiters -= 1
+        self.acquire_latency.observe((time.perf_counter() - start) * 1000)
+        self.in_use += 1
+        try:
+            yield connection
+        finally:
+            self.in_use -= 1
+            await self.pool.release(connection)
+
+    def pool_stats(self) -> dict:
+        if self.pool is None:
+            return {'connected': False, 'in_use': self.in_use, 'waiters': self.waiters}
+        return {
+            'connected': True,
+            'size': self.pool.get_size(),
+            'idle': self.pool.get_idle_size(),
+            'min_size': self.pool.get_min_size(),
+            'max_size': self.pool.get_max_size(),
+            'in_use': self.in_use,
+            'waiters': self.waiters,
+            'acquire_latency': self.acquire_latency.snapshot(),
+        }
+
+    @staticmethod
+    async def _init_connection(connection):
+        """
+        inet/cidr 列直接以文本形式收发，查询结果里就是 '1.2.3.4' 这样的字符串，
+        不会再被 asyncpg 解码成 ipaddress 对象后又在模型里转换一遍。
+        """
+        for type_name in ('inet', 'cidr'):
+            await connection.set_type_codec(
+                type_name, encoder=str, decoder=str, schema='pg_catalog', format='text'
             )
-            logging.info("Database connection pool created successfully.")
-        except Exception as e:
-            logging.error(f"Error connecting to database: {e}")
-            raise
 
     async def close(self):
         """Close the database connection pool."""
@@ -36,34 +124,57 @@ class DBManager:
             await self.pool.close()
             logging.info("Database connection pool closed.")
 
-    async def fetch(self, query, *args):
-        if self.pool is None:
-            await self.connect()
-        async with self.pool.acquire() as connection:
+    def _query_key(self, query: str, name: str = None) -> str:
+        """命名语句用名字；其余的用空白压缩成一个空格的 SQL 文本，超过上限的记在 '<other>' 下"""
+        if name is not None:
+            return name
+        key = self._query_keys.get(query)
+        if key is None:
+            if len(self._query_keys) >= MAX_TRACKED_QUERIES:
+                return '<other>'
+            key = self._query_keys[query] = ' '.join(query.split())
+        return key
+
+    def _observe_query(self, key: str, start: float):
+        histogram = self.query_latency.get(key)
+        if histogram is None:
+            histogram = self.query_latency.setdefault(key, LatencyHistogram())
+        histogram.observe((time.perf_counter() - start) * 1000)
+
+    def query_stats(self) -> dict:
+        """每条命名语句 / SQL 语句的延迟直方图"""
+        return {query: histogram.snapshot() for query, histogram in sorted(self.query_latency.items())}
+
+    async def fetch(self, query, *args, name=None):
+        async with self.acquire() as connection:
+            start = time.perf_counter()
             try:
-                logging.debug(f"Executing query: {query} with args: {args}")
+                if logging.root.isEnabledFor(logging.DEBUG):
+                    logging.debug(f"Executing query: {query} with args: {args}")
                 return await connection.fetch(query, *args)
             except Exception as e:
                 logging.error(f"Error executing fetch: {e}")
                 logging.error(f"Query: {query}")
                 logging.error(f"Args: {args}")
                 raise
+            finally:
+                self._observe_query(self._query_key(query, name), start)
 
 
-    async def fetchrow(self, query, *args):
-        if self.pool is None:
-            await self.connect()
-        async with self.pool.acquire() as connection:
+    async def fetchrow(self, query, *args, name=None):
+        async with self.acquire() as connection:
+            start = time.perf_counter()
             try:
                 return await connection.fetchrow(query, *args)
             except Exception as e:
                 logging.error(f"Error executing fetchrow: {e}")
                 raise
+            finally:
+                self._observe_query(self._query_key(query, name), start)
 
-    async def execute(self, query, *args, fetch=False):
-        if self.pool is None:
-            await self.connect()
-        async with self.pool.acquire() as connection:
+    async def execute(self, query, *args, fetch=False, name=None):
+        async with self.acquire() as connection:
+            start = time.perf_counter()
             try:
                 if fetch:
                     # 使用 fetch 来获取返回的结果
@@ -74,16 +185,36 @@ class DBManager:
             except Exception as e:
                 logging.error(f"Error executing query: {e}")
                 raise
+            finally:
+                self._observe_query(self._query_key(query, name), start)
 
-    async def execute_many(self, query, args_list):
-        if self.pool is None:
-            await self.connect()
-        async with self.pool.acquire() as connection:
+    async def execute_many(self, query, args_list, name=None):
+        async with self.acquire() as connection:
+            start = time.perf_counter()
             try:
                 return await connection.executemany(query, args_list)
             except Exception as e:
                 logging.error(f"Error executing many: {e}")
                 raise
+            finally:
+                self._observe_query(self._query_key(query, name), start)
+
+    async def fetch_named(self, name, *args):
+        """执行 query_registry 里注册的语句，延迟记在语句名下"""
+        return await self.fetch(query_registry.get(name), *args, name=name)
+
+    async def fetchrow_named(self, name, *args):
+        return await self.fetchrow(query_registry.get(name), *args, name=name)
+
+    async def execute_named(self, name, *args, fetch=False):
+        return await self.execute(query_registry.get(name), *args, fetch=fetch, name=name)
+
+    @asynccontextmanager
+    async def transaction(self):
+        """获取一个连接并在事务中使用，退出时提交，出错时回滚"""
+        async with self.acquire() as connection:
+            async with connection.transaction():
+                yield connection
 
 # 示例用法
 async def main():
@@ -7,8 +7,14 @@ class DBConfig:
         self.DB_NAME = os.getenv("POSTGRES_DB", "netguard")
         self.DB_USER = os.getenv("POSTGRES_USER")
         self.DB_PASSWORD = os.getenv("POSTGRES_PASSWORD")
-        self.DB_POOL_MIN_SIZE = 15
-        self.DB_POOL_MAX_SIZE = 30
+        self.DB_POOL_MIN_SIZE = int(os.getenv("DB_POOL_MIN_SIZE", 15))
+        self.DB_POOL_MAX_SIZE = int(os.getenv("DB_POOL_MAX_SIZE", 30))
+        # 空闲超过这么多秒的连接会被关闭 (0 表示不关闭)
+        self.DB_MAX_INACTIVE_CONNECTION_LIFETIME = float(os.getenv("DB_MAX_INACTIVE_CONNECTION_LIFETIME", 300))
+        # 单条语句的默认超时 (秒)
+        self.DB_COMMAND_TIMEOUT = float(os.getenv("DB_COMMAND_TIMEOUT", 60))
+        # 每个连接缓存的预编译语句数量
+        self.DB_STATEMENT_CACHE_SIZE = int(os.getenv("DB_STATEMENT_CACHE_SIZE", 256))
         
 
 db_config = DBConfig()
\ No newline at end of file
@@ -0,0 +1,31 @@
+--
+-- 把地址列从 character varying(45) 改为 PostgreSQL 原生的 inet 类型，并建立 GiST 索引。
+-- 适用于按旧版 init.sql 建立的数据库；新库直接使用 init.sql 即可。
+--
+-- ip_ranges.cidr 使用 inet 而不是 cidr：用户输入的 "1.2.3.4/24" 这类带主机位的值
+-- 会被 cidr 类型拒绝，而服务层把它当作单个 IP 处理，需要原样保留。
+--
+-- 范围归属查询 ("这个 IP 属于哪个范围/提供商") 走 ip_ranges_span_gist：
+--   WHERE inet_merge(start_ip, end_ip) >>= $1 AND $1 BETWEEN start_ip AND end_ip
+--
+
+BEGIN;
+
+ALTER TABLE public.ips
+    ALTER COLUMN ip_address TYPE inet USING ip_address::inet;
+
+ALTER TABLE public.ip_ranges
+    ALTER COLUMN cidr TYPE inet USING NULLIF(cidr, '')::inet,
+    ALTER COLUMN start_ip TYPE inet USING start_ip::inet,
+    ALTER COLUMN end_ip TYPE inet USING end_ip::inet;
+
+ALTER TABLE public.test_results
+    ALTER COLUMN ip TYPE inet USING ip::inet;
+
+CREATE INDEX IF NOT EXISTS ips_ip_address_gist ON public.ips USING gist (ip_address inet_ops);
+
+CREATE INDEX IF NOT EXISTS ip_ranges_span_gist ON public.ip_ranges USING gist (inet_merge(start_ip, end_ip) inet_ops);
+
+CREATE INDEX IF NOT EXISTS test_results_ip_gist ON public.test_results USING gist (ip inet_ops);
+
+COMMIT;
@@ -0,0 +1,77 @@
+--
+-- 给 test_results 增加预先计算好的综合评分 score，越小越好，并建立支持 Top-N 查询的索引。
+--
+-- score = avg_latency_weight    * avg_latency / 100        (每 100 ms 记 1 分)
+--       + packet_loss_weight    * packet_loss * 10         (每 10% 丢包记 1 分)
+--       - download_speed_weight * download_speed / 10      (每 10 MB/s 减 1 分，测速失败(-1)按 0 计)
+--
+-- 权重取自 config.nsi_option (优先 name = 'default' 的配置)。
+-- 批量写入/更新测试结果的语句自己计算 score (权重作为参数，每批只查一次权重)；
+-- 没有给出 score 的写入 (单条写入、手工修改) 由触发器兜底计算。权重变更时由 config 上的触发器重算全表。
+--
+
+BEGIN;
+
+ALTER TABLE public.test_results ADD COLUMN IF NOT EXISTS score real;
+
+CREATE OR REPLACE FUNCTION public.test_result_score(avg_latency real, packet_loss real, download_speed real, weights jsonb) RETURNS real
+    LANGUAGE sql IMMUTABLE
+    AS $$
+    SELECT (COALESCE((weights->>'avg_latency_weight')::real, 0.3) * avg_latency / 100
+          + COALESCE((weights->>'packet_loss_weight')::real, 0.5) * packet_loss * 10
+          - COALESCE((weights->>'download_speed_weight')::real, 0.2) * GREATEST(COALESCE(download_speed, 0), 0) / 10)::real;
+$$;
+
+CREATE OR REPLACE FUNCTION public.test_result_weights() RETURNS jsonb
+    LANGUAGE sql STABLE
+    AS $$
+    SELECT nsi_option FROM public.config
+    WHERE nsi_option IS NOT NULL
+    ORDER BY (name = 'default') DESC, id
+    LIMIT 1;
+$$;
+
+CREATE OR REPLACE FUNCTION public.set_test_result_score() RETURNS trigger
+    LANGUAGE plpgsql
+    AS $$
+BEGIN
+    NEW.score = public.test_result_score(NEW.avg_latency, NEW.packet_loss, NEW.download_speed, public.test_result_weights());
+    RETURN NEW;
+END;
+$$;
+
+CREATE OR REPLACE FUNCTION public.rescore_test_results() RETURNS trigger
+    LANGUAGE plpgsql
+    AS $$
+DECLARE
+    weights jsonb = public.test_result_weights();
+BEGIN
+    -- 只有生效的那份权重变了才需要重算
+    IF weights IS NOT DISTINCT FROM NEW.nsi_option THEN
+        UPDATE public.test_results
+        SET score = public.test_result_score(avg_latency, packet_loss, download_speed, weights);
+    END IF;
+    RETURN NULL;
+END;
+$$;
+
+-- 兜底触发器: WHEN 条件在调用函数前判断，写入语句已经算好 score 时不会逐行查询权重
+DROP TRIGGER IF EXISTS set_test_result_score ON public.test_results;
+DROP TRIGGER IF EXISTS set_test_result_score_on_insert ON public.test_results;
+CREATE TRIGGER set_test_result_score_on_insert BEFORE INSERT ON public.test_results FOR EACH ROW WHEN (NEW.score IS NULL) EXECUTE FUNCTION public.set_test_result_score();
+DROP TRIGGER IF EXISTS set_test_result_score_on_update ON public.test_results;
+CREATE TRIGGER set_test_result_score_on_update BEFORE UPDATE OF avg_latency, packet_loss, download_speed ON public.test_results FOR EACH ROW WHEN (NEW.score IS NOT DISTINCT FROM OLD.score) EXECUTE FUNCTION public.set_test_result_score();
+
+DROP TRIGGER IF EXISTS rescore_test_results_on_weights ON public.config;
+CREATE TRIGGER rescore_test_results_on_weights AFTER UPDATE OF nsi_option ON public.config FOR EACH ROW WHEN (NEW.nsi_option IS DISTINCT FROM OLD.nsi_option) EXECUTE FUNCTION public.rescore_test_results();
+
+UPDATE public.test_results
+SET score = public.test_result_score(avg_latency, packet_loss, download_speed, public.test_result_weights());
+
+-- Top-N: SELECT ip ... WHERE is_delete = false ORDER BY score LIMIT n 只扫描索引
+CREATE INDEX IF NOT EXISTS test_results_score_idx ON public.test_results USING btree (score, ip) WHERE is_delete = false;
+
+-- get_best_ip: 已测速的结果里按 std_deviation 取第一个
+CREATE INDEX IF NOT EXISTS test_results_speed_tested_std_idx ON public.test_results USING btree (std_deviation) WHERE download_speed IS NOT NULL;
+
+COMMIT;
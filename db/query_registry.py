@@ -0,0 +1,29 @@
+from typing import Dict
+
+
+class QueryRegistry:
+    """
+    热点 SQL 的命名语句表，语句本身仍写在各自的 manager 里，模块加载时注册。
+    同一个名字永远对应同一段 SQL 文本，asyncpg 按文本缓存预编译语句，每个连接上只 prepare 一次。
+    DBManager 按名字执行并按名字记录延迟，不用每次从 SQL 文本算统计用的键。
+    """
+
+    def __init__(self):
+        self._queries: Dict[str, str] = {}
+
+    def register(self, name: str, sql: str) -> str:
+        """注册一条语句并返回它的名字；同名不同 SQL 视为编程错误"""
+        existing = self._queries.get(name)
+        if existing is not None and existing != sql:
+            raise ValueError(f"Query '{name}' is already registered with different SQL")
+        self._queries[name] = sql
+        return name
+
+    def get(self, name: str) -> str:
+        try:
+            return self._queries[name]
+        except KeyError:
+            raise ValueError(f"Unknown query '{name}'") from None
+
+
+query_registry = QueryRegistry()
@@ -2,7 +2,7 @@ from dependency_injector import containers, providers
 from db.db_manager import DBManager
 from domain.managers.config_manager import ConfigManager
 from services.redis_manager import RedisManager
-from domain.services.cache_service import CacheService
+from services.cache import CacheService
 from services.pubsub_service import PubSubService
 from domain.services.ip_address_service import IPAddressService
 from domain.services.config_service import ConfigService
@@ -15,6 +15,7 @@ from domain.managers.ip_range_manager import IPRangeManager
 from domain.managers.provider_manager import ProviderManager
 from services.enqueue_service import EnqueueService
 from domain.managers.monitor_manager import MonitorManager
+from domain.managers.ranking_manager import RankingManager
 from domain.services.monitor_service import MonitorService
 from domain.services.config_service import TcpingConfig
 
@@ -43,7 +44,8 @@ class ApplicationContainer(containers.DeclarativeContainer):
     ip_range_manager = providers.Factory(IPRangeManager, db_manager=db_manager)
     provider_manager = providers.Factory(ProviderManager, db_manager=db_manager)
     pubsub_service = providers.Singleton(PubSubService, redis_manager=redis_manager)
-    cache_service = providers.Factory(CacheService, redis_manager=redis_manager)
+    # L1 缓存在进程内，必须是单例
+    cache_service = providers.Singleton(CacheService, redis_manager=redis_manager)
     
     # 配置管理器
     config_manager = providers.Factory(ConfigManager, db_manager=db_manager)
@@ -52,6 +54,12 @@ class ApplicationContainer(containers.DeclarativeContainer):
     config_service = providers.Factory(ConfigService, config_manager=config_manager)
     
     test_result_manager = providers.Factory(TestResultManager, db_manager=db_manager)
+    # 排行榜在进程内存里维护，必须是单例
+    ranking_manager = providers.Singleton(
+        RankingManager,
+        redis_manager=redis_manager,
+        test_result_manager=test_result_manager
+    )
     provider_service = providers.Factory(
         ProviderService,
         provider_manager=provider_manager,
@@ -67,7 +75,8 @@ class ApplicationContainer(containers.DeclarativeContainer):
     ip_range_service = providers.Factory(
         IPRangeService,
         ip_range_manager=ip_range_manager,
-        pubsub_service=pubsub_service
+        pubsub_service=pubsub_service,
+        ranking_manager=ranking_manager
     )
     enqueue_service = providers.Factory(
         EnqueueService
@@ -77,12 +86,14 @@ class ApplicationContainer(containers.DeclarativeContainer):
         TcpingTestService,
         pubsub_service=pubsub_service,
         test_result_manager=test_result_manager,
+        ranking_manager=ranking_manager,
     )
 
     # 添加 CurlTestService
     curl_test_service = providers.Factory(
         CurlTestService,
-        test_result_manager=test_result_manager
+        test_result_manager=test_result_manager,
+        ranking_manager=ranking_manager
     )
 
     # 添加 MonitorManager 和 MonitorService
@@ -126,9 +137,12 @@ async def get_config_service() -> ConfigService:
 async def get_tcping_test_service() -> TcpingTestService:
     return await container.tcping_test_service()
 
+async def get_ranking_manager() -> RankingManager:
+    return await container.ranking_manager()
+
 # 添加获取 CurlTestService 的辅助函数
-def get_curl_test_service() -> CurlTestService:
-    return container.curl_test_service()
+async def get_curl_test_service() -> CurlTestService:
+    return await container.curl_test_service()
 
 # 添加获取 MonitorManager 和 MonitorService 的辅助函数
 def get_monitor_manager() -> MonitorManager:
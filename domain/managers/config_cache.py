@@ -0,0 +1,103 @@
+import asyncio
+import os
+import time
+from collections import OrderedDict
+from typing import Any, Hashable, Optional
+
+from services.redis_manager import RedisManager
+from services.logger import setup_logger
+
+logger = setup_logger(__name__)
+
+CONFIG_CACHE_TTL = float(os.getenv('CONFIG_CACHE_TTL', 60))
+CONFIG_CACHE_MAX_ENTRIES = 512
+# 配置变更时广播到这个频道，消息内容是 provider_id，"*" 表示清空全部
+CONFIG_INVALIDATION_CHANNEL = "config_invalidation"
+ALL_PROVIDERS = "*"
+# 订阅断开后重试的初始间隔和最大间隔(秒)
+INVALIDATION_RETRY_DELAY = 1
+INVALIDATION_MAX_RETRY_DELAY = 30
+
+
+class ConfigCache:
+    """
+    进程内的配置缓存: TTL + LRU，键的第一项是 provider_id。
+    配置被修改时本进程直接失效，并通过 Redis pub/sub 通知其他进程 (API 和 worker) 失效。
+    """
+
+    def __init__(self, ttl: float = CONFIG_CACHE_TTL, max_entries: int = CONFIG_CACHE_MAX_ENTRIES):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self._entries: "OrderedDict[Hashable, tuple]" = OrderedDict()
+
+    def get(self, key: Hashable) -> Optional[Any]:
+        entry = self._entries.get(key)
+        if entry is None:
+            return None
+        expires_at, value = entry
+        if expires_at < time.monotonic():
+            del self._entries[key]
+            return None
+        self._entries.move_to_end(key)
+        return value
+
+    def set(self, key: Hashable, value: Any):
+        self._entries[key] = (time.monotonic() + self.ttl, value)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+
+    def invalidate(self, provider_id=ALL_PROVIDERS):
+        if provider_id == ALL_PROVIDERS:
+            self._entries.clear()
+            return
+        for key in [key for key in self._entries if key[0] == provider_id]:
+            del self._entries[key]
+
+    async def invalidate_everywhere(self, provider_id=ALL_PROVIDERS):
+        """本进程立即失效，再广播给其他进程"""
+        self.invalidate(provider_id)
+        try:
+            redis = await RedisManager.get_instance()
+            await redis.publish(CONFIG_INVALIDATION_CHANNEL, str(provider_id))
+        except Exception as e:
+            # 广播失败时其他进程最多读到 ttl 秒的旧配置
+            logger.error(f"Failed to publish config invalidation for {provider_id}: {e}")
+
+    async def listen_for_invalidations(self):
+        """
+        常驻任务: 接收其他进程的失效通知，在 FastAPI lifespan 和 arq startup 中启动。
+        连接断开后按指数退避重新订阅；重连成功时清空本进程缓存，断线期间可能错过了通知。
+        """
+        delay = INVALIDATION_RETRY_DELAY
+        reconnecting = False
+        while True:
+            try:
+                redis = await RedisManager.get_instance()
+                pubsub = redis.pubsub()
+                try:
+                    await pubsub.subscribe(CONFIG_INVALIDATION_CHANNEL)
+                    if reconnecting:
+                        self.invalidate(ALL_PROVIDERS)
+                        logger.info("Resubscribed to config invalidations, local config cache cleared")
+                    delay = INVALIDATION_RETRY_DELAY
+                    async for message in pubsub.listen():
+                        if message['type'] != 'message':
+                            continue
+                        data = message['data']
+                        data = data.decode() if isinstance(data, bytes) else data
+                        self.invalidate(ALL_PROVIDERS if data == ALL_PROVIDERS else int(data))
+                finally:
+                    await pubsub.reset()
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.error(f"Config invalidation listener failed: {e}, retrying in {delay}s")
+            # listen() 正常结束也说明连接断了
+            reconnecting = True
+            await asyncio.sleep(delay)
+            delay = min(delay * 2, INVALIDATION_MAX_RETRY_DELAY)
+
+
+# ConfigManager 每次注入都是新实例，缓存必须放在模块级别
+config_cache = ConfigCache()
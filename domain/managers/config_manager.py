@@ -1,7 +1,8 @@
 import json
 from typing import Optional
-from domain.schemas.config import Config, CurlConfig, TcpingConfig  # 假设这些模型在 domain/schemas/config.py 文件中定义
+from domain.schemas.config import Config, CurlConfig, SystemConfig, TcpingConfig  # 假设这些模型在 domain/schemas/config.py 文件中定义
 from db.db_manager import DBManager
+from domain.managers.config_cache import ALL_PROVIDERS, config_cache
 from services.logger import setup_logger
 
 logger = setup_logger(__name__)
@@ -33,7 +34,7 @@ class ConfigManager:
                     'curl': json.loads(result['curl']),
                     'tcping': json.loads(result['tcping']),
                     'nsi_option': json.loads(result['nsi_option']) if result['nsi_option'] else None,
-                    'system_option': json.loads(result['system_option']),
+                    'system_option': json.loads(result['system_option']) if result['system_option'] else None,
                     'monitor': json.loads(result['monitor']),
                     'description': result['description'],
                 }
@@ -70,6 +71,8 @@ class ConfigManager:
                     'provider_id': result['provider_id'],
                     'curl': json.loads(result['curl']),
                     'tcping': json.loads(result['tcping']),
+                    'nsi_option': json.loads(result['nsi_option']) if result['nsi_option'] else None,
+                    'system_option': json.loads(result['system_option']) if result['system_option'] else None,
                     'monitor': json.loads(result['monitor']),
                     'description': result['description']
                 }
@@ -92,11 +95,13 @@ class ConfigManager:
         """
         try:
             id = config.id
+            # 同时取回修改前的 provider_id 和 name，旧的缓存项也要失效
             query = """
                 UPDATE config
                 SET name = $1, curl = $2, tcping = $3, nsi_option = $4, system_option = $5, monitor = $6, description = $7
-                WHERE id = $8
-                RETURNING *;
+                FROM (SELECT id, provider_id, name FROM config WHERE id = $8 FOR UPDATE) AS old
+                WHERE config.id = old.id
+                RETURNING config.*, old.provider_id AS old_provider_id, old.name AS old_name;
             """
             result = await self.db_manager.fetchrow(
                 query,
@@ -111,6 +116,13 @@ class ConfigManager:
             )
             if result:
                 logger.info(f"配置更新成功，ID: {id}")
+                # default 配置是其他提供商的回退值，修改它 (或改掉这个名字) 要清空全部缓存
+                if 'default' in (result['name'], result['old_name']):
+                    await config_cache.invalidate_everywhere(ALL_PROVIDERS)
+                else:
+                    await config_cache.invalidate_everywhere(result['provider_id'])
+                    if result['old_provider_id'] != result['provider_id']:
+                        await config_cache.invalidate_everywhere(result['old_provider_id'])
                 config_data = {
                     'id': result['id'],
                     'name': result['name'],
@@ -138,6 +150,7 @@ class ConfigManager:
         try:
             query = "DELETE FROM config WHERE provider_id = $1;"
             await self.db_manager.execute(query, provider_id)
+            await config_cache.invalidate_everywhere(provider_id)
             logger.info(f"配置删除成功，提供商 ID: {provider_id}")
             return True
         except Exception as e:
@@ -175,6 +188,7 @@ class ConfigManager:
             )
             if isinstance(result, list) and len(result) > 0:
                 result = result[0]  # 假设结果是一个列表，取第一个元素
+            await config_cache.invalidate_everywhere(config.provider_id)
 
             logger.info(f"配置创建成功，名称: {config.name}, 提供商 ID: {config.provider_id}")
             config_data = {
@@ -207,11 +221,16 @@ class ConfigManager:
             return False
         
     async def get_provider_tcping_config(self,provider_id:int)->Optional[TcpingConfig]:
+        cached = config_cache.get((provider_id, 'tcping'))
+        if cached is not None:
+            return cached
         try:
-            query = "SELECT * FROM config WHERE provider_id = $1;"
+            query = "SELECT tcping FROM config WHERE provider_id = $1;"
             result = await self.db_manager.fetchrow(query, provider_id)
             if result:
-                return TcpingConfig.from_dict(json.loads(result['tcping']))
+                config = TcpingConfig.from_dict(json.loads(result['tcping']))
+                config_cache.set((provider_id, 'tcping'), config)
+                return config
             else:
                 logger.warning(f"Configuration not found for provider ID: {provider_id}")
                 return None
@@ -220,14 +239,43 @@ class ConfigManager:
             return None
         
     async def get_provider_curl_config(self,provider_id:int)->Optional[CurlConfig]:
+        cached = config_cache.get((provider_id, 'curl'))
+        if cached is not None:
+            return cached
         try:
-            query = "SELECT * FROM config WHERE provider_id = $1;"
+            query = "SELECT curl FROM config WHERE provider_id = $1;"
             result = await self.db_manager.fetchrow(query, provider_id)
             if result:
-                return CurlConfig.from_record(json.loads(result['curl']))
+                config = CurlConfig.from_record(json.loads(result['curl']))
+                config_cache.set((provider_id, 'curl'), config)
+                return config
             else:
                 logger.warning(f"Configuration not found for provider ID: {provider_id}")
                 return None
         except Exception as e:
             logger.error(f"Error fetching configuration for provider ID {provider_id}: {e}")
-            return None
\ No newline at end of file
+            return None
+
+    async def get_provider_system_config(self, provider_id: int) -> SystemConfig:
+        """
+        获取提供商的 system_option，提供商没有单独配置时使用 default 配置里的值。
+        """
+        cached = config_cache.get((provider_id, 'system'))
+        if cached is not None:
+            return cached
+        try:
+            query = """
+                SELECT COALESCE(
+                    (SELECT system_option FROM config WHERE provider_id = $1),
+                    (SELECT system_option FROM config WHERE name = 'default')
+                ) AS system_option;
+            """
+            result = await self.db_manager.fetchrow(query, provider_id)
+            if result and result['system_option']:
+                config = SystemConfig.from_dict(json.loads(result['system_option']))
+                config_cache.set((provider_id, 'system'), config)
+                return config
+            logger.warning(f"System option not found for provider ID: {provider_id}, using defaults")
+        except Exception as e:
+            logger.error(f"Error fetching system option for provider ID {provider_id}: {e}")
+        return SystemConfig()
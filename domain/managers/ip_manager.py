@@ -1,5 +1,5 @@
 import logging
-from typing import Any, Dict, List, Optional
+from typing import Any, AsyncIterable, Awaitable, Callable, Dict, List, Optional, Tuple
 from db.db_manager import DBManager
 from domain.schemas.ipaddress import IPAddress
 from domain.schemas.test_result import TestResult
@@ -9,8 +9,8 @@ class IpaddressManager:
         self.db_manager = db_manager
 
     async def get_better_ips(self,count: int = 1) -> List[TestResult]:
-        query = "SELECT * FROM test_results ORDER BY avg_latency ASC, packet_loss Desc LIMIT $1"
-        results = await self.db_manager.execute(query,count)
+        query = "SELECT * FROM test_results WHERE is_delete = false ORDER BY score ASC LIMIT $1"
+        results = await self.db_manager.fetch(query,count)
         if results:
              return [TestResult.from_record(record) for record in results]
         return None
@@ -42,6 +42,49 @@ class IpaddressManager:
             print(f"Error during batch insert: {e}")
             return False
         
+    async def replace_provider_ips(self, provider_id: int, batches: AsyncIterable[List[Tuple[str, str, int]]],
+                                   on_batch: Optional[Callable[[int], Awaitable[None]]] = None) -> int:
+        """
+        用 COPY 把 IP 批量导入临时表，再在同一个事务里替换该提供商的全部 IP。
+        提交前其他连接看到的仍然是旧数据。
+        和 IPRangeManager.apply_range_diff 使用同一个提供商咨询锁，两者不会交错修改同一提供商的 ips。
+        :param batches: (ip_address, ip_type, provider_id) 元组的批次，异步产出 (见 batched_in_thread)，
+            事务期间展开地址不占用事件循环
+        :param on_batch: 每导入一个批次后回调，参数为该批次的行数
+        :return: 导入的行数
+        """
+        total = 0
+        try:
+            async with self.db_manager.transaction() as connection:
+                await connection.execute("SELECT pg_advisory_xact_lock(hashtext('ip_ranges'), $1)", provider_id)
+                # 临时表用文本列：inet 走的是文本编解码，binary COPY 不能直接写 inet 列
+                await connection.execute("""
+                    CREATE TEMP TABLE ips_staging (
+                        ip_address character varying(45) NOT NULL,
+                        ip_type character varying(10) NOT NULL,
+                        provider_id integer
+                    ) ON COMMIT DROP
+                """)
+                async for batch in batches:
+                    await connection.copy_records_to_table(
+                        'ips_staging',
+                        records=batch,
+                        columns=['ip_address', 'ip_type', 'provider_id']
+                    )
+                    total += len(batch)
+                    if on_batch is not None:
+                        await on_batch(len(batch))
+
+                await connection.execute("DELETE FROM ips WHERE provider_id = $1", provider_id)
+                await connection.execute("""
+                    INSERT INTO ips (ip_address, ip_type, provider_id)
+                    SELECT ip_address::inet, ip_type, provider_id FROM ips_staging
+                """)
+            return total
+        except Exception as e:
+            logging.error(f"Error during bulk load of provider {provider_id} IPs: {e}")
+            raise
+
     async def delete_ips_by_provider(self, provider_id: int) -> bool:
         """删除指定提供商的所有IP地址"""
         query = """
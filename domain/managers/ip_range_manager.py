@@ -1,10 +1,21 @@
 from typing import Dict, List, Optional
-from domain.schemas.ip_range import IPRange  # 假设 IPRange 模型在 domain/models/ip_range.py 文件中定义
+from domain.schemas.ip_range import IPRange, IPRangeSource  # 假设 IPRange 模型在 domain/models/ip_range.py 文件中定义
 from db.db_manager import DBManager
+from db.query_registry import query_registry
 from services.logger import setup_logger
+from utils.ip_expander import batched_in_thread, int_to_ip, iter_ip_range
+from utils.range_diff import diff_intervals, diff_range_rows, interval_bounds, to_intervals
 
 logger = setup_logger(__name__)
 
+# 按 IP 查所在的范围，走 ip_ranges_span_gist 索引
+IP_RANGE_BY_IP = query_registry.register('ip_ranges.by_ip', """
+SELECT * FROM ip_ranges
+WHERE inet_merge(start_ip, end_ip) >>= $1::inet
+  AND $1::inet BETWEEN start_ip AND end_ip
+LIMIT 1
+""")
+
 class IPRangeManager:
     def __init__(self,db_manager:DBManager):
         self.db_manager = db_manager
@@ -24,6 +35,17 @@ class IPRangeManager:
             return IPRange.from_record(record[0])
         return None
 
+    async def get_ip_range_by_ip(self, ip: str) -> Optional[IPRange]:
+        """查找包含指定 IP 的范围（走 ip_ranges_span_gist 索引）"""
+        try:
+            record = await self.db_manager.fetchrow_named(IP_RANGE_BY_IP, ip)
+            if record:
+                return IPRange.from_record(record)
+            return None
+        except Exception as e:
+            logger.error(f"Failed to get IP range by IP {ip}: {e}")
+            return None
+
     async def save_ip_ranges(self, ip_ranges: List[Dict]) -> bool:
         query = "INSERT INTO ip_ranges (start_ip, end_ip, provider_id, source, cidr) VALUES ($1, $2, $3, $4, $5)"
         values = [(ip_range["start_ip"], ip_range["end_ip"], ip_range["provider_id"], ip_range["source"], ip_range["cidr"]) for ip_range in ip_ranges]
@@ -55,6 +77,11 @@ class IPRangeManager:
             return []
             
     
+    async def has_ip_ranges_from_source(self, provider_id: int, source: IPRangeSource) -> bool:
+        query = "SELECT EXISTS (SELECT 1 FROM ip_ranges WHERE provider_id = $1 AND source = $2) AS found"
+        record = await self.db_manager.fetchrow(query, provider_id, source.value)
+        return bool(record and record['found'])
+
     async def delete_ip_range_by_source(self, provider_id: int, source: str) -> bool:       
         query = "DELETE FROM ip_ranges WHERE provider_id = $1 AND source = $2"
         params = (provider_id, source)
@@ -63,4 +90,83 @@ class IPRangeManager:
             return True
         except Exception as e:
             logger.error(f"Failed to delete IP range: {e}")
-            return False
\ No newline at end of file
+            return False
+
+    async def apply_range_diff(self, provider_id: int, source: IPRangeSource, ip_ranges: List[Dict],
+                               batch_size: int = 2000) -> Optional[List[str]]:
+        """
+        在一个事务里用 ip_ranges 替换提供商某个来源的范围，只应用变化的部分:
+        先对提供商加事务级咨询锁并读取现有范围，同一提供商的并发刷新会排队，不会各自按旧数据求差异；
+        ip_ranges 删除/插入变化的行；ips 删除移除区间内的地址、插入新增区间的地址；
+        test_results 删除移除区间内、且不再被任何范围覆盖的结果。读取失败时直接抛出。
+        :return: 被删除测试结果的 IP，用于更新排行榜；内容没变时返回 None
+        """
+        deleted_results: List[str] = []
+        async with self.db_manager.transaction() as connection:
+            await connection.execute("SELECT pg_advisory_xact_lock(hashtext('ip_ranges'), $1)", provider_id)
+            records = await connection.fetch("SELECT * FROM ip_ranges WHERE provider_id = $1", provider_id)
+            old_ranges = [IPRange.from_record(record) for record in records]
+            same_source = [ip_range for ip_range in old_ranges if ip_range.source == source]
+            other_sources = [ip_range for ip_range in old_ranges if ip_range.source != source]
+
+            delete_ids, insert_rows = diff_range_rows(same_source, ip_ranges)
+            if not delete_ids and not insert_rows:
+                logger.info(f"IP ranges of provider {provider_id} ({source.value}) unchanged")
+                return None
+
+            # 地址层面的差异按整个提供商算: 其他来源仍然覆盖的地址不算移除
+            added, removed = diff_intervals(
+                to_intervals(old_ranges),
+                to_intervals(other_sources) + to_intervals(ip_ranges),
+            )
+            logger.info(f"IP ranges of provider {provider_id} ({source.value}): "
+                        f"-{len(delete_ids)} +{len(insert_rows)} rows, "
+                        f"{len(added)} added and {len(removed)} removed address intervals")
+
+            if delete_ids:
+                await connection.execute("DELETE FROM ip_ranges WHERE id = ANY($1::integer[])", delete_ids)
+            if insert_rows:
+                await connection.executemany(
+                    "INSERT INTO ip_ranges (start_ip, end_ip, provider_id, source, cidr) VALUES ($1, $2, $3, $4, $5)",
+                    [(row["start_ip"], row["end_ip"], row["provider_id"], row["source"], row["cidr"]) for row in insert_rows]
+                )
+
+            if removed:
+                starts, ends = interval_bounds(removed)
+                await connection.execute("""
+                    DELETE FROM ips USING unnest($2::inet[], $3::inet[]) AS r(start_ip, end_ip)
+                    WHERE ips.provider_id = $1 AND ips.ip_address BETWEEN r.start_ip AND r.end_ip
+                """, provider_id, starts, ends)
+                records = await connection.fetch("""
+                    DELETE FROM test_results t USING unnest($1::inet[], $2::inet[]) AS r(start_ip, end_ip)
+                    WHERE t.ip BETWEEN r.start_ip AND r.end_ip
+                      AND NOT EXISTS (
+                        SELECT 1 FROM ip_ranges ir
+                        WHERE inet_merge(ir.start_ip, ir.end_ip) >>= t.ip AND t.ip BETWEEN ir.start_ip AND ir.end_ip
+                      )
+                    RETURNING t.ip
+                """, starts, ends)
+                deleted_results = [record['ip'] for record in records]
+
+            if added:
+                # 同 IpaddressManager.replace_provider_ips: 文本列临时表 + COPY
+                await connection.execute("""
+                    CREATE TEMP TABLE ips_staging (
+                        ip_address character varying(45) NOT NULL,
+                        ip_type character varying(10) NOT NULL,
+                        provider_id integer
+                    ) ON COMMIT DROP
+                """)
+                added_ips = (
+                    (ip, ip_type, provider_id)
+                    for start, end, version in added
+                    for ip, ip_type in iter_ip_range(int_to_ip(start, version), int_to_ip(end, version))
+                )
+                async for batch in batched_in_thread(added_ips, batch_size):
+                    await connection.copy_records_to_table(
+                        'ips_staging', records=batch, columns=['ip_address', 'ip_type', 'provider_id'])
+                await connection.execute("""
+                    INSERT INTO ips (ip_address, ip_type, provider_id)
+                    SELECT ip_address::inet, ip_type, provider_id FROM ips_staging
+                """)
+        return deleted_results
@@ -0,0 +1,158 @@
+import asyncio
+from bisect import bisect_left, insort
+from typing import Dict, Iterable, List, Optional, Tuple
+
+from domain.managers.test_result_manager import TestResultManager
+from services.logger import setup_logger
+
+logger = setup_logger(__name__)
+
+# 每个 (提供商, IP 版本) 保留的最优 IP 数量
+RANKING_SIZE = 1000
+RANKING_KEY = "ranking:{provider_id}:{family}"
+
+RankingKey = Tuple[int, int]
+
+
+def ip_family(ip: str) -> int:
+    return 6 if ':' in ip else 4
+
+
+class RankingBoard:
+    """单个 (提供商, IP 版本) 的 Top-K 榜单，按 score 升序 (越小越好)"""
+
+    def __init__(self, size: int):
+        self.size = size
+        self.scores: Dict[str, float] = {}
+        self.ordered: List[Tuple[float, str]] = []
+
+    def remove(self, ip: str) -> bool:
+        score = self.scores.pop(ip, None)
+        if score is None:
+            return False
+        del self.ordered[bisect_left(self.ordered, (score, ip))]
+        return True
+
+    def update(self, ip: str, score: float) -> Optional[str]:
+        """
+        写入一条结果。返回被挤出榜单的 IP (没有则返回 None)；
+        结果本身进不了榜单时返回它自己。
+        """
+        self.remove(ip)
+        if len(self.ordered) >= self.size and (score, ip) >= self.ordered[-1]:
+            return ip
+        insort(self.ordered, (score, ip))
+        self.scores[ip] = score
+        if len(self.ordered) > self.size:
+            _, evicted = self.ordered.pop()
+            del self.scores[evicted]
+            return evicted
+        return None
+
+    def top(self, count: int) -> List[str]:
+        return [ip for _, ip in self.ordered[:count]]
+
+
+class RankingManager:
+    """
+    每个提供商、每个 IP 版本的最优 IP 排行榜。
+    worker 进程内存里维护 Top-K，同时镜像到 Redis 有序集合 ranking:{provider_id}:{family}，
+    API 进程直接读 Redis，不用查数据库。
+    测试结果写库时增量更新 (见 TestResultWriter 的 on_flush)，冷启动时从 Postgres 重建。
+    """
+
+    def __init__(self, redis_manager, test_result_manager: TestResultManager, size: int = RANKING_SIZE):
+        self.redis_manager = redis_manager
+        self.test_result_manager = test_result_manager
+        self.size = size
+        self.boards: Dict[RankingKey, RankingBoard] = {}
+        self._lock = asyncio.Lock()
+
+    @staticmethod
+    def redis_key(provider_id: int, family: int) -> str:
+        return RANKING_KEY.format(provider_id=provider_id, family=family)
+
+    async def apply(self, records: Iterable) -> None:
+        """
+        应用一批写库结果 (ip, score, provider_id)。
+        score 为空(例如还没测完)或找不到所属提供商的记录会从榜单移除。
+        """
+        records = [record for record in records if record['provider_id'] is not None]
+        # 本进程第一次碰到的榜单先从数据库加载，避免用不完整的榜单挤掉 Redis 里的数据
+        for key in {(record['provider_id'], ip_family(str(record['ip']))) for record in records}:
+            if key not in self.boards:
+                await self.rebuild(*key)
+
+        added: Dict[RankingKey, Dict[str, float]] = {}
+        removed: Dict[RankingKey, List[str]] = {}
+        async with self._lock:
+            for record in records:
+                ip = str(record['ip'])
+                key = (record['provider_id'], ip_family(ip))
+                board = self.boards[key]
+                if record['score'] is None:
+                    if board.remove(ip):
+                        removed.setdefault(key, []).append(ip)
+                    continue
+                evicted = board.update(ip, record['score'])
+                if evicted != ip:
+                    added.setdefault(key, {})[ip] = record['score']
+                if evicted is not None:
+                    removed.setdefault(key, []).append(evicted)
+                    added.get(key, {}).pop(evicted, None)
+
+        for key in added.keys() | removed.keys():
+            await self._mirror(key, added.get(key), removed.get(key))
+
+    async def remove(self, ips: Iterable[str]) -> None:
+        """把已删除的 IP 从所有榜单移除"""
+        removed: Dict[RankingKey, List[str]] = {}
+        async with self._lock:
+            for ip in ips:
+                ip = str(ip)
+                for key, board in self.boards.items():
+                    if board.remove(ip):
+                        removed.setdefault(key, []).append(ip)
+        for key, ips_in_key in removed.items():
+            await self._mirror(key, None, ips_in_key)
+
+    async def rebuild(self, provider_id: int, family: int) -> None:
+        """从 Postgres 重建单个榜单并整体替换 Redis 中的镜像"""
+        records = await self.test_result_manager.get_ranked_results(provider_id, family, self.size)
+        board = RankingBoard(self.size)
+        for record in records:
+            board.update(str(record['ip']), record['score'])
+        async with self._lock:
+            self.boards[(provider_id, family)] = board
+
+        redis_key = self.redis_key(provider_id, family)
+        pipe = self.redis_manager.pipeline(transaction=True)
+        pipe.delete(redis_key)
+        if board.scores:
+            pipe.zadd(redis_key, board.scores)
+        await pipe.execute()
+        logger.info(f"Rebuilt ranking {redis_key} with {len(board.scores)} ips")
+
+    async def rebuild_all(self, provider_ids: Iterable[int]) -> None:
+        for provider_id in provider_ids:
+            for family in (4, 6):
+                await self.rebuild(provider_id, family)
+
+    async def get_top_ips(self, provider_id: int, family: int, count: int) -> List[str]:
+        """读取某个提供商某个 IP 版本的前 count 个 IP，Redis 中没有榜单时先从数据库重建"""
+        redis_key = self.redis_key(provider_id, family)
+        if not await self.redis_manager.exists(redis_key):
+            await self.rebuild(provider_id, family)
+        members = await self.redis_manager.zrange(redis_key, 0, count - 1)
+        return [m.decode() if isinstance(m, bytes) else m for m in members]
+
+    async def _mirror(self, key: RankingKey, added: Optional[Dict[str, float]], removed: Optional[List[str]]) -> None:
+        redis_key = self.redis_key(*key)
+        pipe = self.redis_manager.pipeline(transaction=True)
+        if removed:
+            pipe.zrem(redis_key, *removed)
+        if added:
+            pipe.zadd(redis_key, added)
+        # 其他进程也可能写入同一个榜单，统一截断到 size
+        pipe.zremrangebyrank(redis_key, self.size, -1)
+        await pipe.execute()
@@ -1,7 +1,71 @@
 import logging
-from typing import List, Optional
+from typing import List, Optional, Tuple
 from domain.schemas.test_result import TestResult
 from db.db_manager import DBManager
+from db.query_registry import query_registry
+
+# 写入/更新语句把受影响的行放进 CTE changed(ip, score)，再补上所属提供商，供排行榜增量更新
+CHANGED_WITH_PROVIDER = """
+SELECT c.ip, c.score, r.provider_id
+FROM changed c
+LEFT JOIN LATERAL (
+    SELECT provider_id FROM ip_ranges
+    WHERE inet_merge(start_ip, end_ip) >>= c.ip AND c.ip BETWEEN start_ip AND end_ip
+    LIMIT 1
+) r ON true;
+"""
+
+# 测速写库和排行榜的热点语句，按名字注册，DBManager 按名字执行并统计延迟
+UPSERT_TEST_RESULTS = query_registry.register('test_results.upsert_batch', """
+WITH changed AS (
+    INSERT INTO test_results (ip, avg_latency, std_deviation, packet_loss, score)
+    SELECT ip::inet, avg_latency, std_deviation, packet_loss,
+           public.test_result_score(avg_latency, packet_loss, NULL, $5::jsonb)
+    FROM unnest($1::text[], $2::real[], $3::real[], $4::real[])
+        AS u(ip, avg_latency, std_deviation, packet_loss)
+    ON CONFLICT (ip) DO UPDATE SET
+        avg_latency = EXCLUDED.avg_latency,
+        std_deviation = EXCLUDED.std_deviation,
+        packet_loss = EXCLUDED.packet_loss,
+        score = public.test_result_score(EXCLUDED.avg_latency, EXCLUDED.packet_loss,
+                                         test_results.download_speed, $5::jsonb)
+    RETURNING ip, score
+)
+""" + CHANGED_WITH_PROVIDER)
+
+UPDATE_TEST_SPEEDS = query_registry.register('test_results.update_speeds', """
+WITH changed AS (
+    UPDATE test_results AS t SET
+        download_speed = u.speed,
+        score = public.test_result_score(t.avg_latency, t.packet_loss, u.speed, $3::jsonb)
+    FROM unnest($1::text[], $2::real[]) AS u(ip, speed)
+    WHERE t.ip = u.ip::inet
+    RETURNING t.ip, t.score
+)
+""" + CHANGED_WITH_PROVIDER)
+
+# 只取 ip，查询只扫描 test_results_score_idx (index-only scan)
+TOP_IP_ADDRESSES = query_registry.register('test_results.top_ips', """
+SELECT ip FROM test_results
+WHERE is_delete = false
+ORDER BY score ASC
+LIMIT $1;
+""")
+
+RANKED_BY_PROVIDER = query_registry.register('test_results.ranked_by_provider', """
+SELECT tr.ip, tr.score FROM test_results tr
+WHERE tr.is_delete = false
+  AND tr.score IS NOT NULL
+  AND family(tr.ip) = $2
+  AND EXISTS (
+    SELECT 1 FROM ip_ranges r
+    WHERE r.provider_id = $1
+      AND inet_merge(r.start_ip, r.end_ip) >>= tr.ip
+      AND tr.ip BETWEEN r.start_ip AND r.end_ip
+  )
+ORDER BY tr.score ASC
+LIMIT $3;
+""")
 
 class TestResultManager:
     
@@ -32,8 +96,40 @@ class TestResultManager:
             logging.error(f"Failed to insert/update test result: {e}")
             return False
     
+    async def get_score_weights(self) -> Optional[str]:
+        """当前生效的评分权重 (jsonb 文本)，批量写入时作为参数传给写入语句"""
+        record = await self.db_manage.fetchrow("SELECT public.test_result_weights() AS weights")
+        return record['weights'] if record else None
+
+    async def insert_test_results(self, test_results: List[dict], weights: Optional[str] = None) -> Optional[list]:
+        """
+        一条多行 upsert 写入一批结果，同一批里的 ip 必须唯一。
+        score 在同一条语句里按 weights 计算 (见 get_score_weights)，不走触发器逐行查询权重。
+        返回写入行的 (ip, score, provider_id)，失败返回 None。
+        """
+        if not test_results:
+            return []
+        columns = ([r.get('ip') for r in test_results],
+                   [r.get('avg_latency') for r in test_results],
+                   [r.get('std_deviation') for r in test_results],
+                   [r.get('packet_loss') for r in test_results])
+        try:
+            return await self.db_manage.fetch_named(UPSERT_TEST_RESULTS, *columns, weights)
+        except Exception as e:
+            logging.error(f"Failed to insert/update {len(test_results)} test results: {e}")
+            return None
+
     async def get_test_results_by_provider(self, provider_id: int) -> Optional[list[TestResult]]:
-        query = "SELECT * FROM test_results WHERE provider_id = $1;"
+        # test_results 没有 provider_id，通过 ip_ranges 的 GiST 索引判断 IP 归属
+        query = """
+        SELECT tr.* FROM test_results tr
+        WHERE EXISTS (
+            SELECT 1 FROM ip_ranges r
+            WHERE r.provider_id = $1
+              AND inet_merge(r.start_ip, r.end_ip) >>= tr.ip
+              AND tr.ip BETWEEN r.start_ip AND r.end_ip
+        );
+        """
         results = await self.db_manage.fetch(query, provider_id)
         if results:
             return [TestResult.from_record(record) for record in results]
@@ -66,6 +162,21 @@ class TestResultManager:
             logging.error(f"Failed to update test result: {e}")
             return False
         
+    async def update_test_speeds(self, speeds: List[Tuple[str, float]], weights: Optional[str] = None) -> Optional[list]:
+        """
+        一条语句批量写回多个 IP 的下载速度，score 按 weights 在同一条语句里重算。
+        返回更新行的 (ip, score, provider_id)，失败返回 None
+        """
+        if not speeds:
+            return []
+        ips = [ip for ip, _ in speeds]
+        values = [speed for _, speed in speeds]
+        try:
+            return await self.db_manage.fetch_named(UPDATE_TEST_SPEEDS, ips, values, weights)
+        except Exception as e:
+            logging.error(f"Failed to update test speeds: {e}")
+            return None
+
     async def lock_ip(self,ip:str):
         query = "UPDATE test_results SET is_locked = true WHERE ip = $1;"
         try:
@@ -93,9 +204,11 @@ class TestResultManager:
     
 
     async def get_better_ips(self, count: int = 1) -> Optional[List[TestResult]]:
+        # score 按 nsi_option 权重维护 (见 002_test_result_score.sql)，走 test_results_score_idx
         query = """
-        SELECT * FROM test_results 
-        ORDER BY avg_latency ASC, packet_loss DESC 
+        SELECT * FROM test_results
+        WHERE is_delete = false
+        ORDER BY score ASC
         LIMIT $1;
         """
         results = await self.db_manage.fetch(query, count)
@@ -103,14 +216,25 @@ class TestResultManager:
             return [TestResult.from_record(record) for record in results]
         return None
     
-    async def delete_invalid_ips_by_curl_config(self):
-        query = "DELETE FROM test_results WHERE download_speed = -1"
-        await self.db_manage.execute(query)
+    async def get_better_ip_addresses(self, count: int = 1) -> List[str]:
+        """只取 ip，评分最好的 count 个"""
+        results = await self.db_manage.fetch_named(TOP_IP_ADDRESSES, count)
+        return [record['ip'] for record in results] if results else []
+
+    async def get_ranked_results(self, provider_id: int, family: int, limit: int) -> list:
+        """某个提供商某个 IP 版本下评分最好的 limit 条 (ip, score)，用于重建排行榜"""
+        return await self.db_manage.fetch_named(RANKED_BY_PROVIDER, provider_id, family, limit)
+
+    async def delete_invalid_ips_by_curl_config(self) -> List[str]:
+        query = "DELETE FROM test_results WHERE download_speed = -1 RETURNING ip"
+        records = await self.db_manage.fetch(query)
+        return [record['ip'] for record in records]
         
-    async def delete_invalid_ips_by_tcping_config(self,max_avg_latency,max_loss_packet):
-        query = "DELETE FROM test_results WHERE avg_latency > $1 OR packet_loss > $2"
+    async def delete_invalid_ips_by_tcping_config(self,max_avg_latency,max_loss_packet) -> List[str]:
+        query = "DELETE FROM test_results WHERE avg_latency > $1 OR packet_loss > $2 RETURNING ip"
         try:  
-            await self.db_manage.execute(query,max_avg_latency,max_loss_packet)
+            records = await self.db_manage.fetch(query,max_avg_latency,max_loss_packet)
+            return [record['ip'] for record in records]
         except Exception as e:
             raise e
         
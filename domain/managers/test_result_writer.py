@@ -0,0 +1,85 @@
+import asyncio
+import logging
+from typing import Awaitable, Callable, Dict, Optional
+
+from domain.managers.test_result_manager import TestResultManager
+
+# 缓冲区达到这么多行立即写库
+FLUSH_ROWS = 500
+# 即使没攒够也最多等这么久(毫秒)写一次
+FLUSH_INTERVAL_MS = 200
+
+
+class TestResultWriter:
+    """
+    缓冲写入测试结果: 攒够 flush_rows 行或每隔 flush_interval_ms 毫秒，
+    用一条多行 upsert 写入，避免大规模 TCPing 时每个 IP 一次数据库往返。
+    同一 IP 在一批内只保留最后一次结果。
+
+    用法:
+        async with TestResultWriter(test_result_manager) as writer:
+            await writer.add({...})
+    退出(包括任务被取消)时会把剩余结果写完。
+    on_flush 会收到每批写入行的 (ip, score, provider_id)，用于更新排行榜。
+    评分权重在进入时查询一次，之后每批写入都作为参数传入，由写入语句直接算出 score。
+    """
+
+    def __init__(self, test_result_manager: TestResultManager,
+                 flush_rows: int = FLUSH_ROWS, flush_interval_ms: int = FLUSH_INTERVAL_MS,
+                 on_flush: Optional[Callable[[list], Awaitable[None]]] = None):
+        self.test_result_manager = test_result_manager
+        self.on_flush = on_flush
+        self.flush_rows = flush_rows
+        self.flush_interval = flush_interval_ms / 1000
+        self._buffer: Dict[str, dict] = {}
+        self._lock = asyncio.Lock()
+        self._timer = None
+        self._weights: Optional[str] = None
+        self.written = 0
+
+    async def __aenter__(self):
+        self._weights = await self.test_result_manager.get_score_weights()
+        self._timer = asyncio.create_task(self._flush_periodically())
+        return self
+
+    async def __aexit__(self, exc_type, exc, tb):
+        self._timer.cancel()
+        try:
+            await self._timer
+        except asyncio.CancelledError:
+            pass
+        # 外层任务被取消时也要把缓冲区写完
+        await asyncio.shield(self.flush())
+
+    async def add(self, test_result: dict):
+        self._buffer[test_result['ip']] = test_result
+        if len(self._buffer) >= self.flush_rows:
+            await self.flush()
+
+    async def flush(self):
+        async with self._lock:
+            if not self._buffer:
+                return
+            rows = list(self._buffer.values())
+            self._buffer.clear()
+            try:
+                records = await self.test_result_manager.insert_test_results(rows, self._weights)
+            except asyncio.CancelledError:
+                # 写入被取消时放回缓冲区(不覆盖更新的结果)，由退出时的最后一次 flush 重写；upsert 可以重复执行
+                for row in rows:
+                    self._buffer.setdefault(row['ip'], row)
+                raise
+            if records is None:
+                logging.error(f"Dropped {len(rows)} buffered test results")
+                return
+            self.written += len(rows)
+            if self.on_flush is not None:
+                try:
+                    await self.on_flush(records)
+                except Exception as e:
+                    logging.error(f"on_flush failed for {len(records)} test results: {e}")
+
+    async def _flush_periodically(self):
+        while True:
+            await asyncio.sleep(self.flush_interval)
+            await self.flush()
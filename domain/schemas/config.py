@@ -11,6 +11,12 @@ class CurlConfig(BaseModel):
     ip_v4_enable: bool
     ip_v6_enable: bool
     count: int
+    # 下行链路容量(MB/s)，0 表示每轮测试前用并发短下载估算
+    link_capacity: float = 0
+    # 同时进行的测速下载数上限
+    max_parallel: int = 8
+    # 两阶段模式: 所有 IP 先做短测速，再对前 N 名做完整时长测速；0 表示关闭
+    extended_top: int = 0
 
     def update(self, **kwargs):
         for key, value in kwargs.items():
@@ -28,7 +34,10 @@ class CurlConfig(BaseModel):
             download_url=record['download_url'],
             ip_v4_enable=record['ip_v4_enable'],
             ip_v6_enable=record['ip_v6_enable'],
-            count=record['count']
+            count=record['count'],
+            link_capacity=record.get('link_capacity', 0),
+            max_parallel=record.get('max_parallel', 8),
+            extended_top=record.get('extended_top', 0)
         )
 
 class TcpingConfig(BaseModel):
@@ -66,6 +75,34 @@ class MonitorConfig(BaseModel):
                 setattr(self, key, value)
         return self
 
+class SystemConfig(BaseModel):
+    ipv4_count: Optional[int] = None
+    ipv6_count: Optional[int] = 100000
+    max_candidate: int = 500000
+    FIRST_RUN_FLAG: bool = False
+    return_count_ips: int = 100
+    tcping_semaphore_count: int = 20
+
+    @classmethod
+    def from_dict(cls, data: Optional[dict]):
+        return cls(**(data or {}))
+
+class NsiOption(BaseModel):
+    """综合评分 test_results.score 的权重，见 db/migrations/002_test_result_score.sql"""
+    avg_latency_weight: float = 0.3
+    packet_loss_weight: float = 0.5
+    download_speed_weight: float = 0.2
+
+    def update(self, **kwargs):
+        for key, value in kwargs.items():
+            if hasattr(self, key):
+                setattr(self, key, value)
+        return self
+
+    @classmethod
+    def from_dict(cls, data: Optional[dict]):
+        return cls(**(data or {}))
+
 # 定义 Config 模型
 class Config(BaseModel):
     id: int = Field(..., gt=0)
@@ -74,6 +111,8 @@ class Config(BaseModel):
     curl: CurlConfig
     tcping: TcpingConfig
     monitor: MonitorConfig
+    nsi_option: Optional[NsiOption] = None
+    system_option: Optional[SystemConfig] = None
     description: Optional[str] = Field('', description="Description of the configuration")
 
     model_config = ConfigDict(
@@ -89,6 +128,8 @@ class Config(BaseModel):
             'curl': self.curl.model_dump(),
             'tcping': self.tcping.model_dump(),
             'monitor': self.monitor.model_dump(),
+            'nsi_option': self.nsi_option.model_dump() if self.nsi_option else None,
+            'system_option': self.system_option.model_dump() if self.system_option else None,
             'description': self.description
         }
 
@@ -101,6 +142,8 @@ class Config(BaseModel):
             curl=CurlConfig(**data.get('curl', {})),
             tcping=TcpingConfig(**data.get('tcping', {})),
             monitor=MonitorConfig(**data.get('monitor', {})),
+            nsi_option=NsiOption.from_dict(data['nsi_option']) if data.get('nsi_option') else None,
+            system_option=SystemConfig.from_dict(data['system_option']) if data.get('system_option') else None,
             description=data.get('description')
         )
 
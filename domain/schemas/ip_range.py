@@ -52,53 +52,22 @@ class IPRange(BaseModel):
 
     @classmethod
     def from_record(cls, record: dict) -> 'IPRange':
-        # 打印接收到的数据
-        logger.debug(f"Received data for IPRange: {record}")
-
-        # 确保所有必要的属性都存在
-        required_properties = {'start_ip', 'end_ip', 'provider_id', 'source', 'id'}
-        for prop in required_properties:
-            if prop not in record:
-                logger.error(f"Missing property '{prop}' in record: {record}")
-                raise ValueError(f"Missing property '{prop}'")
-
-        # 验证 id 字段
-        id_value = record.get('id')
-        if id_value is None or not isinstance(id_value, int):
-            logger.error(f"Property 'id' must be an integer in record: {record}")
-            raise ValueError("Property 'id' must be an integer")
-
-        cidr = record.get('cidr')
-
-        start_ip = record.get('start_ip')
-        if start_ip is None or not start_ip.strip():
-            logger.error(f"Property 'start_ip' is None or empty in record: {record}")
-            raise ValueError("Property 'start_ip' is None or empty")
-
-        end_ip = record.get('end_ip')
-        if end_ip is None or not end_ip.strip():
-            logger.error(f"Property 'end_ip' is None or empty in record: {record}")
-            raise ValueError("Property 'end_ip' is None or empty")
-
-        provider_id = record.get('provider_id')
-        if provider_id is None or not isinstance(provider_id, int):
-            logger.error(f"Property 'provider_id' must be an integer in record: {record}")
-            raise ValueError("Property 'provider_id' must be an integer")
-
-        ip_source = record.get('source')
+        """
+        从数据库记录创建 IPRange。
+        start_ip/end_ip/cidr 是 inet 列，数据库已经保证了格式，这里跳过 validate_fields 的重复解析。
+        """
         try:
-            ip_source = IPRangeSource(ip_source)
+            ip_source = IPRangeSource(record['source'])
         except ValueError:
-            logger.error(f"Invalid source '{ip_source}'. Valid sources are: {', '.join(t.value for t in IPRangeSource)}")
-            raise ValueError(f"Invalid source '{ip_source}'. Valid sources are: {', '.join(t.value for t in IPRangeSource)}")
-
-        # 创建 IPRange 对象
-        return cls(
-            id=id_value,
-            cidr=cidr,
-            start_ip=start_ip,
-            end_ip=end_ip,
-            provider_id=provider_id,
+            logger.error(f"Invalid source '{record['source']}'. Valid sources are: {', '.join(t.value for t in IPRangeSource)}")
+            raise ValueError(f"Invalid source '{record['source']}'. Valid sources are: {', '.join(t.value for t in IPRangeSource)}")
+
+        return cls.model_construct(
+            id=record['id'],
+            cidr=record['cidr'],
+            start_ip=record['start_ip'],
+            end_ip=record['end_ip'],
+            provider_id=record['provider_id'],
             source=ip_source
         )
 
@@ -1,7 +1,7 @@
 from datetime import datetime
 import ipaddress
 from typing import Any, Dict, List, Optional
-from pydantic import BaseModel, Field, model_validator, ValidationError
+from pydantic import BaseModel, Field, model_validator
 
 from services.logger import setup_logger
 
@@ -39,6 +39,7 @@ class TestResult(BaseModel):
     test_type: Optional[str] = Field(None, description="Type of the test")
     test_time: Optional[datetime] = Field(None, description="Timestamp of the test")
     is_delete: bool = Field(False, description="Is the result deleted")
+    score: Optional[float] = Field(None, description="Weighted quality score, lower is better")
 
     def to_dict(self) -> dict:
         # 将 TestResult 对象转换为字典，便于与数据库兼容
@@ -54,24 +55,21 @@ class TestResult(BaseModel):
             if prop not in record:
                 raise ValueError(f"Missing property '{prop}'")
 
-        # 创建 TestResult 实例
-        try:
-            return cls(
-                id=record.get('id'),
-                ip=record['ip'],
-                avg_latency=record.get('avg_latency'),
-                std_deviation=record.get('std_deviation'),
-                packet_loss=record.get('packet_loss'),
-                download_speed=record.get('download_speed'),
-                is_locked=record.get('is_locked', False),
-                status=record.get('status'),
-                test_type=record.get('test_type'),
-                test_time=record.get('test_time'),
-                is_delete=record.get('is_delete', False)
-            )
-        except ValidationError as e:
-            logger.error(f"Validation error: {e}")
-            raise
+        # 数据库列的类型已经保证了数据合法(ip 是 inet 列)，不再重复校验
+        return cls.model_construct(
+            id=record.get('id'),
+            ip=record['ip'],
+            avg_latency=record.get('avg_latency'),
+            std_deviation=record.get('std_deviation'),
+            packet_loss=record.get('packet_loss'),
+            download_speed=record.get('download_speed'),
+            is_locked=record.get('is_locked', False),
+            status=record.get('status'),
+            test_type=record.get('test_type'),
+            test_time=record.get('test_time'),
+            is_delete=record.get('is_delete', False),
+            score=record.get('score')
+        )
 
     def __repr__(self):
         return (f"<TestResult(id={self.id}, ip={self.ip}, "
@@ -79,7 +77,7 @@ class TestResult(BaseModel):
                 f"packet_loss={self.packet_loss}, download_speed={self.download_speed}, "
                 f"is_locked={self.is_locked}, status={self.status}, "
                 f"test_type={self.test_type}, test_time={self.test_time}, "
-                f"is_delete={self.is_delete})>")
+                f"is_delete={self.is_delete}, score={self.score})>")
 
 class TestRequest(BaseModel):
     provider_id: Optional[int] = Field(None, description="The ID of the provider (optional)")
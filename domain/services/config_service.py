@@ -2,7 +2,7 @@ import json
 import logging
 from typing import Optional
 from domain.managers.config_manager import ConfigManager
-from domain.schemas.config import Config, ConfigUpdate, ConfigCreate, CurlConfig, TcpingConfig  # 假设 Config、ConfigUpdate 和 ConfigCreate 在 schemas.py 文件中定义
+from domain.schemas.config import Config, ConfigUpdate, ConfigCreate, CurlConfig, SystemConfig, TcpingConfig  # 假设 Config、ConfigUpdate 和 ConfigCreate 在 schemas.py 文件中定义
 
 logger = logging.getLogger(__name__)
 
@@ -153,4 +153,7 @@ class ConfigService:
                 return None
         except Exception as e:
             logger.error(f"Error fetching configuration for provider ID {provider_id}: {e}")
-            return None
\ No newline at end of file
+            return None
+
+    async def get_provider_system_config(self, provider_id: int) -> SystemConfig:
+        return await self.config_manager.get_provider_system_config(provider_id)
@@ -1,5 +1,8 @@
-from typing import List
+import asyncio
+import math
+from typing import List, Optional, Tuple
 from domain.managers.test_result_manager import TestResultManager
+from domain.managers.ranking_manager import RankingManager
 from domain.services.config_service import ConfigService
 from services.enqueue_service import EnqueueService
 from domain.schemas.config import CurlConfig
@@ -7,44 +10,114 @@ from utils.curl import CurlRunner
 from services.logger import setup_logger
 logger = setup_logger(__name__)
 
+# 链路容量、并行上限和两阶段测速的前 N 名都在 CurlConfig 中按提供商配置
+# 并行测速时给每路预留的余量倍数，避免多路互相挤占导致测得的速度偏低
+BANDWIDTH_HEADROOM = 1.5
+CALIBRATION_STREAMS = 4
+CALIBRATION_SECONDS = 3
+# 估算容量时路数加倍后总速度至少增长到这个倍数，才认为链路还没跑满
+CALIBRATION_GROWTH = 1.3
+SHORT_PROBE_SECONDS = 3
+
 
 class CurlTestService:
-    def __init__(self,test_result_manager: TestResultManager):
+    def __init__(self,test_result_manager: TestResultManager, ranking_manager: RankingManager):
         self.test_result_manager = test_result_manager
+        self.ranking_manager = ranking_manager
         
     
     def set_tcping_config(self, curl_config: CurlConfig):
         self.curl_config = curl_config
         
     
-    async def run_curl_test(self, ips: List[str] = None):
+    async def run_curl_test(self, ips: List[str] = None, extended_top: Optional[int] = None):
         """
-        Run the curl test asynchronously by pushing the task to the queue.
+        Run download speed tests for the given IPs, several at a time.
 
         Args:
-            ip_type (str): The type of IP to test (ipv4 or ipv6).
-            provider_id (int): The ID of the provider.
-            user_submitted_ips (List[str], optional): A list of user-submitted IPs. Defaults to None.
+            ips (List[str]): The IPs to test.
+            extended_top (int, optional): If set, every IP gets a short probe first and only
+                the fastest extended_top IPs get a full-length test. Defaults to CurlConfig.extended_top.
         """
         if self.curl_config is None:
             raise Exception("CurlConfig not set. Please set it before running curl test.")
         if self.curl_config.download_url =='' or self.curl_config.download_url == None:
             logger.info(f"run curl test error, download_url is empty")
             return
-        # Create a curl test task
-        for ip in ips:
-            result = await CurlRunner.run(ip, self.curl_config.download_url, self.curl_config.port, self.curl_config.time_out)
-            if result is None:
-                continue
-            ip,speed =  result
-            if self.curl_config.speed > speed:
-                speed = -1  
-            await self.test_result_manager.update_test_speed(ip=ip,speed=speed)
+        url = self.curl_config.download_url
+        if extended_top is None:
+            extended_top = self.curl_config.extended_top
+        capacity = self.curl_config.link_capacity or await self._calibrate_capacity(ips, url)
+        parallel = self._parallel_downloads(capacity)
+        logger.info(f"Curl test for {len(ips)} ips, link capacity {capacity:.2f} MB/s, {parallel} parallel downloads")
+
+        if extended_top and len(ips) > extended_top:
+            probe_timeout = min(SHORT_PROBE_SECONDS, self.curl_config.time_out)
+            probed = await self._measure_all(ips, url, probe_timeout, parallel)
+            probed.sort(key=lambda result: result[1], reverse=True)
+            candidates = [ip for ip, _ in probed[:extended_top]]
+            results = await self._measure_all(candidates, url, self.curl_config.time_out, parallel)
+            speeds = [(ip, speed if speed >= self.curl_config.speed else -1) for ip, speed in results]
+            # 其余 IP 只有短测速结果，受 TCP 慢启动影响偏低: 达到阈值的照写，没达到的不能据此判为失败，不写
+            speeds += [(ip, speed) for ip, speed in probed[extended_top:] if speed >= self.curl_config.speed]
+        else:
+            results = await self._measure_all(ips, url, self.curl_config.time_out, parallel)
+            speeds = [(ip, speed if speed >= self.curl_config.speed else -1) for ip, speed in results]
+
+        weights = await self.test_result_manager.get_score_weights()
+        records = await self.test_result_manager.update_test_speeds(speeds, weights)
+        if records:
+            await self.ranking_manager.apply(records)
+
+    def _parallel_downloads(self, capacity: float) -> int:
+        """并行数 = 链路容量 / (速度阈值 * 余量)，保证每一路都能跑到阈值以上"""
+        max_parallel = max(1, self.curl_config.max_parallel)
+        if self.curl_config.speed <= 0 or math.isinf(capacity):
+            return max_parallel
+        parallel = math.floor(capacity / (self.curl_config.speed * BANDWIDTH_HEADROOM))
+        return max(1, min(parallel, max_parallel))
+
+    async def _calibrate_capacity(self, ips: List[str], url: str) -> float:
+        """
+        估算链路容量: 并发短下载的路数逐轮加倍 (每轮换一批 IP)。
+        单个 IP 被服务端限速时总速度会随路数增长，说明链路还没跑满；
+        总速度不再明显增长时取观察到的最大值。到 max_parallel 路 (或 IP 不够下一轮) 都没跑满时返回 inf，按上限并行。
+        """
+        max_parallel = max(1, self.curl_config.max_parallel)
+        timeout = min(CALIBRATION_SECONDS, self.curl_config.time_out)
+        streams = min(CALIBRATION_STREAMS, max_parallel)
+        best = 0.0
+        offset = 0
+        while offset + streams <= len(ips):
+            samples = ips[offset:offset + streams]
+            offset += streams
+            results = await asyncio.gather(*(
+                CurlRunner.run(ip, url, self.curl_config.port, timeout) for ip in samples
+            ))
+            total = sum(result[1] for result in results if result is not None)
+            if best > 0 and total < best * CALIBRATION_GROWTH:
+                return max(best, total)
+            best = max(best, total)
+            if streams >= max_parallel:
+                break
+            streams = min(streams * 2, max_parallel)
+        return math.inf
+
+    async def _measure_all(self, ips: List[str], url: str, timeout: int, parallel: int) -> List[Tuple[str, float]]:
+        semaphore = asyncio.Semaphore(parallel)
+
+        async def measure(ip) -> Optional[Tuple[str, float]]:
+            async with semaphore:
+                return await CurlRunner.run(ip, url, self.curl_config.port, timeout)
+
+        results = await asyncio.gather(*(measure(ip) for ip in ips))
+        return [result for result in results if result is not None]
     
     async def has_speed_value(self):
         return await self.test_result_manager.has_speed_value()
     
     
     async def delete_invalid_ips_by_curl_option(self):
-        await self.test_result_manager.delete_invalid_ips_by_curl_config()
+        deleted = await self.test_result_manager.delete_invalid_ips_by_curl_config()
+        await self.ranking_manager.remove(deleted)
     
\ No newline at end of file
@@ -1,15 +1,11 @@
-import asyncio
-import ipaddress
-import json
-import random
-from typing import Any, Dict, List
+from typing import Any, List
 from domain.managers.ip_range_manager import IPRangeManager
 from domain.managers.ip_manager import IpaddressManager  # 假设 IPManager 在 domain/managers/ip_manager.py 文件中定义
 from domain.schemas.ipaddress import IPAddress
-from domain.schemas.ip_range import IPRange
 from services.pubsub_service import PubSubService
-from domain.schemas.ipaddress import IPType
+from services.progress_reporter import ProgressReporter
 from services.logger import setup_logger
+from utils.ip_expander import batched_in_thread, expanded_size, iter_provider_ips, sample_ips_from_ranges
 logger = setup_logger(__name__)
 
 class IPAddressService:
@@ -19,8 +15,8 @@ class IPAddressService:
         self.ip_manager = ip_manager
         self.ip_range_manager = ip_range_manager
         self.pubsub_service = pubsub_service
-        self.semaphore = asyncio.Semaphore(10)  # 插入ip时限制并发数为10
         self.max_selected_ips  = 50000
+        self.batch_size = 50000  # 每次 COPY 的行数
  
     
     async def store_provider_ips(self, provider_id: int):
@@ -33,80 +29,21 @@ class IPAddressService:
                 return
             logger.info(f"Found {len(ip_ranges)} IP ranges for provider {provider_id}")
 
-            # 删除旧的IP
-            await self.ip_manager.delete_ips_by_provider(provider_id)
+            # 总的 IP 数量直接由范围大小算出,不需要先展开
+            total_items = sum(expanded_size(ip_range.start_ip, ip_range.end_ip) for ip_range in ip_ranges)
 
-            # 初始化 all_items 列表
-            all_items = []
-            for ip_range in ip_ranges:
-                all_items.extend(self.convert_ip_range_to_ips(ip_range))
+            # 进度在内存中累计，每 500ms 发布一次，结束时发布 completed
+            reporter = ProgressReporter(self.pubsub_service, total_items,
+                                        task=f"store_provider_ips:{provider_id}", message="正在更新IP数据")
 
-            # 总的 IP 数量
-            total_items = len(all_items)
+            async def on_batch(processed_count: int):
+                reporter.advance(processed_count)
 
-            # 初始化已处理的 IP 数量
-            processed_items = 0
-
-            # 分批处理数据
-            batch_size = 2000  # 每次从总数据中取出的批次大小
-
-            # 限制并发任务数量为10
-            semaphore = asyncio.Semaphore(10)
-
-            # 分批处理数据
-            async def process_batch(batch):
-                nonlocal processed_items
-                async with semaphore:
-                    # 批量插入数据库
-                    success = await self.ip_manager.batch_insert_ips(batch)
-                    if not success:
-                        logger.error(f"Failed to insert batch of IPs")
-                        return 0
-                    processed_count = len(batch)
-                    processed_items += processed_count
-
-                    # 更新进度
-                    progress_data = {
-                        "type":"progress",
-                        "status": "inserting",
-                        "progress": round(processed_items / total_items, 2),
-                        "total": total_items,
-                        "processed": processed_items,
-                        "message": "正在更新IP数据"
-                    }
-
-                    # 发布进度更新
-                    try:
-                        await self.pubsub_service.publish("progress_updates", json.dumps(progress_data))
-                    except Exception as e:
-                        logger.error(f"Failed to publish progress update. Error: {e}")
-                    return processed_count
-
-            # 创建并发任务列表
-            tasks = []
-            for i in range(0, len(all_items), batch_size):
-                batch = all_items[i:i + batch_size]
-                task = asyncio.create_task(process_batch(batch))
-                tasks.append(task)
-
-            # 等待所有任务完成
-            await asyncio.gather(*tasks)
-
-            # 任务完成后的结束信息
-            completion_data = {
-                "status": "completed",
-                "progress": 1.0,
-                "total": total_items,
-                "processed": processed_items,
-                "message": "IP数据更新完成"
-            }
-
-            # 发布结束信息
-            try:
-                logger.info("正在发布最后的消息")
-                await self.pubsub_service.publish("progress_updates", json.dumps(completion_data))
-            except Exception as e:
-                logger.error(f"Failed to publish completion update. Error: {e}")
+            # 边展开边 COPY 到临时表，最后在一个事务里替换旧的IP；展开在线程里进行，不阻塞事件循环
+            async with reporter:
+                batches = batched_in_thread(iter_provider_ips(ip_ranges), self.batch_size)
+                await self.ip_manager.replace_provider_ips(provider_id, batches, on_batch=on_batch)
+                reporter.message = "IP数据更新完成"
 
             logger.info("All IP data processing completed.")
 
@@ -115,70 +52,17 @@ class IPAddressService:
             raise
         
 
-    async def insert_batch_task(self, batch: List[Dict[str, str]], processed_items: int, total_items: int):
-        """ 异步插入一批 IP 地址 """
-        # 批量插入数据库
-        await self.ip_manager.batch_insert_ips(batch)
-        
-        # 更新已处理的 IP 数量
-        processed_items += len(batch)
-        
     async def delete_ips_by_provider(self, provider_id: int) -> bool:
         return await self.ip_range_manager.delete_ip_ranges_by_provider(provider_id)
     
 
-    def convert_ip_range_to_ips(self, ip_range: IPRange) -> List[Dict[str, str]]:
-        """将单个 IP 范围转换为带有 IP 类型和 provider_id 的 IP 地址列表"""
-        ip_list = []
-        
-        start_ip = ipaddress.ip_address(ip_range.start_ip)
-        end_ip = ipaddress.ip_address(ip_range.end_ip)
-        provider_id = ip_range.provider_id
-        
-        # 确定 IP 类型
-        ip_type = 'ipv4' if isinstance(start_ip, ipaddress.IPv4Address) else 'ipv6'
-        
-        # 生成 IP 列表
-        if ip_type == 'ipv4':
-            for ip_int in range(int(start_ip), int(end_ip) + 1):
-                ip_str = str(ipaddress.ip_address(ip_int))
-                ip_list.append({
-                    'ip_address': ip_str,
-                    'ip_type': ip_type,
-                    'provider_id': provider_id
-                })
-        elif ip_type == 'ipv6':
-            total_ips = int(end_ip) - int(start_ip) + 1
-            if total_ips > 500000:
-                # IPv6 数据量过大，从每一个段上随机选择 50 万个 IP 地址
-                random_ips = [random.randint(int(start_ip), int(end_ip)) for _ in range(500000)]
-                for ip_int in random_ips:
-                    ip_str = str(ipaddress.ip_address(ip_int))
-                    ip_list.append({
-                        'ip_address': ip_str,
-                        'ip_type': ip_type,
-                        'provider_id': provider_id
-                    })
-            else:
-                # 如果总数小于 50 万，则生成全部 IP 地址
-                for ip_int in range(int(start_ip), int(end_ip) + 1):
-                    ip_str = str(ipaddress.ip_address(ip_int))
-                    ip_list.append({
-                        'ip_address': ip_str,
-                        'ip_type': ip_type,
-                        'provider_id': provider_id
-                    })
-
-        return ip_list
-    
-    
-
     async def get_provier_ips(self, provider_id: int) -> List[str]:
-        results = await self.ip_manager.get_ips_by_provider(provider_id, IPType.IPV4.value, count=self.max_selected_ips,randomize=True)
-        logger.info(results)
-        if results:
-            return [result.ip_address for result in results]
-        else:
-            return[]
+        """直接从 ip_ranges 按范围大小加权随机抽取候选 IPv4，不再扫描 ips 表"""
+        ip_ranges = await self.ip_range_manager.get_ip_ranges_by_provider_id(provider_id)
+        ipv4_ranges = [ip_range for ip_range in ip_ranges if ':' not in ip_range.start_ip]
+        results = sample_ips_from_ranges(ipv4_ranges, self.max_selected_ips)
+        logger.info(f"Sampled {len(results)} candidate IPs for provider {provider_id}")
+        return results
+
     # async def get_provider_ips_v6(self, provider_id: int) -> List[IPAddress]:
     #     return await self.ip_manager.get_ips_by_provider(provider_id, IPType.IPV6.value, count=self.max_selected_ips,randomize=True)
@@ -1,19 +1,20 @@
-import asyncio
 import ipaddress
 import logging
-from typing import Dict, List, Optional, Tuple
-import aiohttp
+from typing import Dict, List, Optional
 from domain.managers.ip_range_manager import IPRangeManager
+from domain.managers.ranking_manager import RankingManager
 from domain.schemas.ip_range import IPRange, IPRangeSource, IPRangesByProviderResponse, IPRangeCreateFromAPI,IPRangeCreateFromCidrs, IPRangeCreateFromCustomRange,IPRangeCreateFromSingleIps,IPRangeSource
 from services.logger import setup_logger
+from services.provider_feed_fetcher import provider_feed_fetcher
 from services.pubsub_service import PubSubService
 
 logger = setup_logger(__name__)
 
 class IPRangeService:
-    def __init__(self,ip_range_manager: IPRangeManager,pubsub_service: PubSubService):
+    def __init__(self,ip_range_manager: IPRangeManager,pubsub_service: PubSubService,ranking_manager: RankingManager):
         self.ip_range_manager = ip_range_manager
         self.pubsub_service =   pubsub_service
+        self.ranking_manager = ranking_manager
 
     async def get_ip_ranges(self) -> List[IPRange]:
         return await self.ip_range_manager.get_ip_ranges()
@@ -54,13 +55,17 @@ class IPRangeService:
             bool: 创建是否成功
         """
 
-        try:
-            ipv4_ranges, ipv6_ranges = await self.fetch_ip_ranges_from_api(create_ip_range_data.api_url)
-        except Exception as e:
-            raise e
+        # 条件请求 + 哈希比较，上游没有变化时直接返回，不解析也不比较范围
+        # 提供商还没有 API 来源的范围 (首次添加或被手动删除) 时总是重新拉取
+        provider_id = create_ip_range_data.provider_id
+        force = not await self.ip_range_manager.has_ip_ranges_from_source(provider_id, IPRangeSource.API)
+        payload = await provider_feed_fetcher.fetch(provider_id, create_ip_range_data.api_url, force=force)
+        if payload is None:
+            logger.info(f"IP ranges from {create_ip_range_data.api_url} unchanged")
+            return True
 
         # 合并 IPv4 和 IPv6 的 CIDR 范围
-        cidrs = ipv4_ranges + ipv6_ranges
+        cidrs = payload.ipv4_cidrs + payload.ipv6_cidrs
 
         # 计算每个 CIDR 的 start_ip 和 end_ip
         ip_ranges = []
@@ -80,16 +85,15 @@ class IPRangeService:
                 "start_ip": start_ip,
                 "end_ip": end_ip,
                 "provider_id": create_ip_range_data.provider_id,
-                
-                "source": IPRangeSource.CIDRS.value,
+                "source": IPRangeSource.API.value,
                 "cidr": cidr
             }
             ip_ranges.append(ip_range)
 
         logger.info(f"Creating IP ranges from API: {ip_ranges}")
         try:
-            await self.ip_range_manager.delete_ip_range_by_source(create_ip_range_data.provider_id, IPRangeSource.API.value)
-            saved_ip_ranges = await self.ip_range_manager.save_ip_ranges(ip_ranges)
+            await self.replace_source_ranges(create_ip_range_data.provider_id, IPRangeSource.API, ip_ranges)
+            await provider_feed_fetcher.mark_applied(payload)
             return True
         except Exception as e:
             logger.error(f"Failed to create IP ranges from API: {e}")
@@ -133,10 +137,7 @@ class IPRangeService:
 
         logger.info(f"Creating IP ranges from CIDRs: {ip_ranges}")
         try:
-            # 保存到数据库并获取生成的 id
-            await self.ip_range_manager.delete_ip_range_by_source(ip_range_data.provider_id, IPRangeSource.CIDRS.value)
-            saved_ip_ranges = await self.ip_range_manager.save_ip_ranges(ip_ranges)
-            return saved_ip_ranges
+            return await self.replace_source_ranges(ip_range_data.provider_id, IPRangeSource.CIDRS, ip_ranges)
         except Exception as e:
             logger.error(f"Failed to create IP ranges from CIDRs: {e}")
             raise Exception("Failed to create IP ranges from CIDRs")
@@ -168,8 +169,7 @@ class IPRangeService:
 
         logger.info(f"Creating IP ranges from single IPs: {ip_ranges}")
         try:
-            await self.ip_range_manager.delete_ip_range_by_source(iprange_data.provider_id, IPRangeSource.SINGLE.value)
-            return await self.ip_range_manager.save_ip_ranges(ip_ranges)
+            return await self.replace_source_ranges(iprange_data.provider_id, IPRangeSource.SINGLE, ip_ranges)
         except Exception as e:
             logger.error(f"Failed to create IP ranges from single IPs: {e}")
             raise ValueError("Failed to create IP ranges from single IPs")
@@ -202,9 +202,7 @@ class IPRangeService:
 
             logger.info(f"Creating IP ranges from custom ranges: {ip_ranges}")
             try:
-                # 只能先删除,再插入了
-                await self.ip_range_manager.delete_ip_range_by_source(ip_range_data.provider_id, IPRangeSource.CUSTOM.value)
-                return await self.ip_range_manager.save_ip_ranges(ip_ranges)
+                return await self.replace_source_ranges(ip_range_data.provider_id, IPRangeSource.CUSTOM, ip_ranges)
             except Exception as e:
                 logger.error(f"Failed to create IP ranges from custom ranges: {e}")
                 raise e
@@ -213,74 +211,18 @@ class IPRangeService:
             raise e
 
     
-    async def fetch_ip_ranges_from_api(self, url: str) -> Tuple[List[str], List[str]]:
+    async def replace_source_ranges(self, provider_id: int, source: IPRangeSource, ip_ranges: List[Dict]) -> bool:
         """
-        通过 API 获取 IP 范围
-
-        Args:
-            url (str): API 的 URL
-
-        Returns:
-            Tuple[List[str], List[str]]: A tuple containing two lists, one for IPv4 CIDRs and one for IPv6 CIDRs.
-
-        Raises:
-            ValueError: 如果 API 请求失败或不支持的提供商名称
+        用 ip_ranges 替换提供商某个来源的范围，只写变化的部分:
+        行按 (起始, 结束) 比较，地址按区间运算求出新增/移除的部分，
+        再只对 ip_ranges / ips / test_results 应用差异。内容没变时不写数据库。
+        读取、求差异和写入都在 IPRangeManager.apply_range_diff 的同一个事务里，并按提供商加锁。
         """
-        max_retries = 3
-        retry_delay = 5  # 重试间隔时间（秒）
-        headers = {
-            'Content-Type': 'application/json'
-        }
-        for attempt in range(max_retries):
-            try:
-                async with aiohttp.ClientSession() as session:
-                    async with session.get(url,headers=headers) as resp:
-                        if resp.status != 200:
-                            raise ValueError(f"Failed to fetch data from API: {resp.status}")
-                        data = await resp.json()
-
-                # 判断 URL 是否包含 cloudflare
-                if 'cloudflare' in url:
-                    if not data.get('success'):
-                        raise ValueError("API request failed for Cloudflare")
-                    result = data.get('result', {})
-                    ipv4_cidrs = result.get('ipv4_cidrs', [])
-                    ipv6_cidrs = result.get('ipv6_cidrs', [])
-                    return ipv4_cidrs, ipv6_cidrs
-
-                # 检查 URL 是否包含 'cloudfront' 或 'amazonaws'
-                if 'cloudfront' in url or 'amazonaws' in url:
-                    filtered_prefixes = []
-                    for prefix in data.get('prefixes', []):
-                        region = prefix.get('region')
-                        service = prefix.get('service')
-                        if region == 'GLOBAL' and service == 'CLOUDFRONT':
-                            filtered_prefixes.append(prefix)
-
-                    # 提取 IPv4 和 IPv6 CIDR 前缀
-                    ipv4_cidrs = []
-                    ipv6_cidrs = []
-
-                    for prefix in filtered_prefixes:
-                        if 'ip_prefix' in prefix:
-                            ipv4_cidrs.append(prefix['ip_prefix'])
-                        if 'ipv6_prefix' in prefix:
-                            logger.info(f"有ipv6: {prefix['ipv6_prefix']}")
-                            ipv6_cidrs.append(prefix['ipv6_prefix'])
-
-                    return ipv4_cidrs, ipv6_cidrs
+        deleted_results = await self.ip_range_manager.apply_range_diff(provider_id, source, ip_ranges)
+        if deleted_results:
+            await self.ranking_manager.remove(deleted_results)
+        return True
 
-            except aiohttp.ClientError as e:
-                logger.warning(f"Attempt {attempt + 1}/{max_retries} failed: {e}")
-                if attempt < max_retries - 1:
-                    await asyncio.sleep(retry_delay)
-                else:
-                    raise ValueError(f"Failed to fetch data from API after {max_retries} attempts: {e}")
-            except ValueError as e:
-                logger.error(f"Failed to fetch data from API: {e}")
-                raise
-            
-            
     async def delete_ip_range_by_id(self, ip_range_id: int):
         return await self.ip_range_manager.delete_ip_range_by_id(ip_range_id)
     
@@ -1,4 +1,5 @@
 # tasks.py
+import asyncio
 from typing import List
 import arq
 from dependencies import get_ip_range_service,get_ip_address_service, get_tcping_test_service,get_config_service,get_curl_test_service,get_provider_service
@@ -7,6 +8,8 @@ from domain.schemas.test_result import TestResult
 from domain.services.config_service import ConfigService
 from domain.services.curl_test_service import CurlTestService
 from domain.services.tcping_test_service import TcpingTestService
+from domain.services.tcping_shard_coordinator import TCPING_SHARD_TIMEOUT, TcpingShardCoordinator
+from services.enqueue_service import JOB_MAX_TRIES, detach_from_group
 from services.logger import setup_logger
 
 # 配置日志
@@ -43,6 +46,7 @@ async def store_provider_ips(ctx, *args, **kwargs):
     await ip_address_service.store_provider_ips(provider_id)
 
 async def tcping_test(ctx,provider_id: int = None):
+    """把提供商的候选 IP 拆成分片任务 (tcping_shard)，由多个 worker 并行测试"""
     if provider_id is None:
         logger.info(f"从数据库中获取id")
         provier_service = await get_provider_service()
@@ -50,12 +54,44 @@ async def tcping_test(ctx,provider_id: int = None):
         provider_id = await provier_service.get_provider_id()
     config_service:ConfigService = await get_config_service()
     tcping_config = await config_service.get_provider_tcping_config(provider_id=provider_id)
-    test_service = await get_tcping_test_service()
-    await test_service.set_tcping_config(tcping_config)
     ipaddress_service = await get_ip_address_service()
     ips =await ipaddress_service.get_provier_ips(provider_id=provider_id)
     if ips:
-        await test_service.run_tcping_test(ips=ips)
+        # 这一轮所属的任务组等所有分片完成后再继续，而不是在本任务结束时
+        group_name = await detach_from_group(ctx['redis'], ctx['job_id'])
+        coordinator = TcpingShardCoordinator(ctx['redis'])
+        return await coordinator.start_run(provider_id, ips, tcping_config.count, group_name)
+
+
+async def tcping_shard(ctx, run_id: str, provider_id: int, ips: List[str]):
+    coordinator = TcpingShardCoordinator(ctx['redis'])
+    good = 0
+    try:
+        target = await coordinator.remaining_target(run_id)
+        if target > 0:
+            config_service:ConfigService = await get_config_service()
+            tcping_config = await config_service.get_provider_tcping_config(provider_id=provider_id)
+            system_config = await config_service.get_provider_system_config(provider_id=provider_id)
+            test_service = await get_tcping_test_service()
+            await test_service.set_tcping_config(tcping_config)
+            await test_service.set_system_config(system_config)
+            async with asyncio.timeout(TCPING_SHARD_TIMEOUT):
+                good = await test_service.run_tcping_test(ips=ips, target=target, task=f"tcping:{run_id}:{ctx['job_id']}")
+    except asyncio.CancelledError:
+        # worker 关闭时 arq 会重新执行这个分片，由那一次汇总；已经是最后一次尝试时不会再执行，按失败汇总
+        if ctx['job_try'] >= JOB_MAX_TRIES:
+            await ctx['redis'].enqueue_job('tcping_reduce', run_id, ctx['job_id'], 0, True)
+        raise
+    except Exception:
+        # 普通异常 (包括超时) arq 不会重试，按失败汇总，否则这一轮永远等不到这个分片
+        await ctx['redis'].enqueue_job('tcping_reduce', run_id, ctx['job_id'], 0, True)
+        raise
+    await ctx['redis'].enqueue_job('tcping_reduce', run_id, ctx['job_id'], good)
+    return good
+
+
+async def tcping_reduce(ctx, run_id: str, shard_job_id: str, good: int, failed: bool = False):
+    await TcpingShardCoordinator(ctx['redis']).reduce(run_id, shard_job_id, good, failed)
     
     
 async def tcping_test_monitor_list(ctx,provider_id: int = None):
@@ -66,8 +102,10 @@ async def tcping_test_monitor_list(ctx,provider_id: int = None):
         provider_id = await provier_service.get_provider_id()
     config_service = await get_config_service()
     tcping_config :TcpingConfig =await config_service.get_provider_tcping_config(provider_id=provider_id)
+    system_config = await config_service.get_provider_system_config(provider_id=provider_id)
     tcping_test_service:TcpingTestService =await get_tcping_test_service()
     await tcping_test_service.set_tcping_config(tcping_config)
+    await tcping_test_service.set_system_config(system_config)
     ips = await tcping_test_service.get_better_ips(tcping_config.count)    
     for ip in ips:
         # 逻辑有问题,先删除他们
@@ -96,7 +134,7 @@ async def curl_test(ctx,provider_id: int = None):
         provider_id = await provier_service.get_provider_id()
     config_service:ConfigService =await get_config_service()
     tcping_test_service:TcpingTestService =await get_tcping_test_service()
-    curl_test_service:CurlTestService = get_curl_test_service()
+    curl_test_service:CurlTestService = await get_curl_test_service()
     config =await config_service.get_provider_curl_config(provider_id=provider_id)
     ips =await tcping_test_service.get_better_ips(count=config.count)
     curl_test_service.set_tcping_config(curl_config=config)
@@ -112,5 +150,7 @@ def get_all_functions():
         store_provider_ips,
         curl_test,
         tcping_test,
+        tcping_shard,
+        tcping_reduce,
         tcping_test_monitor_list
     ]
\ No newline at end of file
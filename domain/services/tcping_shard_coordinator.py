@@ -0,0 +1,127 @@
+import json
+import os
+import uuid
+from typing import List, Optional
+
+from arq.connections import ArqRedis
+
+from services.enqueue_service import enqueue_next_in_group
+from services.logger import setup_logger
+
+logger = setup_logger(__name__)
+
+# 每个分片任务测试的 IP 数
+TCPING_SHARD_SIZE = int(os.getenv('TCPING_SHARD_SIZE', 2000))
+# 同时在队列中/执行中的分片数，多个 worker 容器各自领取
+TCPING_SHARD_PARALLEL = int(os.getenv('TCPING_SHARD_PARALLEL', 4))
+# 单个分片最多执行多久(秒)，要小于 worker 的 job_timeout: 超时在分片内部抛出，
+# 和 worker 关闭造成的取消区分开，前者按失败汇总，后者留给 arq 重试
+TCPING_SHARD_TIMEOUT = int(os.getenv('TCPING_SHARD_TIMEOUT', 1100))
+# 一轮测试的状态在 Redis 中保留的时间(秒)
+RUN_STATE_TTL = 24 * 3600
+
+RUN_KEY = "tcping_run:{run_id}"                 # hash: provider_id, target, good, inflight, shards, done, failed, group
+RUN_SHARDS_KEY = "tcping_run:{run_id}:shards"   # 还没派发的分片，每项是 JSON 数组
+RUN_REDUCED_KEY = "tcping_run:{run_id}:reduced" # hash: 已经汇总过的分片 job_id -> 合格数或 "failed"
+
+
+class TcpingShardCoordinator:
+    """
+    把一个提供商的 TCPing 测试拆成固定大小的分片，每个分片是一个独立的 arq 任务，
+    多个 worker 可以同时执行同一轮测试。
+    分片结束后入队 tcping_reduce 汇总合格 IP 数：还没达到目标就派发下一个分片，
+    达到目标后不再派发；最后一个分片汇总完时推进任务组 (如果这一轮属于某个组)。
+    状态都在 Redis 中 (RUN_KEY)，计数用 HINCRBY，多个 reducer 并发执行也是安全的。
+    """
+
+    def __init__(self, redis: ArqRedis, shard_size: int = TCPING_SHARD_SIZE, parallel: int = TCPING_SHARD_PARALLEL):
+        self.redis = redis
+        self.shard_size = max(1, shard_size)
+        self.parallel = max(1, parallel)
+
+    async def start_run(self, provider_id: int, ips: List[str], target: int, group_name: Optional[str] = None) -> str:
+        run_id = uuid.uuid4().hex
+        run_key = RUN_KEY.format(run_id=run_id)
+        shards_key = RUN_SHARDS_KEY.format(run_id=run_id)
+        shards = [ips[i:i + self.shard_size] for i in range(0, len(ips), self.shard_size)]
+        first, rest = shards[:self.parallel], shards[self.parallel:]
+
+        state = {'provider_id': provider_id, 'target': target, 'good': 0,
+                 'inflight': len(first), 'shards': len(shards), 'done': 0}
+        if group_name is not None:
+            state['group'] = group_name
+        # 先写好 inflight 再派发，避免分片先结束时 reducer 读到 0
+        async with self.redis.pipeline(transaction=True) as pipe:
+            pipe.hset(run_key, mapping=state)
+            if rest:
+                pipe.rpush(shards_key, *[json.dumps(shard) for shard in rest])
+            pipe.expire(run_key, RUN_STATE_TTL)
+            pipe.expire(shards_key, RUN_STATE_TTL)
+            await pipe.execute()
+
+        for shard in first:
+            await self.redis.enqueue_job('tcping_shard', run_id, provider_id, shard)
+        logger.info(f"TCPing run {run_id}: {len(ips)} ips in {len(shards)} shards, target {target}, "
+                    f"{len(first)} shards dispatched")
+        if not first:
+            await self._finish(run_id)
+        return run_id
+
+    async def remaining_target(self, run_id: str) -> int:
+        """这一轮还需要多少个合格 IP，分片开始时读取，作为自己的目标"""
+        target, good = await self.redis.hmget(RUN_KEY.format(run_id=run_id), 'target', 'good')
+        if target is None:
+            return 0
+        return int(target) - int(good or 0)
+
+    async def reduce(self, run_id: str, shard_job_id: str, good: int, failed: bool = False):
+        """
+        汇总一个分片的结果，并用下一个分片补上它的位置。
+        分片只在成功或最终失败时汇总 (见 tasks.tcping_shard)，这里再按 job_id 去重，防止重复汇总。
+        :param failed: 分片最终失败，计入 failed 而不是按 0 个合格 IP 汇总
+        """
+        run_key = RUN_KEY.format(run_id=run_id)
+        shards_key = RUN_SHARDS_KEY.format(run_id=run_id)
+        reduced_key = RUN_REDUCED_KEY.format(run_id=run_id)
+        async with self.redis.pipeline(transaction=True) as pipe:
+            pipe.hsetnx(reduced_key, shard_job_id, 'failed' if failed else good)
+            pipe.expire(reduced_key, RUN_STATE_TTL)
+            first, _ = await pipe.execute()
+        if not first:
+            logger.warning(f"TCPing run {run_id}: shard {shard_job_id} already reduced, ignoring repeated result")
+            return
+        async with self.redis.pipeline(transaction=True) as pipe:
+            pipe.hincrby(run_key, 'good', 0 if failed else good)
+            pipe.hincrby(run_key, 'done', 1)
+            pipe.hincrby(run_key, 'failed', 1 if failed else 0)
+            pipe.hget(run_key, 'target')
+            pipe.hget(run_key, 'provider_id')
+            total_good, done, total_failed, target, provider_id = await pipe.execute()
+        if target is None:
+            logger.warning(f"TCPing run {run_id} state expired, dropping shard result")
+            await self.redis.delete(run_key)
+            return
+        if failed:
+            logger.warning(f"TCPing run {run_id}: shard {shard_job_id} failed")
+        logger.info(f"TCPing run {run_id}: {done} shards done ({total_failed} failed), {total_good}/{int(target)} good ips")
+
+        if total_good >= int(target):
+            # 目标已达到，剩下的分片不再派发
+            await self.redis.delete(shards_key)
+        else:
+            raw = await self.redis.lpop(shards_key)
+            if raw is not None:
+                await self.redis.enqueue_job('tcping_shard', run_id, int(provider_id), json.loads(raw))
+                return
+
+        # 分片队列只会变短，所以把 inflight 减到 0 的那个 reducer 就是最后一个
+        if await self.redis.hincrby(run_key, 'inflight', -1) <= 0:
+            await self._finish(run_id)
+
+    async def _finish(self, run_id: str):
+        run_key = RUN_KEY.format(run_id=run_id)
+        group_name = await self.redis.hget(run_key, 'group')
+        await self.redis.delete(run_key, RUN_SHARDS_KEY.format(run_id=run_id), RUN_REDUCED_KEY.format(run_id=run_id))
+        logger.info(f"TCPing run {run_id} finished")
+        if group_name is not None:
+            await enqueue_next_in_group(self.redis, group_name.decode() if isinstance(group_name, bytes) else group_name)
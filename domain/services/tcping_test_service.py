@@ -1,88 +1,108 @@
-import asyncio
-import json
+import os
+from contextlib import aclosing
 from typing import List
 from domain.schemas.ipaddress import IPAddress
 from services.pubsub_service import PubSubService
 from domain.managers.test_result_manager import TestResultManager
+from domain.managers.test_result_writer import TestResultWriter
+from domain.managers.ranking_manager import RankingManager
 from services.logger import setup_logger
+from services.probe_pool import probe_pool
+from services.progress_reporter import ProgressReporter
+from services.single_flight import SingleFlight
 from utils.tcping import TcpingRunner
-from domain.schemas.config import TcpingConfig
+from domain.schemas.config import SystemConfig, TcpingConfig
 
 logger = setup_logger(__name__)
 
+# 筛选探测的超时 = avg_latency 阈值的倍数，但不低于下限(秒)
+SCREEN_LATENCY_FACTOR = 5
+SCREEN_MIN_TIMEOUT = 1
+
+# 最优 IP 查询的请求合并: 并发的相同查询只回源一次，结果在这段时间(秒)内直接复用。
+# 窗口很短，worker 写入新结果后 API 进程最多再返回这么久的旧结果，不需要跨进程失效
+COALESCE_STALE_AFTER = float(os.getenv('COALESCE_STALE_AFTER', 2))
+# TcpingTestService 每次注入都是新实例，所以放在模块级别
+better_ip_coalescer = SingleFlight(stale_after=COALESCE_STALE_AFTER)
+
 class TcpingTestService:
 
-    def __init__(self,pubsub_service:PubSubService,test_result_manager:TestResultManager):
+    def __init__(self,pubsub_service:PubSubService,test_result_manager:TestResultManager,ranking_manager:RankingManager):
         self.tcping_config = None
         self.pubsub_service = pubsub_service
         self.test_result_manager = test_result_manager
+        self.ranking_manager = ranking_manager
         self.completed_tests = 0  # 初始化计数器
+        self.concurrency = SystemConfig().tcping_semaphore_count  # 同时进行的探测数
 
 
 
     async def set_tcping_config(self, tcping_config: TcpingConfig):
         self.tcping_config = tcping_config
 
+    async def set_system_config(self, system_config: SystemConfig):
+        self.concurrency = max(1, system_config.tcping_semaphore_count)
 
-    async def run_tcping_test(self, ips: List[str]=None):
+
+    async def run_tcping_test(self, ips: List[str]=None, target: int = None, task: str = None) -> int:
+        """
+        测试 ips，合格的结果写入 test_results，返回合格 IP 数
+        :param target: 合格 IP 达到这个数就停止，默认是 tcping_config.count (分片测试时传入剩余目标)
+        :param task: 进度事件中的任务标识，同一任务的进度在 SSE 推送时会合并
+        """
         if self.tcping_config is None:
             raise Exception("TcpingConfig is not set,Please call set_tcping_config method first")
  
-        ips = ips
-        logger.info(f"ips info:{ips}")
+        logger.info(f"Start tcping test for {len(ips)} ips, concurrency: {self.concurrency}")
         port = self.tcping_config.port
         timeout = self.tcping_config.time_out
+        # 筛选探测: 延迟阈值的几倍内都连不上的主机基本是死 IP，不必等满 time_out
+        screen_timeout = min(timeout, max(SCREEN_MIN_TIMEOUT, self.tcping_config.avg_latency * SCREEN_LATENCY_FACTOR / 1000))
         total_ips = len(ips)
-        processed_ips = len(ips)
-        target = self.tcping_config.count
-
-        for i in range(0, len(ips), 20):
-            if self.completed_tests >= target:  # 检查是否已达到目标
-                break
+        target = self.tcping_config.count if target is None else target
 
-            batch = ips[i:i+20]
-            batch_size = len(batch)
+        # 滑动窗口: 一个主机测完立刻补上下一个，不再按 20 个一批等最慢的主机
+        # worker 启动了探测进程池时在子进程中探测，本进程只负责写库
+        sweep = (probe_pool.sweep if probe_pool.started else TcpingRunner.sweep)(
+            ips, port, concurrency=self.concurrency, timeout=timeout,
+            screen_timeout=screen_timeout,
+            max_avg_latency=self.tcping_config.avg_latency,
+            max_packet_loss=self.tcping_config.packet_loss,
+        )
+        # 结果先进缓冲区，按批写库；任务被取消时 writer 退出前会把剩余结果写完
+        writer = TestResultWriter(self.test_result_manager, on_flush=self.ranking_manager.apply)
+        # 进度在内存中累计，按固定周期发布
+        reporter = ProgressReporter(self.pubsub_service, total_ips, task=task, message="正在进行TCPing测试")
+        async with reporter, writer, aclosing(sweep) as results:
+            async for ip, result in results:
+                completed = self.completed_tests
+                await self._save_tcping_result(ip, result, writer)
+                reporter.advance(1, good=self.completed_tests - completed)
 
-            tasks = []
-            for ip in batch:
-                task = self._run_single_tcping_test(ip, port, timeout)
-                tasks.append(task)
+                if self.completed_tests >= target:  # 检查是否已达到目标
+                    break
+        return self.completed_tests
 
-            await asyncio.gather(*tasks)
-            processed_ips += batch_size
-
-            # 发布批次的进度更新
-            progress_message = json.dumps({
-                "status": "in_progress",
-                "progress": (processed_ips / total_ips) * 100,
-                "total": total_ips,
-                "processed": processed_ips
-            })
-            await self.pubsub_service.publish("progress_updates", progress_message)
-
-    async def _run_single_tcping_test(self, ip, port, timeout):
+    async def _save_tcping_result(self, ip, result, writer: TestResultWriter):
         if self.tcping_config is None:
             raise Exception("TcpingConfig is not set,Please call set_tcping_config method first")
         try:
-            # 执行 TCPing 测试
-            logger.info(f"开始tcping测试{ip}")
-            result = await TcpingRunner.run_with_stats(ip, port, timeout)
-            logger.info(f"返回值:{result}")
+            logger.debug(f"返回值:{result}")
             if result is not None:
                 # 保存测试结果
                 _,avg_latency, std_deviation, packet_loss = result
                 insert_data = {}
                 if self.is_available_result(avg_latency, packet_loss):
-                    logger.info(f"数据验证成功")   
+                    logger.info(f"数据验证成功 {ip}")   
                     insert_data['ip'] = ip
                     insert_data['avg_latency']= avg_latency
                     insert_data['std_deviation']=std_deviation
                     insert_data['packet_loss']=packet_loss
-                    await self.test_result_manager.insert_test_result(insert_data)
+                    await writer.add(insert_data)
                     self.completed_tests += 1  # 每次成功插入结果后增加计数器
                 else:
-                    logger.info(f"数据验证失败")
-            logger.info(f"TCPing test completed for {ip}")
+                    logger.debug(f"数据验证失败 {ip}")
+            logger.debug(f"TCPing test completed for {ip}")
         except Exception as e:
             logger.error(f"Failed to run TCPing test for {e}")
             
@@ -97,14 +117,18 @@ class TcpingTestService:
         
         
     async def get_better_ips(self,count: int = 1) -> List[str]:
-        results = await self.test_result_manager.get_better_ips(count)
-        if results:
-            return [result.ip for result in results]
-        else:
-            return []
+        return await better_ip_coalescer.do(
+            ('better_ips', count), lambda: self.test_result_manager.get_better_ip_addresses(count))
+
+    async def get_ranked_ips(self, provider_id: int, ip_type: str = 'ipv4', count: int = 1) -> List[str]:
+        """从排行榜 (Redis 有序集合) 读取某个提供商的最优 IP，不查数据库"""
+        family = 6 if ip_type == 'ipv6' else 4
+        return await better_ip_coalescer.do(
+            ('ranked_ips', provider_id, family, count),
+            lambda: self.ranking_manager.get_top_ips(provider_id, family, count))
     
     async def get_best_ip(self):
-        return await self.test_result_manager.get_best_ip()
+        return await better_ip_coalescer.do('best_ip', self.test_result_manager.get_best_ip)
     
         
     async def delete_invalid_ips_by_tcping_option(self):
@@ -112,7 +136,8 @@ class TcpingTestService:
             raise Exception("TcpingConfig is not set,Please call set_tcping_config method first")
         max_avg_latency = self.tcping_config.avg_latency
         max_loss_packet = self.tcping_config.packet_loss        
-        await self.test_result_manager.delete_invalid_ips_by_tcping_config(max_avg_latency,max_loss_packet)
+        deleted = await self.test_result_manager.delete_invalid_ips_by_tcping_config(max_avg_latency,max_loss_packet)
+        await self.ranking_manager.remove(deleted)
         
     async def delete_by_ip(self,ip: str):
         await self.test_result_manager.delete_test_result_by_ip(ip)
\ No newline at end of file
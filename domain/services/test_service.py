@@ -5,12 +5,18 @@ from typing import List, Dict, Any, Tuple
 from domain.services.ip_address_service import IPAddressService
 from domain.services.config_service import ConfigService
 from domain.managers.test_result_manager import TestResultManager
+from domain.schemas.test_result import TestResult
 from services.cache import CacheService
 from domain.services.provider_service import ProviderService
 from utils.tcping import TcpingRunner
 from utils.curl import CurlRunner
 import asyncio
 
+
+def _decode_test_results(rows):
+    # 缓存里的 TestResult 是字段字典
+    return [TestResult.model_construct(**row) if isinstance(row, dict) else row for row in rows]
+
 class TestService:
 
     def __init__(self,provider_id:int, ip_address_service: IPAddressService,
@@ -294,25 +300,23 @@ class TestService:
 
 
     async def get_better_ip_v6(self, provider_id: int) -> List[str]:
-       list_v6= self.cache_service.get_cache("better_ip_v6" + str(provider_id))
-       if list_v6 is None:
-           _, list_v6 = await self.get_better_ip(provider_id)
-           self.cache_service.set_cache("better_ip_v6" + str(provider_id), list_v6,3600)
-       return list_v6
+        async def compute():
+            _, list_v6 = await self.get_better_ip(provider_id)
+            return list_v6
+        return await self.cache_service.get_or_compute("better_ip_v6" + str(provider_id), compute, ttl=3600)
     
     async def get_better_ip_v4(self, provider_id: int) -> List[str]:
-       list_v4= self.cache_service.get_cache("better_ip_v4" + str(provider_id))
-       if list_v4 is None:
+        async def compute():
             list_v4, _ = await self.get_better_ip(provider_id)
-            self.cache_service.set_cache("better_ip_v4" + str(provider_id), list_v4, 3600)
-       return list_v4
+            return list_v4
+        return await self.cache_service.get_or_compute("better_ip_v4" + str(provider_id), compute, ttl=3600)
     
 
     #async def auto_supplement(self,provider_id) -> None:
     async def auto_delete(self,provider_id) -> None:
-        test_resultsv4 : list[TestResult] = await self.cache_service.get_cache("better_ip_v4" + str(provider_id))
-        test_resultsv6: list[TestResult] = await self.cache_service.get_cache("better_ip_v6" + str(provider_id))
-        test_results = test_resultsv4 + test_resultsv6
+        test_resultsv4 : list[TestResult] = await self.cache_service.get("better_ip_v4" + str(provider_id), decode=_decode_test_results)
+        test_resultsv6: list[TestResult] = await self.cache_service.get("better_ip_v6" + str(provider_id), decode=_decode_test_results)
+        test_results = (test_resultsv4 or []) + (test_resultsv6 or [])
         if test_results is not None:
             for reuslt in test_results:
                 if await self.tcpingPassedIp(avg_latency=0, packet_loss=0) or await self.curlPassedIp(download_speed=0):
@@ -50,6 +50,74 @@ $$;
 
 ALTER FUNCTION public.update_updated_at_column() OWNER TO postgres;
 
+--
+-- Name: test_result_score(real, real, real, jsonb); Type: FUNCTION; Schema: public; Owner: postgres
+--
+
+CREATE FUNCTION public.test_result_score(avg_latency real, packet_loss real, download_speed real, weights jsonb) RETURNS real
+    LANGUAGE sql IMMUTABLE
+    AS $$
+    SELECT (COALESCE((weights->>'avg_latency_weight')::real, 0.3) * avg_latency / 100
+          + COALESCE((weights->>'packet_loss_weight')::real, 0.5) * packet_loss * 10
+          - COALESCE((weights->>'download_speed_weight')::real, 0.2) * GREATEST(COALESCE(download_speed, 0), 0) / 10)::real;
+$$;
+
+
+ALTER FUNCTION public.test_result_score(real, real, real, jsonb) OWNER TO postgres;
+
+--
+-- Name: test_result_weights(); Type: FUNCTION; Schema: public; Owner: postgres
+--
+
+CREATE FUNCTION public.test_result_weights() RETURNS jsonb
+    LANGUAGE sql STABLE
+    AS $$
+    SELECT nsi_option FROM public.config
+    WHERE nsi_option IS NOT NULL
+    ORDER BY (name = 'default') DESC, id
+    LIMIT 1;
+$$;
+
+
+ALTER FUNCTION public.test_result_weights() OWNER TO postgres;
+
+--
+-- Name: set_test_result_score(); Type: FUNCTION; Schema: public; Owner: postgres
+--
+
+CREATE FUNCTION public.set_test_result_score() RETURNS trigger
+    LANGUAGE plpgsql
+    AS $$
+BEGIN
+    NEW.score = public.test_result_score(NEW.avg_latency, NEW.packet_loss, NEW.download_speed, public.test_result_weights());
+    RETURN NEW;
+END;
+$$;
+
+
+ALTER FUNCTION public.set_test_result_score() OWNER TO postgres;
+
+--
+-- Name: rescore_test_results(); Type: FUNCTION; Schema: public; Owner: postgres
+--
+
+CREATE FUNCTION public.rescore_test_results() RETURNS trigger
+    LANGUAGE plpgsql
+    AS $$
+DECLARE
+    weights jsonb = public.test_result_weights();
+BEGIN
+    IF weights IS NOT DISTINCT FROM NEW.nsi_option THEN
+        UPDATE public.test_results
+        SET score = public.test_result_score(avg_latency, packet_loss, download_speed, weights);
+    END IF;
+    RETURN NULL;
+END;
+$$;
+
+
+ALTER FUNCTION public.rescore_test_results() OWNER TO postgres;
+
 SET default_tablespace = '';
 
 SET default_table_access_method = heap;
@@ -104,9 +172,9 @@ ALTER SEQUENCE public.config_id_seq OWNED BY public.config.id;
 
 CREATE TABLE public.ip_ranges (
     id integer NOT NULL,
-    cidr character varying(45),
-    start_ip character varying(45),
-    end_ip character varying(45),
+    cidr inet,
+    start_ip inet,
+    end_ip inet,
     created_at timestamp without time zone DEFAULT CURRENT_TIMESTAMP,
     updated_at timestamp without time zone DEFAULT CURRENT_TIMESTAMP,
     provider_id integer NOT NULL,
@@ -144,7 +212,7 @@ ALTER SEQUENCE public.ip_ranges_id_seq OWNED BY public.ip_ranges.id;
 
 CREATE TABLE public.ips (
     id bigint NOT NULL,
-    ip_address character varying(45) NOT NULL,
+    ip_address inet NOT NULL,
     ip_type character varying(10) NOT NULL,
     created_at timestamp without time zone DEFAULT CURRENT_TIMESTAMP,
     updated_at timestamp without time zone DEFAULT CURRENT_TIMESTAMP,
@@ -248,7 +316,7 @@ ALTER TABLE public.providers OWNER TO postgres;
 
 CREATE TABLE public.test_results (
     id integer NOT NULL,
-    ip character varying NOT NULL,
+    ip inet NOT NULL,
     avg_latency real,
     std_deviation real,
     packet_loss real,
@@ -257,7 +325,8 @@ CREATE TABLE public.test_results (
     status character varying(20),
     test_type character varying(10),
     test_time timestamp without time zone DEFAULT CURRENT_TIMESTAMP,
-    is_delete boolean DEFAULT false
+    is_delete boolean DEFAULT false,
+    score real
 );
 
 
@@ -390,6 +459,41 @@ CREATE INDEX idx_provider_id ON public.ips USING btree (provider_id);
 CREATE INDEX provder_id_index ON public.ip_ranges USING btree (provider_id);
 
 
+--
+-- Name: ips_ip_address_gist; Type: INDEX; Schema: public; Owner: postgres
+--
+
+CREATE INDEX ips_ip_address_gist ON public.ips USING gist (ip_address inet_ops);
+
+
+--
+-- Name: ip_ranges_span_gist; Type: INDEX; Schema: public; Owner: postgres
+--
+
+CREATE INDEX ip_ranges_span_gist ON public.ip_ranges USING gist (inet_merge(start_ip, end_ip) inet_ops);
+
+
+--
+-- Name: test_results_ip_gist; Type: INDEX; Schema: public; Owner: postgres
+--
+
+CREATE INDEX test_results_ip_gist ON public.test_results USING gist (ip inet_ops);
+
+
+--
+-- Name: test_results_score_idx; Type: INDEX; Schema: public; Owner: postgres
+--
+
+CREATE INDEX test_results_score_idx ON public.test_results USING btree (score, ip) WHERE (is_delete = false);
+
+
+--
+-- Name: test_results_speed_tested_std_idx; Type: INDEX; Schema: public; Owner: postgres
+--
+
+CREATE INDEX test_results_speed_tested_std_idx ON public.test_results USING btree (std_deviation) WHERE (download_speed IS NOT NULL);
+
+
 --
 -- Name: config prevent_default_config_deletion_trigger; Type: TRIGGER; Schema: public; Owner: postgres
 --
@@ -404,6 +508,27 @@ CREATE TRIGGER prevent_default_config_deletion_trigger BEFORE DELETE ON public.c
 CREATE TRIGGER update_config_updated_at BEFORE UPDATE ON public.config FOR EACH ROW EXECUTE FUNCTION public.update_updated_at_column();
 
 
+--
+-- Name: config rescore_test_results_on_weights; Type: TRIGGER; Schema: public; Owner: postgres
+--
+
+CREATE TRIGGER rescore_test_results_on_weights AFTER UPDATE OF nsi_option ON public.config FOR EACH ROW WHEN ((new.nsi_option IS DISTINCT FROM old.nsi_option)) EXECUTE FUNCTION public.rescore_test_results();
+
+
+--
+-- Name: test_results set_test_result_score_on_insert; Type: TRIGGER; Schema: public; Owner: postgres
+--
+
+CREATE TRIGGER set_test_result_score_on_insert BEFORE INSERT ON public.test_results FOR EACH ROW WHEN ((new.score IS NULL)) EXECUTE FUNCTION public.set_test_result_score();
+
+
+--
+-- Name: test_results set_test_result_score_on_update; Type: TRIGGER; Schema: public; Owner: postgres
+--
+
+CREATE TRIGGER set_test_result_score_on_update BEFORE UPDATE OF avg_latency, packet_loss, download_speed ON public.test_results FOR EACH ROW WHEN ((new.score IS NOT DISTINCT FROM old.score)) EXECUTE FUNCTION public.set_test_result_score();
+
+
 --
 -- Name: ip_ranges fk_ip_ranges_provider; Type: FK CONSTRAINT; Schema: public; Owner: postgres
 --
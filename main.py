@@ -1,7 +1,10 @@
 from fastapi import FastAPI, Depends
 from fastapi.middleware.cors import CORSMiddleware
-from api import config_router, iprange_router, provider_router, message_router, test_router,monitor_roter
+from api import config_router, iprange_router, provider_router, message_router, test_router,monitor_roter,metrics_router
 from dependencies import get_pubsub_service,get_db_manager,get_redis_manager
+from domain.managers.config_cache import config_cache
+from services.progress_hub import progress_hub
+from services.provider_feed_fetcher import provider_feed_fetcher
 from services.logger import setup_logger
 import asyncio
 import uvicorn
@@ -15,42 +18,33 @@ async def lifespan(app):
 
     # 初始化数据库管理器
     db = get_db_manager()
-  
-    logger.info(f"Database connected: {db}")
+    # 启动时就建好连接池，第一批请求不用等建连接
+    await db.warmup()
+    logger.info(f"Database connected: {db.pool_stats()}")
 
     # 初始化 Redis 管理器
     redis_manager = await get_redis_manager()
     logger.info(f"Redis manager initialized: {redis_manager}")
 
-    # 创建 PubSubService 实例
-    pubsub_service =await get_pubsub_service()
-    logger.info(f"PubSubService initialized: {pubsub_service}")
-
-    # 创建一个后台任务来处理发布/订阅
-    async def process_pubsub():
-        try:
-            # 直接传递 on_progress_update 方法
-            await pubsub_service.subscribe_to_channel("progress_updates", pubsub_service.on_progress_update)
-        except asyncio.CancelledError:
-            logger.info("PubSub service is being cancelled")
-        except Exception as e:
-            logger.error(f"Failed to connect to Redis. Error: {e}")
-
-    # 启动后台任务
-    task1 = asyncio.create_task(process_pubsub())
-    logger.info(f"Started background tasks for PubSub services: {task1}")
+    # 进度事件由一个常驻任务从 Redis Stream 读取，再分发给本进程的所有 SSE 客户端
+    pubsub_service = await get_pubsub_service()
+    progress_reader = asyncio.create_task(progress_hub.run(pubsub_service))
+    # 接收其他进程的配置变更通知，清理本进程的配置缓存
+    config_listener = asyncio.create_task(config_cache.listen_for_invalidations())
 
     # 返回一个异步生成器
     yield
 
     # 在这里进行关闭后的操作
+    await provider_feed_fetcher.close()
     await db.close()
     logger.info("Database closed")
 
     # 取消并等待后台任务完成
-    task1.cancel()
+    progress_reader.cancel()
+    config_listener.cancel()
     try:
-        await asyncio.wait([task1], return_when=asyncio.ALL_COMPLETED)
+        await asyncio.wait([progress_reader, config_listener], return_when=asyncio.ALL_COMPLETED)
     except asyncio.CancelledError:
         logger.info("Background tasks for PubSub services stopped")
     finally:
@@ -75,6 +69,7 @@ app.include_router(iprange_router, prefix="/iprange", tags=["Ipranges"])
 app.include_router(message_router, prefix="/message", tags=["MessageRouter"])
 app.include_router(test_router, prefix="/test", tags=["Test_Router"])
 app.include_router(monitor_roter, prefix="/monitor", tags=["Monitor_Roter"])
+app.include_router(metrics_router, prefix="/metrics", tags=["Metrics"])
 @app.get("/")
 async def read_root():
     return {"message": "Welcome to CDNNetGuard"}
@@ -82,7 +77,7 @@ async def read_root():
 @app.get("/test_publish")
 async def test_publish():
     pubsub_service = await get_pubsub_service()
-    await pubsub_service.publish("progress_updates", '{"status": "in_progress", "progress": 50}')
+    await pubsub_service.publish_progress('{"status": "in_progress", "progress": 50}')
     return {"message": "Test message published"}
 
 # 添加 main 方法
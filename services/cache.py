@@ -1,29 +1,124 @@
-from .redis_manager import RedisManager
+import os
+import time
+from collections import OrderedDict
+from typing import Any, Awaitable, Callable, Optional
+
+import orjson
+
+from services.logger import setup_logger
+from services.single_flight import SingleFlight
+
+logger = setup_logger(__name__)
+
+DEFAULT_TTL = 300
+# L1 只在本进程内，其他进程删除/改写 Redis 里的值后，本进程最多再用 L1_MAX_TTL 秒的旧值
+L1_MAX_TTL = float(os.getenv('CACHE_L1_MAX_TTL', 10))
+L1_MAX_ENTRIES = int(os.getenv('CACHE_L1_MAX_ENTRIES', 1024))
+KEY_PREFIX = "cache:"
+
+
+def _default(obj):
+    # pydantic 模型 (例如 TestResult) 按字段序列化
+    if hasattr(obj, 'model_dump'):
+        return obj.model_dump()
+    raise TypeError(f"Type is not JSON serializable: {type(obj).__name__}")
+
+
+def dumps(value: Any) -> bytes:
+    return orjson.dumps(value, default=_default)
+
+
+def loads(data: bytes) -> Any:
+    return orjson.loads(data)
+
 
 class CacheService:
-    def __init__(self, redis_manager: RedisManager):
+    """
+    两级缓存: L1 是进程内 LRU (条目数有上限)，L2 是 Redis。
+    值用 orjson 序列化，pydantic 模型序列化为字段字典，读取时通过 decode 还原，例如
+        decode=lambda rows: [TestResult.model_construct(**row) for row in rows]
+    get_or_compute 对同一个 key 只计算一次 (single-flight)，避免缓存过期时大量请求同时回源。
+    """
+
+    def __init__(self, redis_manager, l1_max_entries: int = L1_MAX_ENTRIES, l1_max_ttl: float = L1_MAX_TTL):
         self.redis_manager = redis_manager
+        self.l1_max_entries = l1_max_entries
+        self.l1_max_ttl = l1_max_ttl
+        self._l1: "OrderedDict[str, tuple]" = OrderedDict()
+        self._single_flight = SingleFlight()
+        self.l1_hits = 0
+        self.l2_hits = 0
+        self.misses = 0
 
-    async def set_cache(self, key: str, value: str, ex: int = None):
+    async def get(self, key: str, decode: Optional[Callable[[Any], Any]] = None) -> Optional[Any]:
         """
-        设置缓存项
-        :param key: 缓存键
-        :param value: 缓存值
-        :param ex: 过期时间（秒）
+        读取缓存项，不存在返回 None
+        :param decode: 从 Redis 读出并反序列化后，对结果做一次转换 (例如还原成模型)
         """
-        await self.redis_manager.set(key, value, ex=ex)
+        entry = self._l1.get(key)
+        if entry is not None:
+            expires_at, value = entry
+            if expires_at >= time.monotonic():
+                self._l1.move_to_end(key)
+                self.l1_hits += 1
+                return value
+            del self._l1[key]
 
-    async def get_cache(self, key: str) -> str:
-        """
-        获取缓存项
-        :param key: 缓存键
-        :return: 缓存值，如果不存在则返回 None
-        """
-        return await self.redis_manager.get(key)
+        data = await self.redis_manager.get(KEY_PREFIX + key)
+        if data is None:
+            self.misses += 1
+            return None
+        self.l2_hits += 1
+        value = loads(data)
+        if decode is not None:
+            value = decode(value)
+        ttl = await self.redis_manager.ttl(KEY_PREFIX + key)
+        self._set_l1(key, value, ttl if ttl and ttl > 0 else self.l1_max_ttl)
+        return value
 
-    async def delete_cache(self, key: str):
+    async def set(self, key: str, value: Any, ttl: Optional[int] = DEFAULT_TTL):
         """
-        删除缓存项
-        :param key: 缓存键
+        写入缓存项
+        :param ttl: 过期时间（秒），None 表示 Redis 中不过期
         """
-        await self.redis_manager.delete(key)
\ No newline at end of file
+        await self.redis_manager.set(KEY_PREFIX + key, dumps(value), ex=ttl)
+        self._set_l1(key, value, ttl or self.l1_max_ttl)
+
+    async def delete(self, key: str):
+        self._l1.pop(key, None)
+        await self.redis_manager.delete(KEY_PREFIX + key)
+
+    async def get_or_compute(self, key: str, compute: Callable[[], Awaitable[Any]],
+                             ttl: Optional[int] = DEFAULT_TTL,
+                             decode: Optional[Callable[[Any], Any]] = None) -> Any:
+        """先查缓存，未命中时调用 compute 并写入缓存；并发的相同请求共享一次计算"""
+        value = await self.get(key, decode=decode)
+        if value is not None:
+            return value
+
+        async def load():
+            # 等锁期间别的协程可能已经写好了
+            cached = await self.get(key, decode=decode)
+            if cached is not None:
+                return cached
+            result = await compute()
+            if result is not None:
+                await self.set(key, result, ttl=ttl)
+            return result
+
+        return await self._single_flight.do(key, load)
+
+    def stats(self) -> dict:
+        return {
+            'l1_entries': len(self._l1),
+            'l1_hits': self.l1_hits,
+            'l2_hits': self.l2_hits,
+            'misses': self.misses,
+            'single_flight': self._single_flight.stats(),
+        }
+
+    def _set_l1(self, key: str, value: Any, ttl: float):
+        self._l1[key] = (time.monotonic() + min(ttl, self.l1_max_ttl), value)
+        self._l1.move_to_end(key)
+        while len(self._l1) > self.l1_max_entries:
+            self._l1.popitem(last=False)
@@ -1,17 +1,86 @@
-from collections import deque
+import json
+import os
+import uuid
+from typing import Optional
 from arq import create_pool
-import asyncio
+from arq.connections import ArqRedis
+from arq.constants import job_key_prefix
 from services.logger import setup_logger
 from services.redis_manager import RedisManager
 
 logger = setup_logger(__name__)
 
+# 任务组 (链) 的状态
+GROUP_PENDING_KEY = "job_group:{group}:pending"   # 已添加、还没 start 的任务
+GROUP_QUEUE_KEY = "job_group:{group}:queue"       # 链中等待执行的任务
+GROUP_RUNNING_KEY = "job_group:{group}:running"   # 链正在执行的标记
+JOB_GROUP_KEY = "job_group_of:{job_id}"           # 正在执行的任务属于哪个组
+# 运行标记和任务->组映射的过期时间(秒)，每推进一步刷新；链意外中断时过期后可以重新 start
+GROUP_RUNNING_TTL = int(os.getenv('GROUP_RUNNING_TTL', 3 * 3600))
+# 任务最多执行的次数，worker 的 max_tries 使用这个值
+JOB_MAX_TRIES = int(os.getenv('JOB_MAX_TRIES', 5))
+
+
+async def enqueue_next_in_group(redis: ArqRedis, group_name: str) -> Optional[str]:
+    """取出链中的下一个任务入队，链空时清除运行标记。返回入队的 job_id"""
+    running_key = GROUP_RUNNING_KEY.format(group=group_name)
+    while True:
+        raw = await redis.lpop(GROUP_QUEUE_KEY.format(group=group_name))
+        if raw is None:
+            await redis.delete(running_key)
+            logger.info(f"Group {group_name} finished")
+            return None
+        task = json.loads(raw)
+        kwargs = dict(task['kwargs'])
+        job_id = kwargs.pop('_job_id', None) or uuid.uuid4().hex
+        job_group_key = JOB_GROUP_KEY.format(job_id=job_id)
+        # 映射必须在入队前写好，否则很快结束的任务在 after_job_end 里找不到所属的组
+        await redis.set(job_group_key, group_name, ex=GROUP_RUNNING_TTL)
+        await redis.set(running_key, 1, ex=GROUP_RUNNING_TTL)
+        job = await redis.enqueue_job(task['function'], *task['args'], _job_id=job_id, **kwargs)
+        if job is None:
+            # 相同 job_id 的任务已经在队列里，跳过这一步
+            await redis.delete(job_group_key)
+            logger.warning(f"Task {task} of group {group_name} was not enqueued (duplicate job id)")
+            continue
+        logger.info(f"Job {job.job_id} ({task['function']}) enqueued for group {group_name}")
+        return job.job_id
+
+
+async def detach_from_group(redis: ArqRedis, job_id: str) -> Optional[str]:
+    """
+    让任务结束时不推进所属的组，返回组名。
+    任务把工作拆给其他任务 (例如分片测试) 时调用，由最后完成的任务调用 enqueue_next_in_group 继续推进。
+    """
+    job_group_key = JOB_GROUP_KEY.format(job_id=job_id)
+    group_name = await redis.getdel(job_group_key)
+    if group_name is None:
+        return None
+    return group_name.decode() if isinstance(group_name, bytes) else group_name
+
+
+async def advance_group_chain(ctx):
+    """
+    arq after_job_end 钩子: 刚结束的任务属于某个组时，立刻入队组里的下一个任务。
+    Retry 或 worker 关闭时任务还会再执行，这时 arq 保留了任务的 job key，不推进链；
+    但如果这已经是最后一次尝试，arq 下次取出它时直接按超过 max_tries 失败 (finish_failed_job)，
+    不会再调用这个钩子，所以这种情况现在就推进。
+    """
+    redis: ArqRedis = ctx['redis']
+    if await redis.exists(job_key_prefix + ctx['job_id']) and ctx['job_try'] < JOB_MAX_TRIES:
+        return
+    job_group_key = JOB_GROUP_KEY.format(job_id=ctx['job_id'])
+    group_name = await redis.get(job_group_key)
+    if group_name is None:
+        return
+    await redis.delete(job_group_key)
+    group_name = group_name.decode() if isinstance(group_name, bytes) else group_name
+    await enqueue_next_in_group(redis, group_name)
+
 class EnqueueService:
     def __init__(self):
         self.redis_pool = None
         self.redis_settings = RedisManager.get_arq_redis_settings()
-        self.groups = {}
-        self.running_groups = set()
 
     async def initialize(self):
         try:
@@ -32,51 +101,29 @@ class EnqueueService:
             await self.initialize()
         if group_name is None:
             raise ValueError("group_name must be provided")
-        if group_name not in self.groups:
-            self.groups[group_name] = deque()
-        
-        task = (function_name, args, kwargs)
-        self.groups[group_name].append(task)
-        logger.info(f"Task {task} added to group {group_name}")
 
-    async def _handle_group_jobs(self, group_name: str):
-        if group_name not in self.groups:
-            logger.warning(f"Group {group_name} not found")
-            return
-        
-        if group_name in self.running_groups:
-            logger.warning(f"Group {group_name} is already running")
-            return
-        
-        self.running_groups.add(group_name)
-        tasks = self.groups[group_name]
-        while tasks:
-            task = tasks.popleft()  # 从队列中取出第一个任务
-            function_name, args, kwargs = task
-            job = await self.enqueue_job(function_name, *args, **kwargs)
-            # logger.info(f"Job {job.job_id} added to queue for group {group_name}")
-            
-            while True:
-                job_status = await job.status()
-                # logger.info(f"Job {job.job_id} status: {job_status}")
-                if job_status == 'complete':
-                    logger.info(f"Job {job.job_id} completed.")
-                    break
-                elif job_status in ['not_found', 'deferred', 'queued', 'in_progress']:
-                    # logger.info(f"Job {job.job_id} is still {job_status}. Waiting...")
-                    await asyncio.sleep(1)  # 等待1秒后再次检查
-                else:
-                    logger.error(f"Unexpected job status: {job_status}")
-                    raise ValueError(f"Unexpected job status: {job_status} for job {job.job_id}")
-        
-        self.running_groups.remove(group_name)
+        task = {'function': function_name, 'args': list(args), 'kwargs': kwargs}
+        await self.redis_pool.rpush(GROUP_PENDING_KEY.format(group=group_name), json.dumps(task))
+        logger.info(f"Task {task} added to group {group_name}")
 
     async def start_group_jobs(self, group_name: str):
-        if group_name in self.running_groups:
-            logger.warning(f"Group {group_name} is already running")
+        """
+        把组里待启动的任务接到链尾并启动链。
+        链中的任务一个接一个执行: 每个任务结束时由 worker 的 after_job_end 钩子 (advance_group_chain)
+        立即入队下一个任务，不再轮询任务状态；链的状态全部在 Redis 里，进程重启后继续执行。
+        """
+        if not self.redis_pool:
+            await self.initialize()
+        pending_key = GROUP_PENDING_KEY.format(group=group_name)
+        queue_key = GROUP_QUEUE_KEY.format(group=group_name)
+        while await self.redis_pool.lmove(pending_key, queue_key, 'LEFT', 'RIGHT'):
+            pass
+
+        if not await self.redis_pool.set(GROUP_RUNNING_KEY.format(group=group_name), 1, nx=True, ex=GROUP_RUNNING_TTL):
+            # 正在执行的链会在当前任务结束后接着执行新加入的任务
+            logger.info(f"Group {group_name} is already running, new tasks appended to its chain")
             return
-        
-        asyncio.create_task(self._handle_group_jobs(group_name))
+        await enqueue_next_in_group(self.redis_pool, group_name)
 
     async def close(self):
         if self.redis_pool:
@@ -0,0 +1,226 @@
+import asyncio
+import itertools
+import multiprocessing
+import os
+import threading
+import time
+from typing import Dict, List, Optional
+
+from services.logger import setup_logger
+from utils.tcping import TcpingRunner
+
+logger = setup_logger(__name__)
+
+# 探测子进程数，0 表示在 worker 自己的事件循环里探测
+PROBE_PROCESSES = int(os.getenv('PROBE_PROCESSES', 0))
+# 子进程攒够这么多个结果或每隔 RESULT_FLUSH_INTERVAL 秒往结果队列发一次
+RESULT_BATCH = 64
+RESULT_FLUSH_INTERVAL = 0.05
+# 等结果时每隔这么久(秒)检查一次子进程是否还活着
+CHILD_CHECK_INTERVAL = 5
+# 关闭时等待子进程退出的时间(秒)，超时直接 terminate
+SHUTDOWN_TIMEOUT = 5
+
+
+def _new_event_loop():
+    try:
+        import uvloop
+    except ImportError:
+        return asyncio.new_event_loop()
+    return uvloop.new_event_loop()
+
+
+def _child_main(task_queue, result_queue):
+    """
+    子进程入口: 在自己的 (uv)loop 上执行分给它的 sweep。
+    任务队列的消息: ('sweep', sweep_id, hosts, port, concurrency, options) / ('cancel', sweep_id) / None (退出)
+    结果队列的消息: (sweep_id, [(host, stats), ...])，sweep 结束时发 (sweep_id, None)
+    """
+    loop = _new_event_loop()
+    asyncio.set_event_loop(loop)
+    loop.run_until_complete(_child_serve(task_queue, result_queue))
+    loop.close()
+
+
+async def _child_serve(task_queue, result_queue):
+    messages = _read_in_thread(task_queue)
+    sweeps: Dict[int, asyncio.Task] = {}
+    while True:
+        message = await messages.get()
+        if message is None:
+            break
+        if message[0] == 'sweep':
+            _, sweep_id, hosts, port, concurrency, options = message
+            task = asyncio.create_task(_child_sweep(result_queue, sweep_id, hosts, port, concurrency, options))
+            sweeps[sweep_id] = task
+            task.add_done_callback(lambda _, sweep_id=sweep_id: sweeps.pop(sweep_id, None))
+        elif message[0] == 'cancel':
+            task = sweeps.get(message[1])
+            if task is not None:
+                task.cancel()
+    for task in list(sweeps.values()):
+        task.cancel()
+    await asyncio.gather(*sweeps.values(), return_exceptions=True)
+
+
+def _read_in_thread(mp_queue) -> asyncio.Queue:
+    """
+    用一个守护线程阻塞读取 multiprocessing 队列，转到 asyncio.Queue，读到 None 时线程退出。
+    不用 run_in_executor: 一直阻塞的 get 会占住默认线程池，事件循环关闭时还要等它。
+    """
+    loop = asyncio.get_running_loop()
+    messages: asyncio.Queue = asyncio.Queue()
+
+    def reader():
+        while True:
+            message = mp_queue.get()
+            loop.call_soon_threadsafe(messages.put_nowait, message)
+            if message is None:
+                return
+
+    threading.Thread(target=reader, daemon=True).start()
+    return messages
+
+
+async def _child_sweep(result_queue, sweep_id, hosts, port, concurrency, options):
+    batch = []
+    last_sent = time.monotonic()
+    try:
+        async for item in TcpingRunner.sweep(hosts, port, concurrency=concurrency, **options):
+            batch.append(item)
+            now = time.monotonic()
+            if len(batch) >= RESULT_BATCH or now - last_sent >= RESULT_FLUSH_INTERVAL:
+                result_queue.put((sweep_id, batch))
+                batch = []
+                last_sent = now
+        if batch:
+            result_queue.put((sweep_id, batch))
+    finally:
+        result_queue.put((sweep_id, None))
+
+
+class ProbePool:
+    """
+    worker 内的探测进程池: N 个 spawn 出来的子进程，各自运行一个 uvloop 事件循环。
+    一次 sweep 的主机平均分给所有子进程，每个子进程按 concurrency 并发探测，
+    结果成批经 multiprocessing 队列回到父进程，由父进程的 TestResultWriter 批量写库。
+    单个事件循环能承受的 socket 数和 CPU 有限，这样一台探测机的所有核都能用上。
+
+    sweep 与 TcpingRunner.sweep 用法相同，可以直接替换。
+    """
+
+    def __init__(self, processes: int = PROBE_PROCESSES):
+        self.processes = processes
+        self._context = multiprocessing.get_context('spawn')
+        self._children: List = []
+        self._task_queues: List = []
+        self._result_queue = None
+        self._dispatcher: Optional[asyncio.Task] = None
+        self._sweeps: Dict[int, asyncio.Queue] = {}
+        self._sweep_ids = itertools.count()
+
+    @property
+    def started(self) -> bool:
+        return bool(self._children)
+
+    def start(self):
+        if self.processes <= 0 or self.started:
+            return
+        self._result_queue = self._context.Queue()
+        for _ in range(self.processes):
+            task_queue, child = self._spawn()
+            self._task_queues.append(task_queue)
+            self._children.append(child)
+        self._dispatcher = asyncio.create_task(self._dispatch_results())
+        logger.info(f"Probe pool started with {self.processes} processes")
+
+    def _spawn(self):
+        task_queue = self._context.Queue()
+        child = self._context.Process(target=_child_main, args=(task_queue, self._result_queue), daemon=True)
+        child.start()
+        return task_queue, child
+
+    def _restart_dead_children(self):
+        """
+        换掉已经退出的子进程 (被 OOM killer 杀掉、崩溃等)。
+        旧的任务队列可能还留着没读的消息，连同进程一起丢弃。
+        """
+        for i, child in enumerate(self._children):
+            if child.is_alive():
+                continue
+            logger.warning(f"Probe process {child.pid} exited with code {child.exitcode}, restarting it")
+            self._task_queues[i], self._children[i] = self._spawn()
+
+    async def close(self):
+        if not self.started:
+            return
+        for task_queue in self._task_queues:
+            task_queue.put(None)
+        # 让读结果的 _dispatch_results 退出
+        self._result_queue.put(None)
+        await self._dispatcher
+        loop = asyncio.get_running_loop()
+        for child in self._children:
+            await loop.run_in_executor(None, child.join, SHUTDOWN_TIMEOUT)
+            if child.is_alive():
+                child.terminate()
+        self._children.clear()
+        self._task_queues.clear()
+        logger.info("Probe pool stopped")
+
+    async def sweep(self, hosts, port, concurrency=20, **probe_options):
+        """
+        把 hosts 分给各个子进程测试，按完成顺序产出 (host, stats)。
+        concurrency 是每个子进程的并发探测数。
+        提前退出时 (aclosing) 通知子进程取消剩余的探测。
+        """
+        if not self.started:
+            raise RuntimeError("Probe pool is not started")
+        self._restart_dead_children()
+        hosts = list(hosts)
+        sweep_id = next(self._sweep_ids)
+        results: asyncio.Queue = asyncio.Queue()
+        self._sweeps[sweep_id] = results
+        queues = []
+        for i, task_queue in enumerate(self._task_queues):
+            part = hosts[i::len(self._task_queues)]
+            if part:
+                task_queue.put(('sweep', sweep_id, part, port, concurrency, probe_options))
+                queues.append(task_queue)
+
+        remaining = len(queues)
+        try:
+            while remaining:
+                try:
+                    batch = await asyncio.wait_for(results.get(), CHILD_CHECK_INTERVAL)
+                except asyncio.TimeoutError:
+                    # 子进程崩溃时不会再发结束标记，不能一直等下去；它会在下一次 sweep 前被重启
+                    if not all(child.is_alive() for child in self._children):
+                        raise RuntimeError("Probe process died during sweep")
+                    continue
+                if batch is None:
+                    remaining -= 1
+                    continue
+                for item in batch:
+                    yield item
+        finally:
+            self._sweeps.pop(sweep_id, None)
+            if remaining:
+                for task_queue in queues:
+                    task_queue.put(('cancel', sweep_id))
+
+    async def _dispatch_results(self):
+        messages = _read_in_thread(self._result_queue)
+        while True:
+            message = await messages.get()
+            if message is None:
+                return
+            sweep_id, batch = message
+            results = self._sweeps.get(sweep_id)
+            # 已经结束 (提前退出) 的 sweep 的剩余结果直接丢弃
+            if results is not None:
+                results.put_nowait(batch)
+
+
+# TcpingTestService 每次注入都是新实例，进程池放在模块级别，由 worker 的 startup/shutdown 启停
+probe_pool = ProbePool()
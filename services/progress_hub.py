@@ -0,0 +1,154 @@
+import asyncio
+import os
+import time
+from collections import deque
+from typing import Deque, List, Optional, Set, Tuple
+
+from services.logger import setup_logger
+from services.pubsub_service import PubSubService
+
+logger = setup_logger(__name__)
+
+# 每个客户端每秒最多推送的次数，期间到达的进度合并成最新的一条
+SSE_MAX_UPDATES_PER_SECOND = float(os.getenv('SSE_MAX_UPDATES_PER_SECOND', 4))
+# 每个客户端最多缓存的事件数，消费太慢时丢弃最旧的
+SSE_CLIENT_BUFFER = int(os.getenv('SSE_CLIENT_BUFFER', 100))
+# 读取 Stream 时每次最多阻塞的毫秒数
+HUB_BLOCK_MS = 5000
+# 读取失败后等待多久(秒)重试
+HUB_RETRY_DELAY = 1
+# 这些状态的事件不参与合并，一定会推送
+FINAL_STATUSES = {'completed', 'failed'}
+
+Event = Tuple[str, dict]
+
+
+def _stream_id(event_id: str) -> Tuple[int, int]:
+    ms, _, seq = event_id.partition('-')
+    return int(ms), int(seq or 0)
+
+
+def coalesce(events: List[Event]) -> List[Event]:
+    """
+    同一个任务 (消息的 task 字段) 的中间进度只保留最后一条，完成/失败事件全部保留，顺序不变。
+    没有 task 字段的事件分不清属于哪个任务，不参与合并。
+    """
+    def mergeable(message: dict) -> bool:
+        return message.get('task') is not None and message.get('status') not in FINAL_STATUSES
+
+    latest = {}
+    for index, (_, message) in enumerate(events):
+        if mergeable(message):
+            latest[message['task']] = index
+    return [event for index, event in enumerate(events)
+            if not mergeable(event[1]) or latest[event[1]['task']] == index]
+
+
+class ProgressSubscriber:
+    """一个 SSE 客户端的有界队列，满了丢弃最旧的事件"""
+
+    def __init__(self, buffer_size: int = SSE_CLIENT_BUFFER):
+        self._events: Deque[Event] = deque(maxlen=buffer_size)
+        self._ready = asyncio.Event()
+        self.dropped = 0
+        # 回放到的位置，中心分发的不晚于它的事件已经发过了
+        self.skip_until: Optional[Tuple[int, int]] = None
+
+    def push(self, event: Event):
+        if len(self._events) == self._events.maxlen:
+            self.dropped += 1
+        self._events.append(event)
+        self._ready.set()
+
+    async def wait(self, timeout: float) -> List[Event]:
+        """等到有事件 (或超时)，取出全部并合并"""
+        try:
+            await asyncio.wait_for(self._ready.wait(), timeout)
+        except asyncio.TimeoutError:
+            return []
+        self._ready.clear()
+        events = list(self._events)
+        self._events.clear()
+        if self.skip_until is not None:
+            events = [event for event in events if _stream_id(event[0]) > self.skip_until]
+        return coalesce(events)
+
+
+class ProgressHub:
+    """
+    每个 web 进程只用一个读取者阻塞读取进度 Stream，再分发给所有 SSE 客户端的有界队列，
+    客户端数量不再影响 Redis 连接数；没有事件时客户端只是在等 asyncio.Event，不占 CPU。
+    """
+
+    def __init__(self, max_updates_per_second: float = SSE_MAX_UPDATES_PER_SECOND):
+        self.min_interval = 1 / max_updates_per_second if max_updates_per_second > 0 else 0
+        self._subscribers: Set[ProgressSubscriber] = set()
+
+    async def run(self, pubsub_service: PubSubService):
+        """常驻任务: 在 FastAPI lifespan 中启动"""
+        # 用具体的 id 作游标: 一直用 "$" 的话两次 XREAD 之间发布的事件会漏掉
+        cursor = None
+        while True:
+            if cursor is None:
+                try:
+                    latest = await pubsub_service.recent_progress(count=1)
+                except asyncio.CancelledError:
+                    raise
+                except Exception as e:
+                    logger.error(f"Failed to read progress stream: {e}")
+                    await asyncio.sleep(HUB_RETRY_DELAY)
+                    continue
+                cursor = latest[0][0] if latest else "0-0"
+            try:
+                events = await pubsub_service.read_progress(cursor, count=500, block_ms=HUB_BLOCK_MS)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.error(f"Failed to read progress stream: {e}")
+                await asyncio.sleep(HUB_RETRY_DELAY)
+                continue
+            for event_id, message in events:
+                cursor = event_id
+                if message is None:
+                    continue
+                for subscriber in self._subscribers:
+                    subscriber.push((event_id, message))
+
+    def subscribe(self) -> ProgressSubscriber:
+        subscriber = ProgressSubscriber()
+        self._subscribers.add(subscriber)
+        return subscriber
+
+    def unsubscribe(self, subscriber: ProgressSubscriber):
+        self._subscribers.discard(subscriber)
+
+    async def stream(self, subscriber: ProgressSubscriber, replay: List[Event],
+                     after: Optional[str] = None, timeout: float = HUB_BLOCK_MS / 1000):
+        """
+        先推送回放的事件，再按限速推送分发来的事件。
+        subscriber 要在读取回放之前订阅，回放期间分发来的重复事件按 id 跳过。
+        :param after: 客户端已经收到的最后一个事件 id (Last-Event-ID)
+        每次产出一批事件，没有事件时在 timeout 后产出空列表，便于调用方检查连接是否断开。
+        """
+        last_seen = replay[-1][0] if replay else after
+        if last_seen:
+            subscriber.skip_until = _stream_id(last_seen)
+        if replay:
+            yield [event for event in replay if event[1] is not None]
+        while True:
+            started = time.monotonic()
+            yield await subscriber.wait(timeout)
+            # 限速: 两次推送之间至少间隔 min_interval，期间到达的事件下次一起合并
+            delay = self.min_interval - (time.monotonic() - started)
+            if delay > 0:
+                await asyncio.sleep(delay)
+
+    def stats(self) -> dict:
+        return {
+            'subscribers': len(self._subscribers),
+            'dropped': sum(subscriber.dropped for subscriber in self._subscribers),
+        }
+
+
+# 每个进程一个
+progress_hub = ProgressHub()
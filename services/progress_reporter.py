@@ -0,0 +1,104 @@
+import asyncio
+import json
+import time
+import uuid
+from typing import Optional, Sequence
+
+from services.logger import setup_logger
+from services.pubsub_service import PubSubService
+
+logger = setup_logger(__name__)
+
+# 最多每隔这么久(毫秒)发布一次进度
+PROGRESS_INTERVAL_MS = 500
+# 进度越过这些比例时立即发布，不等下一个周期
+PROGRESS_MILESTONES = (0.25, 0.5, 0.75)
+
+
+class ProgressReporter:
+    """
+    在内存里累计进度，按固定周期 (或越过里程碑时) 发布一条进度事件，
+    不管任务处理多少条数据，Redis 写入次数只和耗时有关。
+
+    用法:
+        async with ProgressReporter(pubsub_service, total, task="tcping:...") as reporter:
+            reporter.advance(n, good=...)
+    退出时发布 completed (出现异常时为 failed)。
+    """
+
+    def __init__(self, pubsub_service: PubSubService, total: int, task: Optional[str] = None,
+                 message: str = "", interval_ms: int = PROGRESS_INTERVAL_MS,
+                 milestones: Sequence[float] = PROGRESS_MILESTONES):
+        self.pubsub_service = pubsub_service
+        self.total = total
+        self.task = task or uuid.uuid4().hex
+        self.message = message
+        self.interval = interval_ms / 1000
+        self._milestones = sorted(milestones)
+        self.processed = 0
+        self.good = 0
+        self._published_processed = None
+        self._started_at = None
+        self._wake = asyncio.Event()
+        self._publisher = None
+
+    async def __aenter__(self):
+        self._started_at = time.monotonic()
+        self._publisher = asyncio.create_task(self._publish_periodically())
+        return self
+
+    async def __aexit__(self, exc_type, exc, tb):
+        self._publisher.cancel()
+        try:
+            await self._publisher
+        except asyncio.CancelledError:
+            pass
+        status = "completed" if exc_type is None else "failed"
+        await asyncio.shield(self._publish(status))
+
+    def advance(self, count: int = 1, good: int = 0):
+        """累计进度，只改内存里的计数"""
+        self.processed += count
+        self.good += good
+        crossed = False
+        while self._milestones and self.total and self.processed / self.total >= self._milestones[0]:
+            self._milestones.pop(0)
+            crossed = True
+        if crossed:
+            self._wake.set()
+
+    def snapshot(self, status: str = "in_progress") -> dict:
+        elapsed = time.monotonic() - self._started_at if self._started_at else 0.0
+        rate = self.processed / elapsed if elapsed > 0 else 0.0
+        remaining = max(self.total - self.processed, 0)
+        return {
+            "type": "progress",
+            "task": self.task,
+            "status": status,
+            "progress": round(self.processed / self.total, 4) if self.total else 1.0,
+            "total": self.total,
+            "processed": self.processed,
+            "good": self.good,
+            "rate": round(rate, 2),
+            "eta": round(remaining / rate, 1) if rate > 0 and status == "in_progress" else None,
+            "elapsed": round(elapsed, 1),
+            "message": self.message,
+        }
+
+    async def _publish_periodically(self):
+        while True:
+            try:
+                await asyncio.wait_for(self._wake.wait(), self.interval)
+            except asyncio.TimeoutError:
+                pass
+            self._wake.clear()
+            # 没有新进度时不发布
+            if self.processed != self._published_processed:
+                await self._publish("in_progress")
+
+    async def _publish(self, status: str):
+        self._published_processed = self.processed
+        try:
+            await self.pubsub_service.publish_progress(json.dumps(self.snapshot(status)))
+        except Exception as e:
+            logger.error(f"Failed to publish progress for {self.task}. Error: {e}")
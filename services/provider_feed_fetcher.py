@@ -0,0 +1,154 @@
+import asyncio
+import hashlib
+import tempfile
+from dataclasses import dataclass, field
+from typing import IO, List, Optional, Tuple
+
+import aiohttp
+import ijson
+
+from services.logger import setup_logger
+from services.redis_manager import RedisManager
+
+logger = setup_logger(__name__)
+
+# 按 (提供商, URL) 保存，多个提供商配置同一个 URL 时各自判断是否变化
+FEED_STATE_KEY = "feed:{provider_id}:{url}"
+# 下载内容超过这个大小(字节)时落盘，否则留在内存
+SPOOL_MAX_MEMORY = 1024 * 1024
+CHUNK_SIZE = 64 * 1024
+MAX_RETRIES = 3
+RETRY_DELAY = 5  # 重试间隔时间（秒）
+REQUEST_TIMEOUT = 60
+
+
+@dataclass
+class FeedPayload:
+    provider_id: int
+    url: str
+    ipv4_cidrs: List[str]
+    ipv6_cidrs: List[str]
+    # 应用成功后通过 mark_applied 保存，下次请求带上
+    state: dict = field(default_factory=dict)
+
+
+def _parse_cloudflare(file: IO[bytes]) -> Tuple[List[str], List[str]]:
+    if next(ijson.items(file, 'success'), False) is not True:
+        raise ValueError("API request failed for Cloudflare")
+    file.seek(0)
+    ipv4_cidrs = list(ijson.items(file, 'result.ipv4_cidrs.item'))
+    file.seek(0)
+    ipv6_cidrs = list(ijson.items(file, 'result.ipv6_cidrs.item'))
+    return ipv4_cidrs, ipv6_cidrs
+
+
+def _parse_aws(file: IO[bytes]) -> Tuple[List[str], List[str]]:
+    """只保留 CloudFront 的全局前缀，IPv4 在 prefixes 中，IPv6 在 ipv6_prefixes 中"""
+    def cloudfront(prefix: dict) -> bool:
+        return prefix.get('region') == 'GLOBAL' and prefix.get('service') == 'CLOUDFRONT'
+
+    ipv4_cidrs = [prefix['ip_prefix'] for prefix in ijson.items(file, 'prefixes.item')
+                  if cloudfront(prefix) and 'ip_prefix' in prefix]
+    file.seek(0)
+    ipv6_cidrs = [prefix['ipv6_prefix'] for prefix in ijson.items(file, 'ipv6_prefixes.item')
+                  if cloudfront(prefix) and 'ipv6_prefix' in prefix]
+    return ipv4_cidrs, ipv6_cidrs
+
+
+def parse_feed(url: str, file: IO[bytes]) -> Tuple[List[str], List[str]]:
+    """按 URL 选择解析方式，ijson 边读边解析，内存占用与文件大小无关"""
+    if 'cloudflare' in url:
+        return _parse_cloudflare(file)
+    if 'cloudfront' in url or 'amazonaws' in url:
+        return _parse_aws(file)
+    raise ValueError(f"Unsupported provider feed: {url}")
+
+
+class ProviderFeedFetcher:
+    """
+    拉取提供商公布的 IP 范围 (Cloudflare / AWS ip-ranges.json)。
+    - 进程内共用一个 aiohttp 会话
+    - 带 If-None-Match / If-Modified-Since 条件请求，304 时不下载
+    - 内容的 sha256 和上次一样时不解析
+    - 下载内容写入临时文件 (小的留在内存)，用 ijson 增量解析
+    上次的 ETag / Last-Modified / 哈希存在 Redis 中，调用方应用成功后再调用 mark_applied 保存，
+    应用失败时下次仍会重新拉取。
+    """
+
+    def __init__(self):
+        self._session: Optional[aiohttp.ClientSession] = None
+
+    def _get_session(self) -> aiohttp.ClientSession:
+        if self._session is None or self._session.closed:
+            self._session = aiohttp.ClientSession(timeout=aiohttp.ClientTimeout(total=REQUEST_TIMEOUT))
+        return self._session
+
+    async def close(self):
+        if self._session is not None:
+            await self._session.close()
+            self._session = None
+
+    async def fetch(self, provider_id: int, url: str, force: bool = False) -> Optional[FeedPayload]:
+        """
+        返回解析后的范围，内容没有变化时返回 None。
+        :param force: 忽略保存的状态，总是下载并解析 (例如提供商的范围被手动删除后)
+        """
+        redis = await RedisManager.get_instance()
+        state_key = FEED_STATE_KEY.format(provider_id=provider_id, url=url)
+        saved = {} if force else {
+            (key.decode() if isinstance(key, bytes) else key): (value.decode() if isinstance(value, bytes) else value)
+            for key, value in (await redis.hgetall(state_key)).items()
+        }
+
+        headers = {}
+        if saved.get('etag'):
+            headers['If-None-Match'] = saved['etag']
+        if saved.get('last_modified'):
+            headers['If-Modified-Since'] = saved['last_modified']
+
+        for attempt in range(MAX_RETRIES):
+            try:
+                with tempfile.SpooledTemporaryFile(max_size=SPOOL_MAX_MEMORY) as file:
+                    async with self._get_session().get(url, headers=headers) as resp:
+                        if resp.status == 304:
+                            logger.info(f"Feed {url} not modified")
+                            return None
+                        if resp.status != 200:
+                            raise ValueError(f"Failed to fetch data from API: {resp.status}")
+                        digest = hashlib.sha256()
+                        async for chunk in resp.content.iter_chunked(CHUNK_SIZE):
+                            digest.update(chunk)
+                            file.write(chunk)
+                        state = {
+                            'etag': resp.headers.get('ETag', ''),
+                            'last_modified': resp.headers.get('Last-Modified', ''),
+                            'sha256': digest.hexdigest(),
+                        }
+
+                    if state['sha256'] == saved.get('sha256'):
+                        # 服务器不支持条件请求但内容没变，更新校验头即可
+                        logger.info(f"Feed {url} unchanged (same hash)")
+                        await redis.hset(state_key, mapping=state)
+                        return None
+
+                    file.seek(0)
+                    # 解析是 CPU 操作，放到线程里不阻塞事件循环
+                    ipv4_cidrs, ipv6_cidrs = await asyncio.to_thread(parse_feed, url, file)
+                    return FeedPayload(provider_id=provider_id, url=url, ipv4_cidrs=ipv4_cidrs, ipv6_cidrs=ipv6_cidrs, state=state)
+
+            # ClientTimeout 超时抛出的是 asyncio.TimeoutError，不是 ClientError
+            except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+                logger.warning(f"Attempt {attempt + 1}/{MAX_RETRIES} failed: {e}")
+                if attempt < MAX_RETRIES - 1:
+                    await asyncio.sleep(RETRY_DELAY)
+                else:
+                    raise ValueError(f"Failed to fetch data from API after {MAX_RETRIES} attempts: {e}")
+
+    async def mark_applied(self, payload: FeedPayload):
+        """范围更新成功后保存这次的校验信息"""
+        redis = await RedisManager.get_instance()
+        await redis.hset(FEED_STATE_KEY.format(provider_id=payload.provider_id, url=payload.url), mapping=payload.state)
+
+
+# 共用会话，放在模块级别；在 FastAPI lifespan 和 arq shutdown 中关闭
+provider_feed_fetcher = ProviderFeedFetcher()
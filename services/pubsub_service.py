@@ -1,10 +1,17 @@
 import json
-from typing import Callable, Awaitable, List, Optional
+import os
+from typing import Callable, Awaitable, List, Optional, Tuple
 from services.redis_manager import RedisManager
 from services.logger import setup_logger
 
 logger = setup_logger(__name__)
 
+# 进度事件的 Redis Stream，XADD 时近似裁剪到 PROGRESS_STREAM_MAXLEN 条
+PROGRESS_STREAM = "progress_stream"
+PROGRESS_STREAM_MAXLEN = int(os.getenv('PROGRESS_STREAM_MAXLEN', 1000))
+# 只读取在此之后发布的事件
+LATEST_CURSOR = "$"
+
 class PubSubService:
     _instance = None
 
@@ -16,7 +23,6 @@ class PubSubService:
     def __init__(self, redis_manager: RedisManager):
         if not hasattr(self, 'initialized'):
             self.redis_manager = redis_manager
-            self.message_queue: List[dict] = []
             self.initialized = True
 
     async def publish(self, channel: str, message: str):
@@ -40,23 +46,44 @@ class PubSubService:
         pubsub = self.redis_manager.pubsub()
         await pubsub.unsubscribe(channel)
 
-    async def on_progress_update(self, message_data: bytes):
-        """ 处理进度更新消息并更新最新进度信息 """
+    async def publish_progress(self, message: str):
+        """
+        发布进度事件到 Redis Stream。
+        事件按 MAXLEN 裁剪，内存有上限；web 进程不在线时发布的事件也保留在 Stream 中。
+        """
+        await self.redis_manager.xadd(
+            PROGRESS_STREAM, {'data': message}, maxlen=PROGRESS_STREAM_MAXLEN, approximate=True)
+
+    async def read_progress(self, cursor: str = LATEST_CURSOR, count: int = 100,
+                            block_ms: Optional[int] = None) -> List[Tuple[str, dict]]:
+        """
+        读取 cursor 之后的进度事件，返回 [(事件 id, 消息)]。
+        每个客户端自己保存游标 (最后一个事件 id)，下次从这里继续读。
+        :param block_ms: 没有新事件时最多阻塞等待的毫秒数，None 表示不等待
+        """
+        response = await self.redis_manager.xread({PROGRESS_STREAM: cursor}, count=count, block=block_ms)
+        if not response:
+            return []
+        _, entries = response[0]
+        return [self._decode_entry(entry) for entry in entries]
+
+    async def recent_progress(self, count: int = 20) -> List[Tuple[str, dict]]:
+        """最近的 count 个进度事件 (从旧到新)，供新连接的客户端回放"""
+        entries = await self.redis_manager.xrevrange(PROGRESS_STREAM, count=count)
+        return [self._decode_entry(entry) for entry in reversed(entries)]
+
+    async def get_latest_progress(self) -> Optional[dict]:
+        recent = await self.recent_progress(count=1)
+        return recent[0][1] if recent else None
+
+    @staticmethod
+    def _decode_entry(entry) -> Tuple[str, dict]:
+        entry_id, fields = entry
+        entry_id = entry_id.decode() if isinstance(entry_id, bytes) else entry_id
+        data = fields.get(b'data', fields.get('data'))
         try:
-            message_str = message_data.decode('utf-8')  # 解码字节对象为字符串
-            message = json.loads(message_str)
-
-            # 将消息存放到列表中
-            self.message_queue.append(message)
-
-        except json.JSONDecodeError:
-            print("Received non-JSON data, ignoring.")
-        except Exception as e:
-            print(f"An error occurred while processing the progress update: {e}")
-
-    def get_message(self) -> Optional[dict]:
-        """ 从消息队列中获取消息 """
-        if self.message_queue:
-            message = self.message_queue.pop(0)
-            return message
-        return None
\ No newline at end of file
+            message = json.loads(data)
+        except (TypeError, json.JSONDecodeError):
+            logger.warning(f"Received non-JSON progress event {entry_id}, ignoring.")
+            message = None
+        return entry_id, message
@@ -0,0 +1,61 @@
+import asyncio
+import time
+from typing import Any, Awaitable, Callable, Dict, Hashable, Tuple
+
+# 保留的结果超过这么多个时清理过期的
+MAX_RESULTS = 1024
+
+
+class SingleFlight:
+    """
+    同一个 key 同时只执行一次计算: 计算进行中再来的调用直接等待同一个结果。
+    计算在独立的 task 里执行，所有调用方 (包括发起计算的那个) 都通过 shield 等待它，
+    任何一个调用方被取消都不影响计算本身和其他等待者。计算抛出的异常会传给所有等待者。
+    stale_after > 0 时，计算成功后的 stale_after 秒内相同 key 的调用直接返回上一次的结果，
+    挡住一次查询刚结束时紧接着到达的大量相同请求。
+    """
+
+    def __init__(self, stale_after: float = 0):
+        self.stale_after = stale_after
+        self._inflight: Dict[Hashable, asyncio.Future] = {}
+        self._results: Dict[Hashable, Tuple[float, Any]] = {}
+        self.calls = 0
+        self.hits = 0
+        self.coalesced = 0
+
+    async def do(self, key: Hashable, compute: Callable[[], Awaitable[Any]]) -> Any:
+        self.calls += 1
+        entry = self._results.get(key)
+        if entry is not None and time.monotonic() - entry[0] < self.stale_after:
+            self.hits += 1
+            return entry[1]
+        task = self._inflight.get(key)
+        if task is not None:
+            self.coalesced += 1
+        else:
+            task = asyncio.ensure_future(compute())
+            self._inflight[key] = task
+            task.add_done_callback(lambda done, key=key: self._done(key, done))
+        return await asyncio.shield(task)
+
+    def _done(self, key: Hashable, task: asyncio.Future):
+        if self._inflight.get(key) is task:
+            del self._inflight[key]
+        if task.cancelled():
+            return
+        # 所有等待者都被取消时没人读取异常，避免 "exception was never retrieved" 警告
+        if task.exception() is None and self.stale_after > 0:
+            now = time.monotonic()
+            if len(self._results) >= MAX_RESULTS:
+                self._results = {k: v for k, v in self._results.items() if now - v[0] < self.stale_after}
+            self._results[key] = (now, task.result())
+
+    def stats(self) -> dict:
+        return {
+            'calls': self.calls,
+            'hits': self.hits,
+            'coalesced': self.coalesced,
+            'inflight': len(self._inflight),
+            'hit_rate': round(self.hits / self.calls, 4) if self.calls else 0.0,
+            'coalesce_rate': round(self.coalesced / self.calls, 4) if self.calls else 0.0,
+        }
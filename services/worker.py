@@ -1,3 +1,4 @@
+import asyncio
 import os
 import sys
 from arq import cron
@@ -6,19 +7,46 @@ project_root = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
 if project_root not in sys.path:
     sys.path.append(project_root)
 from services.redis_manager import RedisManager
+from services.enqueue_service import JOB_MAX_TRIES, advance_group_chain
 # 获取项目根目录
 from domain.services.tasks import curl_test, get_all_functions,tcping_test, tcping_test_monitor_list
+from dependencies import get_db_manager, get_provider_service, get_ranking_manager
+from domain.managers.config_cache import config_cache
+from services.probe_pool import probe_pool
+from services.provider_feed_fetcher import provider_feed_fetcher
+from services.logger import setup_logger
+
+logger = setup_logger(__name__)
 
 async def startup(ctx):
     ctx['redis'] = await create_pool(RedisManager.get_arq_redis_settings())
+    await get_db_manager().warmup()
+    ctx['config_listener'] = asyncio.create_task(config_cache.listen_for_invalidations())
+    # PROBE_PROCESSES > 0 时 TCPing 探测在子进程中执行
+    probe_pool.start()
+    # 冷启动: 从 Postgres 重建内存排行榜和 Redis 镜像
+    try:
+        ranking_manager = await get_ranking_manager()
+        provider_service = await get_provider_service()
+        providers = await provider_service.get_all_providers()
+        await ranking_manager.rebuild_all(provider.id for provider in providers or [])
+    except Exception as e:
+        logger.error(f"Failed to rebuild rankings on startup: {e}")
 
 async def shutdown(ctx):
+    ctx['config_listener'].cancel()
+    await probe_pool.close()
+    await provider_feed_fetcher.close()
     await ctx['redis'].close()
+    await get_db_manager().close()
 
 class WorkerSettings:
     functions = get_all_functions()
     on_startup = startup
     on_shutdown = shutdown
+    # 任务组里的下一个任务在上一个结束时立即入队
+    after_job_end = advance_group_chain
+    max_tries = JOB_MAX_TRIES
     job_timeout = 1200  # 设置全局超时时间为 1200 秒（20 分钟）
     cron_josb=[
          cron(tcping_test,hour={9,12,15,18}),
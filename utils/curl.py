@@ -1,110 +1,132 @@
 import asyncio
-import subprocess
-import os
-import re
+from collections import deque
+from dataclasses import dataclass
+import ipaddress
 import logging
-from urllib.parse import urlparse
-import uuid
+import socket
+import time
+from typing import Optional
+
+import aiohttp
+from aiohttp.abc import AbstractResolver
+
+# 读取块大小，数据读出后直接丢弃，不落盘
+CHUNK_SIZE = 64 * 1024
+# 计算持续吞吐量的滑动窗口(秒)，可以排除 TCP 慢启动阶段的影响
+THROUGHPUT_WINDOW = 2.0
+# 超过这么久没有收到新数据就认为下载卡住了(秒)
+STALL_TIMEOUT = 30
+
+
+@dataclass
+class DownloadStats:
+    ip: str
+    bytes_received: int
+    elapsed: float          # 秒，从发出请求到停止读取
+    ttfb_ms: float          # 首字节时间
+    speed: float            # MB/s，滑动窗口内的持续吞吐量
+
+
+class PinnedResolver(AbstractResolver):
+    """把下载链接的域名固定解析到待测 IP，SNI 和 Host 头仍然使用原域名"""
+
+    def __init__(self, ip: str):
+        self.ip = ip
+        self.family = socket.AF_INET if ipaddress.ip_address(ip).version == 4 else socket.AF_INET6
+
+    async def resolve(self, host, port=0, family=socket.AF_INET):
+        return [{
+            'hostname': host,
+            'host': self.ip,
+            'port': port,
+            'family': self.family,
+            'proto': 0,
+            'flags': socket.AI_NUMERICHOST,
+        }]
+
+    async def close(self):
+        pass
+
 
 class CurlRunner:
     @staticmethod
-    async def run(ip, download_url, port, timeout):
-        logging.info("Downloading file with curl")
-        # 生成唯一的文件名
-        unique_id = f"{int(asyncio.get_event_loop().time())}_{uuid.uuid4().hex[:6]}"
-        output_file = f'downloaded_file_{unique_id}.zip'
-
-        # 解析 URL 获取主机名
-        parsed_url = urlparse(download_url)
-        hostname = parsed_url.hostname
-
-        # 构建 curl 命令
-        curl_command = [
-            'curl',
-            '--resolve', f'{hostname}:{port}:{ip}',  # 将域名解析到指定的 IP 和端口
-            '--output', output_file,  # 输出文件
-            '--show-error',  # 显示错误信息
-            '--max-time', str(timeout),  # 设置超时时间
-            download_url
-        ]
-        logging.info(f"Running curl command: {' '.join(curl_command)}")
-
-        # 记录开始时间
-        start_time = asyncio.get_event_loop().time()
-        last_output_time = start_time  # 初始化最后输出时间
-
-        # 运行 curl 命令
-        process = await asyncio.create_subprocess_exec(
-            *curl_command,
-            stdout=asyncio.subprocess.PIPE,
-            stderr=asyncio.subprocess.PIPE
-        )
-
+    async def measure(ip, download_url, timeout, target_bytes=None, window=THROUGHPUT_WINDOW) -> Optional[DownloadStats]:
+        """
+        在进程内通过 ip 下载 download_url，读到 target_bytes 字节或达到 timeout 秒就停止。
+        速度取最后 window 秒内的吞吐量；下载时间不足一个窗口时取首字节之后的平均速度。
+        """
+        connector = aiohttp.TCPConnector(resolver=PinnedResolver(ip), use_dns_cache=False, force_close=True)
+        # 总时长由下面的读取循环控制，这里只限制建连和等待响应头
+        client_timeout = aiohttp.ClientTimeout(total=None, sock_connect=timeout, sock_read=STALL_TIMEOUT)
+
+        received = 0
+        first_byte_at = None
+        # 读到最后一块数据的时间；不能在会话关闭后取，force_close 的断开连接耗时会被算进传输时间
+        end = None
+        samples = deque()
+        start = time.perf_counter()
+        deadline = start + timeout
         try:
-            while True:
-                # 等待一段时间
-                await asyncio.sleep(1)
-
-                # 检查是否超时
-                if (asyncio.get_event_loop().time() - start_time) > timeout:
-                    logging.info("Download timed out, stopping the download.")
-                    process.terminate()  # 终止进程
-                    break
-
-                # 检查是否有新的输出
-                if (asyncio.get_event_loop().time() - last_output_time) > 30:  # 如果 30 秒内没有新的输出
-                    logging.info("No new output for 30 seconds, assuming the download is unresponsive, stopping the download.")
-                    process.terminate()  # 终止进程
-                    break
-
-                # 读取并过滤 stderr 输出
-                stderr_line = await process.stderr.readline()
-                if not stderr_line:
-                    continue
-                stderr_line = stderr_line.decode().strip()
-
-                # 过滤掉特定的 TLS 日志信息
-                if not re.match(r'^\* TLSv1\.2 $IN$, TLS header, Supplemental data $23$:', stderr_line):
-                    logging.info(stderr_line)
-                    last_output_time = asyncio.get_event_loop().time()  # 更新最后输出时间
-        except asyncio.CancelledError:
-            # 如果下载被取消，则终止进程
-            process.terminate()
-            raise
-        finally:
-            # 确保进程完全终止
-            try:
-                await asyncio.wait_for(process.wait(), timeout=5)
-            except asyncio.TimeoutError:
-                logging.warning("Process did not terminate in time, forcing termination.")
-                process.kill()
-
-            # 等待进程完成并获取输出
-            stdout, stderr = await process.communicate()
-
-            # 检查是否成功下载了文件
-            if not os.path.exists(output_file):
-                logging.error("Download failed. The file was not found.")
+            async with aiohttp.ClientSession(connector=connector, timeout=client_timeout) as session:
+                async with session.get(download_url) as response:
+                    if response.status >= 400:
+                        logging.error(f"Download from {ip} failed with HTTP {response.status}")
+                        return None
+                    while True:
+                        remaining = deadline - time.perf_counter()
+                        if remaining <= 0:
+                            break
+                        try:
+                            chunk = await asyncio.wait_for(response.content.readany(), timeout=remaining)
+                        except asyncio.TimeoutError:
+                            break
+                        if not chunk:
+                            break
+                        now = end = time.perf_counter()
+                        if first_byte_at is None:
+                            first_byte_at = now
+                        received += len(chunk)
+                        samples.append((now, received))
+                        while now - samples[0][0] > window:
+                            samples.popleft()
+                        if target_bytes is not None and received >= target_bytes:
+                            break
+        except (aiohttp.ClientError, asyncio.TimeoutError, OSError) as e:
+            logging.error(f"Download from {ip} failed: {e!r}")
+            if received == 0:
                 return None
-            else:
-                # 获取文件大小（字节）
-                file_size_bytes = os.path.getsize(output_file)
-
-                # 如果文件大小为0，返回None
-                if file_size_bytes == 0:
-                    logging.error("Downloaded file size is 0, returning None.")
-                    os.remove(output_file)
-                    return None
-
-                # 计算平均下载速度（单位：MB/s）
-                average_speed_mbps = round((file_size_bytes / 1024 / 1024) / timeout, 2)
-
-                # 打印平均下载速度
-                logging.info(f"Download completed. Total time: {timeout:.2f}s, Downloaded size: {file_size_bytes} bytes")
-                logging.info(f"Average download speed: {average_speed_mbps:.2f} MB/s")
-
-                # 删除下载的文件
-                os.remove(output_file)
-                logging.info(f"Downloaded file '{output_file}' has been deleted.")
-                speed = average_speed_mbps
-                return ip,speed
\ No newline at end of file
+
+        if received == 0 or first_byte_at is None:
+            logging.error(f"Download from {ip} received no data")
+            return None
+
+        window_start_time, window_start_bytes = samples[0]
+        if end - first_byte_at > window and end > window_start_time:
+            speed_bytes = (received - window_start_bytes) / (end - window_start_time)
+        elif end > first_byte_at:
+            speed_bytes = received / (end - first_byte_at)
+        else:
+            # 只读到一块数据，没有首字节之后的时间跨度，按从发出请求算
+            speed_bytes = received / max(end - start, 1e-3)
+
+        stats = DownloadStats(
+            ip=ip,
+            bytes_received=received,
+            elapsed=round(end - start, 3),
+            ttfb_ms=round((first_byte_at - start) * 1000, 2),
+            speed=round(speed_bytes / 1024 / 1024, 2),
+        )
+        logging.info(f"Download via {ip}: {stats.bytes_received} bytes in {stats.elapsed:.2f}s, "
+                     f"TTFB {stats.ttfb_ms:.2f} ms, speed {stats.speed:.2f} MB/s")
+        return stats
+
+    @staticmethod
+    async def run(ip, download_url, port, timeout, target_bytes=None):
+        """
+        返回 (ip, speed MB/s)，失败返回 None。
+        port 保留只为兼容旧调用: 实际连接端口取自 download_url，与原来 curl --resolve 的行为一致。
+        """
+        stats = await CurlRunner.measure(ip, download_url, timeout, target_bytes=target_bytes)
+        if stats is None:
+            return None
+        return ip, stats.speed
@@ -0,0 +1,126 @@
+import asyncio
+import ipaddress
+import random
+import socket
+import sys
+from bisect import bisect_right
+from itertools import islice
+from typing import AsyncIterator, Iterable, Iterator, List, Tuple, TypeVar
+
+T = TypeVar('T')
+
+# IPv6 段过大时只随机抽取这么多个地址
+IPV6_SAMPLE_LIMIT = 500000
+
+
+def ip_range_bounds(start_ip: str, end_ip: str) -> Tuple[int, int, int]:
+    """返回 (起始整数, 结束整数, IP 版本)"""
+    start = ipaddress.ip_address(start_ip)
+    end = ipaddress.ip_address(end_ip)
+    return int(start), int(end), start.version
+
+
+def expanded_size(start_ip: str, end_ip: str, ipv6_limit: int = IPV6_SAMPLE_LIMIT) -> int:
+    """计算一个 IP 范围展开后会生成的地址数量（不真正展开）"""
+    start, end, version = ip_range_bounds(start_ip, end_ip)
+    total = max(end - start + 1, 0)
+    if version == 6 and total > ipv6_limit:
+        return ipv6_limit
+    return total
+
+
+def int_to_ip(ip_int: int, version: int) -> str:
+    if version == 4:
+        # inet_ntoa 比 ipaddress.IPv4Address 快一个数量级
+        return socket.inet_ntoa(ip_int.to_bytes(4, 'big'))
+    return str(ipaddress.IPv6Address(ip_int))
+
+
+def iter_ip_range(start_ip: str, end_ip: str, ipv6_limit: int = IPV6_SAMPLE_LIMIT) -> Iterator[Tuple[str, str]]:
+    """
+    惰性展开单个 IP 范围，逐个产出 (ip_address, ip_type)。
+    IPv6 段超过 ipv6_limit 时，从该段随机抽取 ipv6_limit 个地址。
+    """
+    start, end, version = ip_range_bounds(start_ip, end_ip)
+    ip_type = 'ipv4' if version == 4 else 'ipv6'
+
+    if version == 6 and end - start + 1 > ipv6_limit:
+        ints = (random.randint(start, end) for _ in range(ipv6_limit))
+    else:
+        ints = range(start, end + 1)
+
+    for ip_int in ints:
+        yield int_to_ip(ip_int, version), ip_type
+
+
+def iter_provider_ips(ip_ranges: Iterable, ipv6_limit: int = IPV6_SAMPLE_LIMIT) -> Iterator[Tuple[str, str, int]]:
+    """按顺序展开多个 IPRange，逐个产出 (ip_address, ip_type, provider_id)"""
+    for ip_range in ip_ranges:
+        provider_id = ip_range.provider_id
+        for ip_str, ip_type in iter_ip_range(ip_range.start_ip, ip_range.end_ip, ipv6_limit):
+            yield ip_str, ip_type, provider_id
+
+
+def batched(iterable: Iterable[T], batch_size: int) -> Iterator[List[T]]:
+    """把任意可迭代对象切成固定大小的批次，内存中只保留一个批次"""
+    if batch_size <= 0:
+        raise ValueError("batch_size must be positive")
+    iterator = iter(iterable)
+    while True:
+        batch = list(islice(iterator, batch_size))
+        if not batch:
+            return
+        yield batch
+
+
+async def batched_in_thread(iterable: Iterable[T], batch_size: int) -> AsyncIterator[List[T]]:
+    """
+    同 batched，但每个批次在线程里生成: 展开地址是 CPU 操作，放在事件循环里会卡住其他协程
+    (例如持有事务时等待的心跳和进度发布)。
+    """
+    batches = batched(iterable, batch_size)
+    while True:
+        batch = await asyncio.to_thread(next, batches, None)
+        if batch is None:
+            return
+        yield batch
+
+
+def sample_ips_from_ranges(ip_ranges: Iterable, count: int, rng: random.Random = None) -> List[str]:
+    """
+    不展开范围，直接从多个 IP 范围中均匀随机抽取最多 count 个不重复的地址。
+    重叠的范围先合并(例如单个 IP 又落在某个 CIDR 里)，每个地址只算一次，
+    再按合并后区间的大小加权，代价为 O(count * log(范围数))，与地址总数无关。
+    """
+    # range_diff 在模块级别引用了本模块，这里延迟导入
+    from utils.range_diff import merge_intervals, to_intervals
+
+    rng = rng or random
+    starts = []
+    versions = []
+    cumulative = []
+    total = 0
+    for start, end, version in merge_intervals(to_intervals(ip_ranges)):
+        starts.append(start)
+        versions.append(version)
+        total += end - start + 1
+        cumulative.append(total)
+
+    if total == 0 or count <= 0:
+        return []
+    count = min(count, total)
+
+    def offset_to_ip(offset: int) -> str:
+        i = bisect_right(cumulative, offset)
+        previous = cumulative[i - 1] if i else 0
+        return int_to_ip(starts[i] + offset - previous, versions[i])
+
+    # 区间互不重叠，不同的偏移就是不同的地址
+    # range 对象的长度不能超过 sys.maxsize，IPv6 大段只能用拒绝采样
+    if total <= sys.maxsize:
+        offsets = rng.sample(range(total), count)
+    else:
+        offsets = set()
+        while len(offsets) < count:
+            offsets.add(rng.randrange(total))
+    return [offset_to_ip(offset) for offset in offsets]
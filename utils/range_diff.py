@@ -0,0 +1,101 @@
+from typing import Dict, Iterable, List, Tuple
+
+from utils.ip_expander import int_to_ip, ip_range_bounds
+
+# (起始整数, 结束整数, IP 版本)，两端都包含
+Interval = Tuple[int, int, int]
+
+
+def to_intervals(ip_ranges: Iterable) -> List[Interval]:
+    """把 IPRange (或带 start_ip/end_ip 的字典) 转成区间"""
+    intervals = []
+    for ip_range in ip_ranges:
+        if isinstance(ip_range, dict):
+            start_ip, end_ip = ip_range['start_ip'], ip_range['end_ip']
+        else:
+            start_ip, end_ip = ip_range.start_ip, ip_range.end_ip
+        start, end, version = ip_range_bounds(start_ip, end_ip)
+        if start <= end:
+            intervals.append((start, end, version))
+    return intervals
+
+
+def merge_intervals(intervals: Iterable[Interval]) -> List[Interval]:
+    """按版本、起点排序后合并重叠和相邻的区间"""
+    merged: List[Interval] = []
+    for start, end, version in sorted(intervals, key=lambda interval: (interval[2], interval[0])):
+        if merged and merged[-1][2] == version and start <= merged[-1][1] + 1:
+            if end > merged[-1][1]:
+                merged[-1] = (merged[-1][0], end, version)
+        else:
+            merged.append((start, end, version))
+    return merged
+
+
+def subtract_intervals(a: Iterable[Interval], b: Iterable[Interval]) -> List[Interval]:
+    """a 中不被 b 覆盖的部分，一次线性扫描，代价与区间数有关，与地址数无关"""
+    a = merge_intervals(a)
+    b = merge_intervals(b)
+    result: List[Interval] = []
+    j = 0
+    for start, end, version in a:
+        # 跳过完全在当前区间之前的 b
+        while j < len(b) and (b[j][2], b[j][1]) < (version, start):
+            j += 1
+        k = j
+        cursor = start
+        while k < len(b) and b[k][2] == version and b[k][0] <= end:
+            if b[k][0] > cursor:
+                result.append((cursor, b[k][0] - 1, version))
+            cursor = max(cursor, b[k][1] + 1)
+            k += 1
+        if cursor <= end:
+            result.append((cursor, end, version))
+    return result
+
+
+def diff_intervals(old: Iterable[Interval], new: Iterable[Interval]) -> Tuple[List[Interval], List[Interval]]:
+    """返回 (新增的地址区间, 移除的地址区间)"""
+    old = merge_intervals(old)
+    new = merge_intervals(new)
+    return subtract_intervals(new, old), subtract_intervals(old, new)
+
+
+def diff_range_rows(old_ranges: Iterable, new_rows: List[Dict]) -> Tuple[List[int], List[Dict]]:
+    """
+    比较 ip_ranges 的行: 按 (起始, 结束) 匹配，没变的行保持不动。
+    :return: (要删除的旧行 id, 要插入的新行)
+    """
+    def key(start_ip: str, end_ip: str) -> Interval:
+        return ip_range_bounds(start_ip, end_ip)
+
+    old_by_key: Dict[Interval, int] = {}
+    # 同一个范围在旧表里重复出现时，多出来的行直接删掉
+    to_delete = []
+    for ip_range in old_ranges:
+        row_key = key(ip_range.start_ip, ip_range.end_ip)
+        if row_key in old_by_key:
+            to_delete.append(ip_range.id)
+        else:
+            old_by_key[row_key] = ip_range.id
+
+    to_insert = []
+    kept = set()
+    for row in new_rows:
+        row_key = key(row['start_ip'], row['end_ip'])
+        if row_key in old_by_key:
+            kept.add(row_key)
+        elif row_key not in kept:
+            kept.add(row_key)
+            to_insert.append(row)
+    to_delete.extend(range_id for row_key, range_id in old_by_key.items() if row_key not in kept)
+    return to_delete, to_insert
+
+
+def interval_bounds(intervals: Iterable[Interval]) -> Tuple[List[str], List[str]]:
+    """区间转成 (起始 IP 列表, 结束 IP 列表)，用作 SQL 的 unnest 参数"""
+    starts, ends = [], []
+    for start, end, version in intervals:
+        starts.append(int_to_ip(start, version))
+        ends.append(int_to_ip(end, version))
+    return starts, ends
@@ -1,11 +1,75 @@
 import asyncio
 from datetime import datetime
+import ipaddress
+import logging
 import math
+import os
 import socket
+import struct
+import time
+
+logger = logging.getLogger(__name__)
+
+# 同时在测的主机数 = 并发探测数 * HOST_WINDOW_FACTOR。
+# 主机在两次探测之间 sleep 时不占用探测名额，窗口放大后这段时间可以被其他主机的探测填满。
+HOST_WINDOW_FACTOR = 4
+
+# 探测引擎: raw = 非阻塞 socket + loop.sock_connect，stream = asyncio.open_connection
+TCPING_ENGINE = os.getenv('TCPING_ENGINE', 'raw')
+
+# l_onoff=1, l_linger=0: close 时直接发 RST，不进入 TIME_WAIT
+_LINGER_RESET = struct.pack('ii', 1, 0)
+
 
 class TcpingRunner:
     @staticmethod
     async def tcp_ping(host, port, timeout=1):
+        if TCPING_ENGINE == 'stream':
+            return await TcpingRunner.stream_tcp_ping(host, port, timeout)
+        return await TcpingRunner.raw_tcp_ping(host, port, timeout)
+
+    @staticmethod
+    async def _resolve(host, port):
+        """IP 字面量直接构造地址，避免每次探测都走 getaddrinfo"""
+        try:
+            ip = ipaddress.ip_address(host)
+        except ValueError:
+            loop = asyncio.get_running_loop()
+            family, _, _, _, sockaddr = (await loop.getaddrinfo(host, port, type=socket.SOCK_STREAM))[0]
+            return family, sockaddr
+        if ip.version == 4:
+            return socket.AF_INET, (host, port)
+        return socket.AF_INET6, (host, port, 0, 0)
+
+    @staticmethod
+    async def raw_tcp_ping(host, port, timeout=1):
+        """
+        只做一次 TCP 握手: 非阻塞 socket + loop.sock_connect，不创建 StreamReader/StreamWriter。
+        用 perf_counter_ns 计时，以 SO_LINGER 0 关闭连接，避免大量探测堆积 TIME_WAIT。
+        """
+        try:
+            family, sockaddr = await TcpingRunner._resolve(host, port)
+        except Exception as e:
+            return False, str(e)
+
+        loop = asyncio.get_running_loop()
+        sock = socket.socket(family, socket.SOCK_STREAM)
+        try:
+            sock.setblocking(False)
+            sock.setsockopt(socket.SOL_SOCKET, socket.SO_LINGER, _LINGER_RESET)
+            start_ns = time.perf_counter_ns()
+            await asyncio.wait_for(loop.sock_connect(sock, sockaddr), timeout=timeout)
+            response_time = (time.perf_counter_ns() - start_ns) / 1_000_000
+            return True, response_time
+        except asyncio.TimeoutError:
+            return False, 'Timeout'
+        except Exception as e:
+            return False, str(e)
+        finally:
+            sock.close()
+
+    @staticmethod
+    async def stream_tcp_ping(host, port, timeout=1):
         # 开始计时
         start_time = datetime.now()
         try:
@@ -54,17 +118,49 @@ class TcpingRunner:
             print(f"Standard Deviation: {std_deviation:.4f} ms")
 
     @staticmethod
-    async def run_with_stats(host, port, count=10, interval=1, timeout=1):
+    async def run_with_stats(host, port, count=10, interval=1, timeout=1, semaphore=None,
+                             screen_timeout=None, max_avg_latency=None, max_packet_loss=None, min_probes=3):
+        """
+        对 host 做最多 count 次探测并返回统计结果。
+        传入 semaphore 时只在单次探测期间占用名额，探测间隔的 sleep 不占用。
+
+        提前淘汰:
+        - screen_timeout: 第一次探测作为筛选，用这个较短的超时，失败直接返回 None
+        - max_packet_loss: 失败次数已经让最终丢包率必然超标时停止
+        - max_avg_latency: 至少 min_probes 次成功后平均延迟仍超标时停止
+        被提前淘汰的主机返回已完成探测的统计值，这些值本身就不满足阈值。
+        """
         results = []
+        success_times = []
         for i in range(count):
-            result, response_time = await TcpingRunner.tcp_ping(host, port, timeout)
+            probe_timeout = screen_timeout if (i == 0 and screen_timeout is not None) else timeout
+            if semaphore is None:
+                result, response_time = await TcpingRunner.tcp_ping(host, port, probe_timeout)
+            else:
+                async with semaphore:
+                    result, response_time = await TcpingRunner.tcp_ping(host, port, probe_timeout)
             if result:
-                print(f"Connection to {host}:{port} successful. Response time: {response_time:.2f} ms")
+                logger.debug(f"Connection to {host}:{port} successful. Response time: {response_time:.2f} ms")
+                success_times.append(response_time)
             else:
-                print(f"Connection to {host}:{port} failed. Reason: {response_time}")
+                logger.debug(f"Connection to {host}:{port} failed. Reason: {response_time}")
             results.append((result, response_time))
+
+            if i == 0 and not result and screen_timeout is not None:
+                logger.debug(f"{host}:{port} failed screening probe, skipping")
+                return None
+            failures = len(results) - len(success_times)
+            if max_packet_loss is not None and failures / count > max_packet_loss:
+                logger.debug(f"{host}:{port} rejected early: {failures} failures out of {count} probes")
+                break
+            if (max_avg_latency is not None and len(success_times) >= min_probes
+                    and sum(success_times) / len(success_times) > max_avg_latency):
+                logger.debug(f"{host}:{port} rejected early: avg latency above {max_avg_latency} ms")
+                break
+
             if i < count - 1:
                 await asyncio.sleep(interval)
+        count = len(results)
         
         # 计算统计信息
         success_count = sum(1 for r, _ in results if r)
@@ -76,10 +172,8 @@ class TcpingRunner:
         
         avg_latency, std_deviation = TcpingRunner.calculate_stats(successful_response_times)
         packet_loss = (count - success_count) / count 
-        print(f"\n--- {host}:{port} tcping statistics ---")
-        print(f"{count} packets transmitted, {success_count} packets received, {packet_loss:.2f}% packet loss")
-        print(f"round-trip min/avg/max = {min(successful_response_times):.2f}/{avg_latency:.2f}/{max(successful_response_times):.2f} ms")
-        print(f"Standard Deviation: {std_deviation:.4f} ms")
+        logger.debug(f"{host}:{port} {count} packets transmitted, {success_count} packets received, "
+                     f"{packet_loss:.2f}% packet loss, avg {avg_latency:.2f} ms, stddev {std_deviation:.4f} ms")
 
         # 返回结果
         return (
@@ -89,6 +183,45 @@ class TcpingRunner:
             round(packet_loss, 2)
         )
 
+    @staticmethod
+    async def sweep(hosts, port, concurrency=20, count=10, interval=1, timeout=1, **probe_options):
+        """
+        滑动窗口批量测试: 始终保持最多 concurrency 个探测在进行，
+        每完成一个主机就按完成顺序产出 (host, stats)，不会像固定批次那样等最慢的主机。
+        probe_options 原样传给 run_with_stats (screen_timeout / max_avg_latency 等)。
+
+        调用方提前退出时应使用 contextlib.aclosing 包裹，以便取消剩余的探测。
+        """
+        probe_slots = asyncio.BoundedSemaphore(concurrency)
+        host_iter = iter(hosts)
+        results = asyncio.Queue()
+
+        async def worker():
+            try:
+                # 所有 worker 共享同一个迭代器，取到下一个主机之间没有 await，不会重复
+                for host in host_iter:
+                    stats = await TcpingRunner.run_with_stats(
+                        host, port, count=count, interval=interval, timeout=timeout, semaphore=probe_slots,
+                        **probe_options
+                    )
+                    results.put_nowait((host, stats))
+            finally:
+                results.put_nowait(None)
+
+        workers = [asyncio.create_task(worker()) for _ in range(concurrency * HOST_WINDOW_FACTOR)]
+        remaining = len(workers)
+        try:
+            while remaining:
+                item = await results.get()
+                if item is None:
+                    remaining -= 1
+                    continue
+                yield item
+        finally:
+            for task in workers:
+                task.cancel()
+            await asyncio.gather(*workers, return_exceptions=True)
+
     @staticmethod
     def calculate_stats(response_times):
         n = len(response_times)